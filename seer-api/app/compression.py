@@ -0,0 +1,229 @@
+"""
+Response compression middleware for API responses.
+
+Compresses JSON and text responses above a size threshold with Brotli (when the
+optional `brotli` package is installed) or gzip, depending on what the client
+accepts. Streaming responses are compressed chunk by chunk and flushed so
+clients still receive each chunk as soon as it is produced.
+
+Author: Runkai Zhang
+"""
+
+import zlib
+from functools import lru_cache
+from types import ModuleType
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+@lru_cache()
+def _brotli() -> Optional[ModuleType]:
+    """The brotli module, imported on first use (None if not installed)."""
+    try:
+        import brotli
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return brotli
+
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/",
+    "image/svg+xml",
+)
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """
+    Parse an Accept-Encoding header into `{encoding: q}`.
+
+    Args:
+        accept_encoding: Raw header value
+
+    Returns:
+        Mapping of lower-case encoding names to their quality values
+    """
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best encoding we support, preferring Brotli over gzip."""
+    encodings = accepted_encodings(accept_encoding)
+    candidates = ["br", "gzip"] if _brotli() is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = encodings.get(name, encodings.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class _Encoder:
+    """Incremental compressor with a common interface for gzip and Brotli."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = _brotli().Compressor(quality=brotli_quality)
+        else:
+            # wbits=31 produces gzip framing
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            chunk = self._compressor.process(data)
+            if flush:
+                chunk += self._compressor.flush()
+            return chunk
+        chunk = self._compressor.compress(data)
+        if flush:
+            chunk += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses under `path_prefix` that are large enough to benefit.
+
+    Responses that already carry a Content-Encoding, are not a compressible
+    type, or are smaller than `minimum_size` are passed through untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        path_prefix: str = "/api",
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.path_prefix = path_prefix
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(
+            send,
+            encoding,
+            self.minimum_size,
+            self.gzip_level,
+            self.brotli_quality,
+        )
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Per-response state machine wrapping the ASGI `send` callable."""
+
+    def __init__(
+        self,
+        send: Send,
+        encoding: str,
+        minimum_size: int,
+        gzip_level: int,
+        brotli_quality: int,
+    ):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._start: Optional[Message] = None
+        self._encoder: Optional[_Encoder] = None
+        self._passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the headers until we know whether the body will be compressed
+            self._start = message
+            self._passthrough = not self._is_compressible(
+                Headers(raw=message["headers"])
+            )
+            return
+
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        if self._passthrough:
+            await self._flush_start()
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._encoder is None:
+            if not more_body and len(body) < self.minimum_size:
+                self._passthrough = True
+                await self._flush_start()
+                await self._send(message)
+                return
+
+            self._encoder = _Encoder(
+                self.encoding, self.gzip_level, self.brotli_quality
+            )
+            headers = MutableHeaders(raw=self._start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                await self._flush_start()
+            else:
+                compressed = self._encoder.compress(body) + self._encoder.finish()
+                headers["Content-Length"] = str(len(compressed))
+                await self._flush_start()
+                await self._send({"type": "http.response.body", "body": compressed})
+                return
+
+        if more_body:
+            chunk = self._encoder.compress(body, flush=True)
+        else:
+            chunk = self._encoder.compress(body) + self._encoder.finish()
+        await self._send(
+            {"type": "http.response.body", "body": chunk, "more_body": more_body}
+        )
+
+    def _is_compressible(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return any(content_type.startswith(t) for t in COMPRESSIBLE_TYPES)
+
+    async def _flush_start(self) -> None:
+        if self._start is not None:
+            await self._send(self._start)
+            self._start = None
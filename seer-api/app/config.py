@@ -5,6 +5,7 @@ Author: Runkai Zhang
 """
 
 from functools import lru_cache
+from typing import Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -31,6 +32,154 @@ class Settings(BaseSettings):
     # OpenAI Settings
     openai_model: str = "gpt-5.1"
     max_candidates: int = 10
+    openai_timeout_seconds: float = 60.0
+
+    # Model cascade: the fast model answers first and the full model is only
+    # used when its answer is unusable or below the confidence threshold.
+    # Set OPENAI_FAST_MODEL to an empty string to always use the full model.
+    openai_fast_model: Optional[str] = "gpt-5-mini"
+    openai_fast_timeout_seconds: float = 8.0
+    cascade_confidence_threshold: float = 0.7
+
+    # Responses smaller than this are sent uncompressed
+    compression_minimum_size: int = 1024
+
+    # Startup warm-up (see /api/ready)
+    warmup_enabled: bool = True
+    warmup_timeout_seconds: float = 20.0
+
+    # Additional MAL client IDs (JSON array). Requests are balanced over all
+    # IDs, each paced to its own budget; IDs answered with 429/403 are benched
+    # for mal_key_bench_seconds (doubling on repeats). With no extra IDs the
+    # single ID is not paced, so the per-key budget only applies to pools.
+    mal_extra_client_ids: List[str] = []
+    mal_key_requests_per_second: float = 10.0
+    mal_key_burst: float = 30.0
+    mal_key_bench_seconds: float = 30.0
+
+    # MyAnimeList response cache
+    mal_cache_max_entries: int = 4096
+    mal_cache_ttl_seconds: int = 1800
+
+    # Cost-based throttling of /api/recommend (see app/services/cost_limiter.py).
+    # One unit is one prompt token; completion tokens, MAL calls and history
+    # items are weighted. The global budget should match the OpenAI token
+    # rate limit; below the degrade threshold only the fast model is used.
+    cost_limit_enabled: bool = True
+    cost_client_capacity: float = 50000
+    cost_client_refill_per_hour: float = 250000
+    cost_global_capacity: float = 200000
+    cost_global_refill_per_minute: float = 200000
+    cost_degrade_threshold: float = 0.25
+    cost_completion_weight: float = 4.0
+    cost_mal_call: float = 100.0
+    cost_history_item: float = 1.0
+
+    # Duplicate /api/recommend requests (see app/services/idempotency.py):
+    # results are replayed for ttl_seconds per Idempotency-Key, and for
+    # body_ttl_seconds when a request is only identified by its body hash
+    idempotency_enabled: bool = True
+    idempotency_max_entries: int = 1024
+    idempotency_ttl_seconds: float = 600.0
+    idempotency_body_ttl_seconds: float = 30.0
+
+    # Hedged MAL detail fetches: a duplicate request is sent when a call is
+    # slower than the given latency percentile, limited to budget_ratio extra
+    # requests per request
+    mal_hedge_enabled: bool = True
+    mal_hedge_percentile: float = 0.95
+    mal_hedge_initial_delay_ms: float = 500.0
+    mal_hedge_min_delay_ms: float = 50.0
+    mal_hedge_max_delay_ms: float = 2000.0
+    mal_hedge_budget_ratio: float = 0.05
+
+    # Familiar candidates: proceed once this many detail fetches have arrived,
+    # waiting at most the grace period for the rest
+    candidate_details_quorum: int = 3
+    candidate_quorum_grace_ms: float = 150.0
+
+    # Exploratory candidates per MAL list and mode (see
+    # app/services/candidate_sources.py for the available sources)
+    candidate_source_quotas: Dict[str, Dict[str, int]] = {
+        "explore": {
+            "all": 2,
+            "airing": 1,
+            "favorite": 1,
+            "movie": 1,
+            "ova": 1,
+            "season": 1,
+            "last_season": 1,
+        },
+        "similar": {"all": 3, "bypopularity": 3, "favorite": 2},
+    }
+    # Uncached list pages beyond each source's first page, per request
+    candidate_source_max_fetches: int = 4
+
+    # Bulk title resolution (/api/resolve): titles per request, and MAL
+    # searches in flight across all requests and per request (16 searches of
+    # ~0.4 s each resolve a cold 500-title import in about 13 s). Searches are
+    # charged to a per-client search budget of their own, separate from the
+    # /api/recommend cost budget: resolve_search_burst searches, refilled at
+    # resolve_searches_per_hour. Titles the title index knows are free.
+    resolve_max_titles: int = 500
+    resolve_concurrency: int = 32
+    resolve_concurrency_per_request: int = 16
+    resolve_search_burst: int = 1000
+    resolve_searches_per_hour: float = 2000
+
+    # Titles learned from every MAL response, for exact local title matches
+    title_index_max_entries: int = 50000
+    title_index_ttl_seconds: float = 86400
+
+    # Poster image proxy (/api/image/{mal_id}): resized posters are kept in a
+    # disk cache of at most image_cache_max_mb. IMAGE_UPSTREAM_BASE_URL
+    # replaces the MAL CDN host, e.g. with a local image server for testing.
+    # Each client may start image_renders_per_minute new renders; anime
+    # without a poster are remembered for image_missing_ttl_seconds.
+    image_cache_dir: str = "image_cache"
+    image_cache_max_mb: float = 256.0
+    image_cache_max_age_seconds: int = 604800
+    image_quality: int = 80
+    image_upstream_base_url: Optional[str] = None
+    image_rate_limit: str = "600/minute"
+    image_renders_per_minute: float = 60.0
+    image_missing_ttl_seconds: float = 3600.0
+
+    # Co-recommendation graph built from MAL details responses, ranked with
+    # personalized PageRank for familiar candidates. CO_GRAPH_PATH (.npz)
+    # keeps the graph across restarts.
+    co_graph_enabled: bool = True
+    co_graph_max_nodes: int = 200000
+    co_graph_damping: float = 0.85
+    co_graph_iterations: int = 20
+    co_graph_path: Optional[str] = None
+
+    # Speculative prefetch of the next recommendation, one per plausible
+    # rating of the current one; prefetch_rankings=False only warms the MAL
+    # cache for the next candidate pools and skips the speculative LLM calls
+    prefetch_enabled: bool = True
+    prefetch_max_concurrent: int = 2
+    prefetch_max_foreground: int = 4
+    prefetch_rankings: bool = True
+    prefetch_max_results: int = 2000
+    prefetch_result_ttl_seconds: float = 600.0
+
+    # History delta protocol (see app/services/history_store.py): at most
+    # max_entries histories holding max_items history items in total
+    history_cache_max_entries: int = 2048
+    history_cache_max_items: int = 200000
+    history_cache_ttl_seconds: int = 3600
+
+    # Preference profile tokens (random per process when unset)
+    profile_token_secret: Optional[str] = None
+
+    # Diagnostics: Server-Timing stage breakdown on API responses, and the
+    # admin-only sampling profiler and stats (/api/admin/profiling and
+    # /api/admin/stats, off without a token)
+    server_timing_enabled: bool = True
+    admin_token: Optional[str] = None
+    profile_output_dir: str = "profiles"
+    profile_interval_ms: float = 5.0
 
     class Config:
         env_file = ".env"
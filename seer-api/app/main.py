@@ -4,20 +4,57 @@ Main FastAPI application entry point.
 Author: Runkai Zhang
 """
 
-import os
+# Imported first so the startup report covers every other import
+from app.startup import startup_report, warm_up
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
+from app.compression import CompressionMiddleware
 from app.config import get_settings
 from app.limiter import limiter
-from app.routers import recommendations
+from app.profiling import ProfilingMiddleware
+from app.routers import admin, images, recommendations
+from app.timing import ServerTimingMiddleware
 
+startup_report.mark("imports")
+logger = logging.getLogger(__name__)
 settings = get_settings()
+startup_report.mark("settings")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start warming caches in the background so the port opens immediately."""
+    warmup_task = None
+    if settings.warmup_enabled:
+        warmup_task = asyncio.create_task(warm_up(settings.warmup_timeout_seconds))
+    else:
+        startup_report.warm = True
+    startup_report.mark("lifespan_start")
+
+    yield
+
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+
+    # Imported here so numpy stays out of the import phase
+    from app.services.co_graph import get_co_graph
+
+    graph = get_co_graph()
+    # An empty graph (e.g. warm-up never ran) must not overwrite a saved one
+    if graph is not None and len(graph) and settings.co_graph_path:
+        try:
+            graph.save(settings.co_graph_path)
+        except OSError as e:
+            logger.warning("Could not save the co-recommendation graph: %s", e)
 
 
 # Create FastAPI application
@@ -28,6 +65,7 @@ app = FastAPI(
         "No accounts needed - manage your recommendations with a local JSON file!"
     ),
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # Add rate limiter to app state
@@ -41,11 +79,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"],
+    expose_headers=[
+        "X-RateLimit-Limit",
+        "X-RateLimit-Remaining",
+        "X-RateLimit-Reset",
+        "Server-Timing",
+        "Idempotent-Replayed",
+    ],
 )
 
+# Compress API responses (static assets are served precompressed)
+app.add_middleware(
+    CompressionMiddleware, minimum_size=settings.compression_minimum_size
+)
+
+# Per-stage timings (Server-Timing header) and sampled profiling. Added last
+# so they wrap compression and see the full request.
+if settings.server_timing_enabled:
+    app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(recommendations.router)
+app.include_router(images.router)
+app.include_router(admin.router)
 
 
 @app.get("/api", tags=["root"])
@@ -57,6 +114,7 @@ async def root():
         "description": "No accounts needed - manage your recommendations with a local JSON file!",
         "docs": "/docs",
         "health": "/api/health",
+        "ready": "/api/ready",
         "main_endpoint": "/api/recommend",
     }
 
@@ -66,11 +124,17 @@ async def root():
 frontend_build_dir = Path(__file__).parent.parent.parent / "seer" / "build"
 
 if frontend_build_dir.exists():
-    # Mount static files for assets
+    from app.static import PrecompressedStaticFiles
+
+    # Mount static files for assets, preferring build-time .br/.gz variants
     app.mount(
-        "/", StaticFiles(directory=str(frontend_build_dir), html=True), name="frontend"
+        "/",
+        PrecompressedStaticFiles(directory=str(frontend_build_dir), html=True),
+        name="frontend",
     )
 
+startup_report.mark("app")
+
 
 if __name__ == "__main__":
     import uvicorn
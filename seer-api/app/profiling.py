@@ -0,0 +1,166 @@
+"""
+On-demand sampling profiler for a fraction of API requests.
+
+When enabled through the admin endpoint, `ProfilingMiddleware` picks requests
+at the configured sample rate and runs a `SamplingProfiler` thread for the
+duration of each one. The thread periodically captures the event loop thread's
+Python stack and writes the result in collapsed-stack format (one
+`frame;frame;frame count` line per unique stack), which flamegraph.pl,
+speedscope and inferno read directly.
+
+All request handling shares the event loop thread, so a profile shows
+everything the loop did while the sampled request was in flight. Only one
+request is profiled at a time. When profiling is disabled the middleware costs
+a single attribute check per request.
+
+Author: Runkai Zhang
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval from a helper thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="seer-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Return samples in collapsed-stack format."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+
+@dataclass
+class ProfilingState:
+    """Runtime profiling switch, changed through the admin endpoint."""
+
+    output_dir: Path
+    sample_rate: float = 0.0
+    interval_ms: float = 5.0
+    active: bool = False
+    profiles_written: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0.0
+
+    def recent_profiles(self, limit: int = 20) -> List[str]:
+        """Names of the most recent profile files."""
+        if not self.output_dir.exists():
+            return []
+        files = sorted(
+            self.output_dir.glob("*.folded"),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+        return [p.name for p in files[:limit]]
+
+
+@lru_cache()
+def get_profiling_state() -> ProfilingState:
+    """Get the process-wide profiling state."""
+    settings = get_settings()
+    return ProfilingState(
+        output_dir=Path(settings.profile_output_dir),
+        interval_ms=settings.profile_interval_ms,
+    )
+
+
+class ProfilingMiddleware:
+    """Attach a sampling profiler to a random fraction of HTTP requests."""
+
+    def __init__(self, app: ASGIApp, path_prefix: str = "/api"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        state = get_profiling_state()
+        if (
+            not state.enabled
+            or state.active
+            or scope["type"] != "http"
+            or not scope["path"].startswith(self.path_prefix)
+            or random.random() >= state.sample_rate
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        state.active = True
+        profiler = SamplingProfiler(
+            threading.get_ident(), interval=state.interval_ms / 1000
+        )
+        started_at = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            state.active = False
+            self._write(
+                state, scope["path"], profiler, time.perf_counter() - started_at
+            )
+
+    def _write(
+        self,
+        state: ProfilingState,
+        path: str,
+        profiler: SamplingProfiler,
+        duration: float,
+    ) -> Optional[Path]:
+        if not profiler.samples:
+            return None
+        try:
+            state.output_dir.mkdir(parents=True, exist_ok=True)
+            slug = path.strip("/").replace("/", "_") or "root"
+            target = state.output_dir / (
+                f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{slug}.folded"
+            )
+            target.write_text(profiler.collapsed())
+        except OSError as e:
+            logger.warning("Could not write profile: %s", e)
+            return None
+        state.profiles_written += 1
+        logger.info(
+            "Wrote profile %s (%d samples)", target, sum(profiler.samples.values())
+        )
+        return target
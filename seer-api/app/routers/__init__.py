@@ -1,6 +1,6 @@
 """
 API routers package.
 """
-from app.routers import recommendations
+from app.routers import admin, images, recommendations
 
-__all__ = ["recommendations"]
+__all__ = ["admin", "images", "recommendations"]
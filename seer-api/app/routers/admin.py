@@ -0,0 +1,106 @@
+"""
+Operator-only diagnostics endpoints.
+
+Every endpoint requires the `X-Admin-Token` header to match the `ADMIN_TOKEN`
+setting. Without a configured token the endpoints respond 404, so they are
+invisible on deployments that don't opt in.
+
+Author: Runkai Zhang
+"""
+
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.config import get_settings
+from app.profiling import ProfilingState, get_profiling_state
+from app.services import get_mal_client
+from app.services.cost_limiter import get_cost_limiter
+from app.services.history_store import get_history_store
+from app.services.idempotency import get_idempotency_store
+from app.services.image_proxy import get_image_proxy
+from app.services.prefetch import get_prefetcher
+from app.services.title_resolver import get_title_resolver
+from app.startup import startup_report
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], include_in_schema=False)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Dependency that rejects requests without the admin token."""
+    expected = get_settings().admin_token
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token"
+        )
+
+
+class ProfilingUpdate(BaseModel):
+    """Request body for changing the profiler settings."""
+
+    sample_rate: float = Field(
+        ..., ge=0.0, le=1.0, description="Fraction of API requests to profile (0 = off)"
+    )
+    interval_ms: Optional[float] = Field(
+        None, ge=1.0, le=1000.0, description="Milliseconds between stack samples"
+    )
+
+
+def _profiling_status(state: ProfilingState) -> dict:
+    return {
+        "enabled": state.enabled,
+        "sample_rate": state.sample_rate,
+        "interval_ms": state.interval_ms,
+        "active": state.active,
+        "profiles_written": state.profiles_written,
+        "output_dir": str(state.output_dir),
+        "recent_profiles": state.recent_profiles(),
+    }
+
+
+@router.get("/stats", dependencies=[Depends(require_admin)])
+async def get_stats():
+    """Report startup timings and the state of every cache, pool and limiter."""
+    mal_client = get_mal_client()
+    idempotency = get_idempotency_store()
+    return {
+        "uptime_seconds": startup_report.uptime_seconds(),
+        "startup": startup_report.as_dict(),
+        "caches": {
+            "mal": mal_client.cache.stats(),
+            "history": get_history_store().stats(),
+        },
+        "prefetch": get_prefetcher().stats(),
+        "mal_keys": mal_client.key_pool.stats(),
+        "hedging": mal_client.hedger.stats() if mal_client.hedger else None,
+        "co_graph": (
+            mal_client.graph.stats() if mal_client.graph is not None else None
+        ),
+        "cost_limiter": get_cost_limiter().stats(),
+        "idempotency": idempotency.stats() if idempotency is not None else None,
+        # Not created just for this: it sets up the on-disk image cache
+        "images": (
+            get_image_proxy().stats() if get_image_proxy.cache_info().currsize else None
+        ),
+        "resolver": get_title_resolver().stats(),
+    }
+
+
+@router.get("/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling():
+    """Report the profiler settings and the most recent profile files."""
+    return _profiling_status(get_profiling_state())
+
+
+@router.post("/profiling", dependencies=[Depends(require_admin)])
+async def update_profiling(update: ProfilingUpdate):
+    """Turn the sampling profiler on or off, or change its rate."""
+    state = get_profiling_state()
+    state.sample_rate = update.sample_rate
+    if update.interval_ms is not None:
+        state.interval_ms = update.interval_ms
+    return _profiling_status(state)
@@ -0,0 +1,117 @@
+"""
+Poster image proxy endpoint.
+
+Author: Runkai Zhang
+"""
+
+import hashlib
+import logging
+import os
+from email.utils import formatdate
+from typing import Dict, Optional
+
+import httpx
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response
+from slowapi.util import get_remote_address
+
+from app.config import get_settings
+from app.limiter import limiter
+from app.services.cost_limiter import CostLimitExceeded, retry_after_header
+from app.services.image_proxy import (
+    THUMBNAIL_WIDTHS,
+    ImageNotFound,
+    ImageProxy,
+    ImageUpstreamError,
+    choose_format,
+    get_image_proxy,
+    snap_width,
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["images"])
+
+
+def _file_headers(stat_result: os.stat_result) -> Dict[str, str]:
+    """ETag and Last-Modified of a cache file, computed as FileResponse does."""
+    etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return {
+        "ETag": f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header covers the given ETag."""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+@router.get(
+    "/image/{mal_id}",
+    summary="Anime poster thumbnail",
+    description=(
+        "Serve an anime's poster resized to the requested width "
+        f"(rounded up to one of {', '.join(map(str, THUMBNAIL_WIDTHS))} pixels), "
+        "as WebP when the client accepts it and JPEG otherwise. Responses are "
+        "cached on disk and carry long-lived cache headers and an ETag. Each "
+        "client may only trigger a limited number of new renders per minute."
+    ),
+    response_class=Response,
+    responses={
+        200: {"content": {"image/webp": {}, "image/jpeg": {}}},
+        304: {"description": "The client's cached copy is current"},
+        404: {"description": "Anime not found or without a poster"},
+        429: {"description": "Rate limit exceeded - please try again later"},
+        502: {"description": "MyAnimeList or its image CDN failed"},
+    },
+)
+@limiter.limit(get_settings().image_rate_limit)
+async def get_image(
+    mal_id: int,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=2000, description="Desired width in px"),
+    proxy: ImageProxy = Depends(get_image_proxy),
+):
+    """Return a cached, resized poster for an anime."""
+    fmt = choose_format(request.headers.get("accept", ""))
+    try:
+        image = await proxy.thumbnail(
+            mal_id, snap_width(w), fmt, client_key=get_remote_address(request)
+        )
+    except ImageNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except CostLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+    except (httpx.HTTPError, ImageUpstreamError) as e:
+        logger.warning("Poster fetch for %s failed: %s", mal_id, e)
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY, detail="Failed to fetch poster"
+        )
+
+    response = Response(
+        image.data,
+        media_type=image.media_type,
+        headers=_file_headers(image.stat_result),
+    )
+    response.headers["Cache-Control"] = (
+        f"public, max-age={get_settings().image_cache_max_age_seconds}"
+    )
+    # The format depends on the Accept header
+    response.headers["Vary"] = "Accept"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, response.headers["etag"]):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={
+                name: response.headers[name]
+                for name in ("cache-control", "etag", "vary")
+            },
+        )
+    return response
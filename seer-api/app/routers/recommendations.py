@@ -4,10 +4,24 @@ Stateless REST API endpoints for anime recommendations.
 Author: Runkai Zhang
 """
 
+import json
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from slowapi.util import get_remote_address
 
+from app.config import get_settings
 from app.limiter import limiter
 
 logger = logging.getLogger(__name__)
@@ -15,10 +29,35 @@ from app.schemas import (
     ErrorResponse,
     RecommendRequest,
     RecommendResponse,
+    ResolveRequest,
 )
 from app.services import RecommendationEngine, get_mal_client, get_openai_client
+from app.services.cost_limiter import (
+    CostLimiter,
+    CostLimitExceeded,
+    RequestCost,
+    Reservation,
+    get_cost_limiter,
+    retry_after_header,
+)
+from app.services.history_store import (
+    HistoryBaseEvictedError,
+    HistoryDeltaError,
+    HistoryStore,
+    get_history_store,
+)
+from app.services.idempotency import (
+    IdempotencyKeyReused,
+    IdempotencyStore,
+    get_idempotency_store,
+    request_fingerprint,
+)
 from app.services.mal_client import MALClient
 from app.services.openai_client import OpenAIRecommendationClient
+from app.services.seen import SeenSet
+from app.services.title_resolver import TitleResolver, get_title_resolver
+from app.startup import startup_report
+from app.timing import collect
 
 router = APIRouter(prefix="/api", tags=["recommendations"])
 
@@ -47,9 +86,16 @@ def get_recommendation_engine(
             "model": ErrorResponse,
             "description": "Anime not found or no candidates available",
         },
+        409: {
+            "model": ErrorResponse,
+            "description": "history_delta base is no longer cached - resend the full anime_history",
+        },
         422: {
             "model": ErrorResponse,
-            "description": "anime_history is required and must contain at least one anime",
+            "description": (
+                "anime_history is required and must contain at least one anime, "
+                "or the Idempotency-Key was already used for a different request"
+            ),
         },
         429: {
             "model": ErrorResponse,
@@ -58,11 +104,21 @@ def get_recommendation_engine(
         500: {"model": ErrorResponse, "description": "Internal server error"},
     },
 )
-@limiter.limit("100/hour")
 async def recommend_anime(
     request: Request,
+    response: Response,
     body: RecommendRequest,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(
+        default=None,
+        min_length=1,
+        max_length=255,
+        description="Client-chosen ID that is identical for retries of one request",
+    ),
     engine: RecommendationEngine = Depends(get_recommendation_engine),
+    history_store: HistoryStore = Depends(get_history_store),
+    cost_limiter: CostLimiter = Depends(get_cost_limiter),
+    idempotency: Optional[IdempotencyStore] = Depends(get_idempotency_store),
 ):
     """
     Get personalized anime recommendation (stateless).
@@ -104,20 +160,150 @@ async def recommend_anime(
 
     **Optional Controls:**
     - `exclude_ids`: MAL IDs to skip (useful when a user dismisses a recommendation without rating it)
+    - `history_delta`: Instead of `anime_history`, send `{base_hash, appended_items, rating_changes}`
+      where `base_hash` is the `history_hash` from a previous response. If the server has
+      evicted that history it returns 409 and the full `anime_history` must be resent.
+    - `seen_ids_packed`: Extra seen MAL IDs in compact form (sorted, delta-encoded
+      LEB128 varints, base64url) for clients with thousands of seen titles
+    - `profile_token`: Echo the `profile_token` from the previous response so your taste
+      profile is updated with only the new history items instead of rebuilt.
 
     **Note:** Minimum required fields per anime are `mal_id`, `title`, `has_seen`, and optionally `rating`.
     More complete metadata improves recommendation quality.
 
-    **Rate Limits:** 20 recommendations per hour per IP address to prevent API abuse.
+    **Rate Limits:** Each IP address has a budget charged by what its requests cost
+    (AI tokens, MyAnimeList calls and history size), so small histories get more
+    recommendations per hour than huge ones. When the budget is used up the API
+    returns 429 with a `Retry-After` header.
+
+    **Duplicate Requests:** Send the same `Idempotency-Key` header when retrying a
+    request. A retry that arrives while the original is still running waits for
+    its result, and one that arrives later (within 10 minutes) gets the stored
+    result; neither is charged again. Requests without the header are matched by
+    their body, with results kept for 30 seconds. Shared results carry an
+    `Idempotent-Replayed: true` header.
     """
+    client_key = get_remote_address(request)
+
+    async def compute() -> RecommendResponse:
+        return await _charged_recommend(
+            client_key, body, engine, history_store, cost_limiter, background_tasks
+        )
+
+    if idempotency is None:
+        return await compute()
+    try:
+        result, shared = await idempotency.run(
+            client_key, idempotency_key, request_fingerprint(body), compute
+        )
+    except IdempotencyKeyReused as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+        )
+    if shared:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def _charged_recommend(
+    client_key: str,
+    body: RecommendRequest,
+    engine: RecommendationEngine,
+    history_store: HistoryStore,
+    cost_limiter: CostLimiter,
+    background_tasks: BackgroundTasks,
+) -> RecommendResponse:
+    """Charge a recommendation request to the cost limiter and run it."""
+    if body.history_delta is not None:
+        # Only a lower bound: _recommend charges the full rebuilt history
+        delta = body.history_delta
+        history_items = len(delta.appended_items) + len(delta.rating_changes)
+    else:
+        history_items = len(body.anime_history)
+    try:
+        reservation = cost_limiter.reserve(
+            client_key=client_key,
+            mode=body.mode.value,
+            history_items=history_items,
+        )
+    except CostLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+
+    cost = RequestCost(history_items=history_items)
+    # Keep the estimate unless the request finished with a recorded cost:
+    # failed, cancelled (client gone) or crashed requests may have made
+    # upstream calls that `cost` does not show yet
+    settled: Optional[RequestCost] = None
     try:
-        result = await engine.get_recommendation(
-            anime_history=body.anime_history,
-            mode=body.mode,
-            exclude_ids=body.exclude_ids,
+        result = await _recommend(
+            body, engine, history_store, reservation, cost, background_tasks
         )
+        settled = cost
+        return result
+    except HTTPException as e:
+        if e.status_code < 500:
+            settled = cost
+        raise
+    finally:
+        reservation.settle(settled)
+
 
-        return RecommendResponse(recommendation=result["recommendation"])
+async def _recommend(
+    body: RecommendRequest,
+    engine: RecommendationEngine,
+    history_store: HistoryStore,
+    reservation: Reservation,
+    cost: RequestCost,
+    background_tasks: BackgroundTasks,
+) -> RecommendResponse:
+    """Run a recommendation request, recording its upstream usage in `cost`."""
+    if body.history_delta is not None:
+        try:
+            history = history_store.apply_delta(body.history_delta)
+        except HistoryBaseEvictedError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+        except HistoryDeltaError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+            )
+        # The whole rebuilt history is validated, hashed and ranked
+        cost.history_items = len(history.items)
+    else:
+        history = history_store.put(body.anime_history)
+
+    seen_ids = None
+    if body.seen_ids_packed:
+        try:
+            seen_ids = SeenSet.from_packed(body.seen_ids_packed)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e)
+            )
+
+    usage = None
+    try:
+        with collect() as usage:
+            result = await engine.get_recommendation(
+                history=history,
+                mode=body.mode,
+                exclude_ids=body.exclude_ids,
+                profile_token=body.profile_token,
+                seen_ids=seen_ids,
+                fast_only=reservation.degraded,
+                background_tasks=background_tasks,
+            )
+        cost.prompt_tokens = result["token_usage"]["prompt_tokens"]
+        cost.completion_tokens = result["token_usage"]["completion_tokens"]
+
+        return RecommendResponse(
+            recommendation=result["recommendation"],
+            history_hash=history.content_hash,
+            profile_token=result["profile_token"],
+        )
 
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
@@ -135,6 +321,9 @@ async def recommend_anime(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=error_msg,
         )
+    finally:
+        if usage is not None:
+            cost.mal_calls = usage.count("mal_")
 
 
 @router.get(
@@ -168,15 +357,125 @@ async def search_anime(
         )
 
 
+@router.post(
+    "/resolve",
+    summary="Match many titles to anime",
+    description=(
+        "Resolve a list of free-text titles (e.g. an imported watch list) to "
+        "MyAnimeList entries. Results are streamed as NDJSON as they complete."
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        422: {"model": ErrorResponse, "description": "Too many or too long titles"},
+        429: {
+            "model": ErrorResponse,
+            "description": "Rate limit exceeded - please try again later",
+        },
+    },
+)
+@limiter.limit("20/hour")
+async def resolve_titles(
+    request: Request,
+    body: ResolveRequest,
+    resolver: TitleResolver = Depends(get_title_resolver),
+    mal_client: MALClient = Depends(get_mal_client),
+):
+    """
+    Match titles to anime in bulk.
+
+    Titles are normalised and deduplicated, exact matches against titles the
+    server already knows are answered immediately, and the rest are searched
+    on MyAnimeList concurrently. Each distinct title that needs a search is
+    charged to a per-IP search budget, separate from the recommendation
+    budget (429 with `Retry-After` when it is used up).
+
+    **Returns:** One JSON object per line, in completion order:
+    - `{"index", "title", "match", "confidence", "source"}` for every input
+      title, where `index` is its position in `titles`, `match` is the best
+      anime (same fields as `/api/search` results, or null), `confidence` is
+      the 0-1 title similarity and `source` is `local`, `mal` or `none`
+    - a final `{"done": true, "titles", "unique", "matched", "local"}` summary
+    """
+    max_titles = get_settings().resolve_max_titles
+    if len(body.titles) > max_titles:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {max_titles} titles can be resolved per request",
+        )
+    try:
+        resolver.charge(get_remote_address(request), body.titles)
+    except CostLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+
+    async def lines():
+        unique = matched = local = 0
+        async for indices, resolution in resolver.resolve_many(body.titles):
+            unique += 1
+            local += resolution.source == "local"
+            match = None
+            if resolution.match is not None:
+                matched += len(indices)
+                match = mal_client.extract_metadata(resolution.match)
+            for index in indices:
+                line = {
+                    "index": index,
+                    "title": body.titles[index],
+                    "match": match,
+                    "confidence": resolution.confidence,
+                    "source": resolution.source,
+                }
+                if resolution.error:
+                    line["error"] = resolution.error
+                yield json.dumps(line) + "\n"
+        yield json.dumps(
+            {
+                "done": True,
+                "titles": len(body.titles),
+                "unique": unique,
+                "matched": matched,
+                "local": local,
+            }
+        ) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.get(
     "/health",
     summary="Health check",
     description="Check if the API is running and responsive.",
 )
 async def health_check():
-    """Simple health check endpoint."""
+    """
+    Cheap liveness check.
+
+    Startup timings and cache statistics are served by the admin-only
+    `/api/admin/stats` endpoint.
+    """
     return {
         "status": "healthy",
         "service": "Anime Recommendation API (Stateless)",
         "version": "2.0",
+        "uptime_seconds": startup_report.uptime_seconds(),
     }
+
+
+@router.get(
+    "/ready",
+    summary="Readiness check",
+    description="Returns 200 once startup warm-up has finished, 503 while warming.",
+    responses={503: {"description": "Instance is still warming up"}},
+)
+async def readiness_check():
+    """Readiness endpoint for load balancers and deploy health checks."""
+    if not startup_report.warm:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "warming"},
+        )
+    return {"status": "ready", "warmup_error": startup_report.warmup_error}
@@ -2,10 +2,13 @@
 Pydantic schemas for stateless API request/response validation.
 """
 
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, model_validator
+from typing import Annotated, Dict, Optional, List
 from enum import Enum
 
+# MAL IDs are positive; anything else is a client error (422), not a lookup miss
+MalId = Annotated[int, Field(gt=0)]
+
 
 class UserRatingEnum(str, Enum):
     """User rating options."""
@@ -43,6 +46,7 @@ class AnimeBase(BaseModel):
 class AnimeHistoryItem(AnimeBase):
     """Represents an anime in the user's history with their rating."""
 
+    mal_id: MalId
     has_seen: bool = Field(
         default=True, description="Whether the user has seen this anime"
     )
@@ -60,26 +64,71 @@ class AnimeRecommendation(AnimeBase):
     )
 
 
+class HistoryDelta(BaseModel):
+    """Changes to a history the server has already seen, identified by its hash."""
+
+    base_hash: str = Field(
+        ...,
+        description="history_hash returned by a previous /api/recommend response",
+    )
+    appended_items: List[AnimeHistoryItem] = Field(
+        default_factory=list,
+        description="Anime added to the end of the history since the base",
+    )
+    rating_changes: Dict[MalId, Optional[UserRatingEnum]] = Field(
+        default_factory=dict,
+        description="New ratings for anime already in the base, keyed by MAL ID",
+    )
+
+
 class RecommendRequest(BaseModel):
     """Stateless request for anime recommendation.
 
     Client sends their full anime history (from their JSON save file).
     The history is ordered, with the first item being the initial/favorite anime.
+
+    Alternatively, clients can send `history_delta` relative to a
+    `history_hash` from an earlier response. If the server no longer holds that
+    base it answers 409 and the client should resend the full history.
     """
 
-    anime_history: List[AnimeHistoryItem] = Field(
-        ...,
+    anime_history: Optional[List[AnimeHistoryItem]] = Field(
+        None,
         min_length=1,
         description="Ordered list of anime the user has watched/rated (first item = initial favorite)",
     )
+    history_delta: Optional[HistoryDelta] = Field(
+        None,
+        description="Optional compact alternative to anime_history (see history_hash)",
+    )
     mode: RecommendationMode = Field(
         default=RecommendationMode.EXPLORE,
         description="Recommendation strategy: 'similar' for comfort zone, 'explore' for discovery (default)",
     )
-    exclude_ids: List[int] = Field(
+    exclude_ids: List[MalId] = Field(
         default_factory=list,
         description="Optional list of MAL IDs to exclude (e.g., recently dismissed recommendations)",
     )
+    seen_ids_packed: Optional[str] = Field(
+        None,
+        max_length=262144,
+        description=(
+            "Optional compact list of extra seen/excluded MAL IDs: sorted IDs, "
+            "delta-encoded as LEB128 varints, base64url without padding"
+        ),
+    )
+    profile_token: Optional[str] = Field(
+        None,
+        max_length=16384,
+        description="Opaque profile_token from the previous response",
+    )
+
+    @model_validator(mode="after")
+    def check_history_source(self) -> "RecommendRequest":
+        """Require exactly one of anime_history and history_delta."""
+        if (self.anime_history is None) == (self.history_delta is None):
+            raise ValueError("Provide exactly one of anime_history or history_delta")
+        return self
 
 
 class RecommendResponse(BaseModel):
@@ -90,6 +139,24 @@ class RecommendResponse(BaseModel):
     """
 
     recommendation: AnimeRecommendation
+    history_hash: Optional[str] = Field(
+        None,
+        description="Hash of the history used for this request; send it as history_delta.base_hash next time",
+    )
+    profile_token: Optional[str] = Field(
+        None,
+        description="Opaque preference profile; send it back with the next request",
+    )
+
+
+class ResolveRequest(BaseModel):
+    """Request body for bulk title resolution."""
+
+    titles: List[Annotated[str, Field(max_length=256)]] = Field(
+        ...,
+        min_length=1,
+        description="Anime titles to match (at most 256 characters each)",
+    )
 
 
 class ErrorResponse(BaseModel):
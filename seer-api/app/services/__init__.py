@@ -1,11 +1,13 @@
 """
 Services package for anime recommendation system.
 """
+from app.services.anime_record import AnimeRecord
 from app.services.mal_client import MALClient, get_mal_client
 from app.services.openai_client import OpenAIRecommendationClient, get_openai_client
 from app.services.recommendation import RecommendationEngine
 
 __all__ = [
+    "AnimeRecord",
     "MALClient",
     "get_mal_client",
     "OpenAIRecommendationClient",
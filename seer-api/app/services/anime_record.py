@@ -0,0 +1,236 @@
+"""
+Compact in-memory representation of anime used inside the recommendation engine.
+
+MAL responses and client history items are converted to `AnimeRecord`s as soon
+as they enter the engine, and back to plain dictionaries only at the API
+boundary. Genre and studio names from MAL are interned into process-wide
+vocabularies so every record stores small integer IDs instead of repeating the
+same strings. Names sent by clients are never registered there: history items
+keep their own name tuples, reusing the vocabulary's string objects for names
+MAL already uses.
+
+Author: Runkai Zhang
+"""
+
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Prompts only ever show the first 200 characters of a synopsis for history items
+HISTORY_SYNOPSIS_CHARS = 200
+
+
+class Vocabulary:
+    """
+    Bidirectional name <-> ID mapping for small categorical values.
+
+    Only names from MAL responses are registered. MAL has a finite set of
+    genres and studios, so the table stays small without a size cap, and no
+    MAL name is ever refused.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def intern(self, name: str) -> Optional[int]:
+        """Return the ID for a name, registering it if needed (None if empty)."""
+        name_id = self._ids.get(name)
+        if name_id is not None:
+            return name_id
+        if not name:
+            return None
+        name_id = len(self._names)
+        name = sys.intern(name)
+        self._ids[name] = name_id
+        self._names.append(name)
+        return name_id
+
+    def intern_all(self, names: Iterable[str]) -> Tuple[int, ...]:
+        """Intern a sequence of names, skipping empty ones."""
+        ids = []
+        for name in names:
+            name_id = self.intern(name)
+            if name_id is not None:
+                ids.append(name_id)
+        return tuple(ids)
+
+    def lookup(self, name: str) -> Optional[int]:
+        """Return the ID for a name without registering it."""
+        return self._ids.get(name)
+
+    def canonical(self, name: str) -> str:
+        """Return the registered string equal to a name, or the name itself."""
+        name_id = self._ids.get(name)
+        return name if name_id is None else self._names[name_id]
+
+    def name(self, name_id: int) -> str:
+        """Return the name registered for an ID."""
+        return self._names[name_id]
+
+    def names(self, ids: Iterable[int]) -> List[str]:
+        """Resolve a sequence of IDs back to names."""
+        return [self._names[i] for i in ids]
+
+
+GENRES = Vocabulary()
+STUDIOS = Vocabulary()
+
+
+def _intern_optional(value: Optional[str]) -> Optional[str]:
+    """Intern short repeated strings such as media type and source."""
+    return sys.intern(value) if value else value
+
+
+@dataclass(slots=True)
+class AnimeRecord:
+    """
+    A single anime, either a candidate from MAL or an item in the user's history.
+
+    For MAL anime, `genre_ids` and `studio_ids` index into the `GENRES` and
+    `STUDIOS` vocabularies. History items come from clients and carry their
+    names in `genre_names` and `studio_names` instead, so client input never
+    grows the shared vocabularies. User-specific fields are only set for
+    history items.
+    """
+
+    mal_id: int
+    title: str
+    genre_ids: Tuple[int, ...] = ()
+    studio_ids: Tuple[int, ...] = ()
+    episodes: Optional[int] = None
+    score: Optional[str] = None
+    synopsis: Optional[str] = None
+    media_type: Optional[str] = None
+    content_rating: Optional[str] = None
+    source: Optional[str] = None
+    image_url: Optional[str] = None
+    rank: Optional[int] = None
+    popularity: Optional[int] = None
+    watch_status: Optional[str] = None
+    user_seen: Optional[bool] = None
+    user_rating: Optional[str] = None
+    genre_names: Optional[Tuple[str, ...]] = None
+    studio_names: Optional[Tuple[str, ...]] = None
+
+    @property
+    def genres(self) -> List[str]:
+        """Genre names for this anime."""
+        if self.genre_names is not None:
+            return list(self.genre_names)
+        return GENRES.names(self.genre_ids)
+
+    @property
+    def studios(self) -> List[str]:
+        """Studio names for this anime."""
+        if self.studio_names is not None:
+            return list(self.studio_names)
+        return STUDIOS.names(self.studio_ids)
+
+    @classmethod
+    def from_mal(cls, anime_data: Dict[str, Any]) -> "AnimeRecord":
+        """
+        Build a record from raw MAL anime data.
+
+        Args:
+            anime_data: Raw anime data from MAL API (search, ranking or details)
+
+        Returns:
+            Normalized AnimeRecord
+        """
+        # Handle both search results and detailed anime objects
+        if "node" in anime_data:
+            anime_data = anime_data["node"]
+
+        # Extract image URL (prefer medium size, fallback to large)
+        image_url = None
+        if "main_picture" in anime_data and anime_data["main_picture"]:
+            main_picture = anime_data["main_picture"]
+            image_url = main_picture.get("medium") or main_picture.get("large")
+
+        return cls(
+            mal_id=anime_data.get("id"),
+            title=anime_data.get("title", ""),
+            genre_ids=GENRES.intern_all(
+                g.get("name", "") for g in anime_data.get("genres", [])
+            ),
+            studio_ids=STUDIOS.intern_all(
+                s.get("name", "") for s in anime_data.get("studios", [])
+            ),
+            episodes=anime_data.get("num_episodes"),
+            score=(
+                str(anime_data.get("mean", "N/A")) if anime_data.get("mean") else "N/A"
+            ),
+            synopsis=anime_data.get("synopsis", ""),
+            media_type=_intern_optional(anime_data.get("media_type", "")),
+            content_rating=_intern_optional(anime_data.get("rating", "")),
+            source=_intern_optional(anime_data.get("source", "")),
+            image_url=image_url,
+            rank=anime_data.get("rank"),
+            popularity=anime_data.get("popularity"),
+        )
+
+    @classmethod
+    def from_history_item(cls, item: Any) -> "AnimeRecord":
+        """
+        Build a record from an AnimeHistoryItem sent by the client.
+
+        History synopses are only used in prompts, so they are trimmed to the
+        length the prompts actually show. Genre and studio names are kept as
+        plain strings rather than registered in the shared vocabularies.
+
+        Args:
+            item: AnimeHistoryItem from request
+
+        Returns:
+            AnimeRecord carrying the user's rating and seen state
+        """
+        return cls(
+            mal_id=item.mal_id,
+            title=item.title,
+            genre_names=tuple(GENRES.canonical(name) for name in item.genres if name),
+            studio_names=tuple(
+                STUDIOS.canonical(name) for name in item.studios if name
+            ),
+            episodes=item.episodes,
+            score=item.score,
+            synopsis=(
+                item.synopsis[: HISTORY_SYNOPSIS_CHARS + 1]
+                if item.synopsis
+                else item.synopsis
+            ),
+            media_type=_intern_optional(item.media_type),
+            source=_intern_optional(item.source),
+            watch_status=_intern_optional(item.watch_status),
+            image_url=item.image_url,
+            rank=item.rank,
+            popularity=item.popularity,
+            user_seen=item.has_seen,
+            user_rating=item.rating.value if item.rating else None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert to the metadata dictionary returned by the API.
+
+        Returns:
+            Dictionary with the same keys as MAL metadata responses
+        """
+        return {
+            "mal_id": self.mal_id,
+            "title": self.title,
+            "genres": self.genres,
+            "studios": self.studios,
+            "episodes": self.episodes,
+            "score": self.score,
+            "synopsis": self.synopsis,
+            "media_type": self.media_type,
+            "rating": self.content_rating,
+            "source": self.source,
+            "image_url": self.image_url,
+            "rank": self.rank,
+            "popularity": self.popularity,
+        }
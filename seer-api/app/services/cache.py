@@ -0,0 +1,107 @@
+"""
+Small in-process caches shared by the API services.
+
+Author: Runkai Zhang
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class BoundedTTLCache(Generic[V]):
+    """
+    LRU cache with a maximum number of entries and a per-entry time-to-live.
+
+    Entries are evicted when the cache is full (least recently used first) or
+    when they are older than `ttl_seconds`. With a `weigher`, the total weight
+    of the entries (e.g. their size) is also kept within `max_weight`. Not
+    thread-safe; it is meant to be used from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        max_weight: Optional[float] = None,
+        weigher: Optional[Callable[[V], float]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self._entries: "OrderedDict[Hashable, tuple[float, V, float]]" = OrderedDict()
+        self.weight = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, count=False) is not None
+
+    def get(self, key: Hashable, count: bool = True) -> Optional[V]:
+        """Return a live entry and mark it as recently used, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        expires_at, value, weight = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.weight -= weight
+            if count:
+                self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl_seconds: Optional[float] = None) -> None:
+        """Insert or refresh an entry, evicting the oldest ones if full."""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        weight = self.weigher(value) if self.weigher else 0.0
+        self.pop(key)
+        self._entries[key] = (time.monotonic() + ttl, value, weight)
+        self.weight += weight
+        # The entry just set is kept even if it alone exceeds max_weight
+        while len(self._entries) > self.max_entries or (
+            self.max_weight is not None
+            and self.weight > self.max_weight
+            and len(self._entries) > 1
+        ):
+            _, (_, _, evicted_weight) = self._entries.popitem(last=False)
+            self.weight -= evicted_weight
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        """Remove an entry and return its value if it was present."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.weight -= entry[2]
+        return entry[1]
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        self._entries.clear()
+        self.weight = 0.0
+
+    def stats(self) -> dict:
+        """Return size and hit/miss counters for diagnostics."""
+        stats = {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        if self.weigher is not None:
+            stats["weight"] = self.weight
+            stats["max_weight"] = self.max_weight
+        return stats
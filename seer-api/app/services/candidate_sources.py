@@ -0,0 +1,260 @@
+"""
+Exploratory candidates fanned out over several MAL lists.
+
+Instead of drawing only on the all-time ranking, `CandidateFanOut` reads a
+configurable mix of MAL lists (ranking types and seasonal charts) in
+parallel. Each source contributes up to its per-mode quota of unseen anime;
+the per-source runs are scored on a common 0-1 scale (MAL score blended with
+position in the list) and combined with a k-way merge, so the best items of
+every list come first regardless of which list they came from.
+
+MAL load: a request reads the first page (25 items) of each of its mode's
+sources, 7 for the default explore mix. These pages go through the MAL
+client's cache, are shared by all requests and are fetched by the startup
+warm-up, so they rarely cost a MAL call. Deeper pages are only needed when the
+user has seen most of a list; uncached ones are limited per request by
+CANDIDATE_SOURCE_MAX_FETCHES across all sources (default 4), instead of up to
+SOURCE_MAX_PAGES - 1 per source.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.anime_record import AnimeRecord
+from app.services.mal_client import MALClient, PageBudget
+from app.services.seen import SeenSet
+
+logger = logging.getLogger(__name__)
+
+SEASONS = ("winter", "spring", "summer", "fall")
+
+# Pages read per source while looking for unseen anime (25 + 50 + 100 items)
+SOURCE_MAX_PAGES = 3
+
+# Extra items collected per source to make up for cross-source duplicates
+DEDUPE_SLACK = 2
+
+
+@dataclass(frozen=True)
+class ListSource:
+    """A MAL list that can supply candidates."""
+
+    name: str
+    ranking_type: Optional[str] = None
+    season_offset: Optional[int] = None  # 0 = current season, -1 = previous
+
+    def iterate(
+        self, mal_client: MALClient, budget: Optional[PageBudget] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Lazily iterate over the list's items."""
+        if self.season_offset is not None:
+            year, season = season_for(date.today(), self.season_offset)
+            return mal_client.iter_season(
+                year, season, max_pages=SOURCE_MAX_PAGES, budget=budget
+            )
+        return mal_client.iter_ranking(
+            self.ranking_type or "all", max_pages=SOURCE_MAX_PAGES, budget=budget
+        )
+
+
+SOURCES: Dict[str, ListSource] = {
+    source.name: source
+    for source in (
+        ListSource("all", ranking_type="all"),
+        ListSource("airing", ranking_type="airing"),
+        ListSource("bypopularity", ranking_type="bypopularity"),
+        ListSource("favorite", ranking_type="favorite"),
+        ListSource("movie", ranking_type="movie"),
+        ListSource("ova", ranking_type="ova"),
+        ListSource("season", season_offset=0),
+        ListSource("last_season", season_offset=-1),
+    )
+}
+
+
+def season_for(today: date, offset: int = 0) -> Tuple[int, str]:
+    """
+    Return the (year, season) `offset` seasons away from `today`.
+
+    Args:
+        today: Reference date
+        offset: Seasons to move (negative = past)
+
+    Returns:
+        Year and MAL season name
+    """
+    index = today.year * 4 + (today.month - 1) // 3 + offset
+    return index // 4, SEASONS[index % 4]
+
+
+def normalised_score(item: Dict[str, Any], position: int, depth: int) -> float:
+    """
+    Score an item from one list on a 0-1 scale comparable across lists.
+
+    Half of the score is the MAL mean score, half the item's position in its
+    own list, so a list's top entries rank high even when the list is not
+    ordered by score (popularity, favourites, airing).
+
+    Args:
+        item: MAL list item
+        position: Zero-based position among the items collected from the list
+        depth: Number of items collected from the list
+
+    Returns:
+        Normalised score
+    """
+    mean = item.get("node", {}).get("mean") or 0.0
+    return 0.5 * min(float(mean), 10.0) / 10.0 + 0.5 * (1.0 - position / max(depth, 1))
+
+
+class CandidateFanOut:
+    """Collects exploratory candidates from several MAL lists concurrently."""
+
+    def __init__(self, quotas: Dict[str, Dict[str, int]], max_fetches: int = 4):
+        # Uncached pages beyond each source's first, per request
+        self.max_fetches = max_fetches
+        self.quotas = {
+            mode: {name: n for name, n in mode_quotas.items() if name in SOURCES}
+            for mode, mode_quotas in quotas.items()
+        }
+        for mode, mode_quotas in quotas.items():
+            unknown = set(mode_quotas) - set(SOURCES)
+            if unknown:
+                logger.warning(
+                    "Ignoring unknown candidate sources for %s: %s",
+                    mode,
+                    sorted(unknown),
+                )
+
+    def quotas_for(self, mode: str) -> Dict[str, int]:
+        """Per-source quotas for a mode (falls back to the all-time ranking)."""
+        return self.quotas.get(mode) or {"all": 8}
+
+    async def candidates(
+        self,
+        mal_client: MALClient,
+        mode: str,
+        seen_ids: SeenSet,
+        exclude_ids: Iterable[int],
+        limit: int,
+    ) -> List[AnimeRecord]:
+        """
+        Gather up to `limit` unseen candidates from the mode's sources.
+
+        Args:
+            mal_client: Client the lists are read with
+            mode: Recommendation mode whose quotas apply
+            seen_ids: MAL IDs the user has seen or excluded
+            exclude_ids: IDs already in the candidate pool
+            limit: Maximum number of candidates
+
+        Returns:
+            Candidates, best first
+        """
+        if limit <= 0:
+            return []
+        quotas = self.quotas_for(mode)
+        names = list(quotas)
+        budget = PageBudget(self.max_fetches)
+        results = await asyncio.gather(
+            *[
+                self._collect(
+                    mal_client,
+                    SOURCES[name],
+                    seen_ids,
+                    quotas[name] + DEDUPE_SLACK,
+                    budget,
+                )
+                for name in names
+            ],
+            return_exceptions=True,
+        )
+
+        runs = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning("Candidate source %s failed: %s", name, result)
+                continue
+            depth = len(result)
+            run = [
+                (normalised_score(item, position, depth), name, item)
+                for position, item in enumerate(result)
+            ]
+            # heapq.merge needs every run in merge order
+            run.sort(key=lambda e: e[0], reverse=True)
+            runs.append(run)
+
+        chosen: List[AnimeRecord] = []
+        overflow: List[Dict[str, Any]] = []
+        taken = set(exclude_ids)
+        used: Dict[str, int] = {}
+        for _, name, item in heapq.merge(*runs, key=lambda e: e[0], reverse=True):
+            anime_id = item["node"]["id"]
+            if anime_id in taken:
+                continue
+            if used.get(name, 0) >= quotas[name]:
+                overflow.append(item)
+                continue
+            taken.add(anime_id)
+            used[name] = used.get(name, 0) + 1
+            chosen.append(mal_client.extract_record(item))
+            if len(chosen) >= limit:
+                return chosen
+
+        # Sources that ran dry leave room for the others' next-best items
+        for item in overflow:
+            anime_id = item["node"]["id"]
+            if anime_id not in taken:
+                taken.add(anime_id)
+                chosen.append(mal_client.extract_record(item))
+                if len(chosen) >= limit:
+                    break
+        return chosen
+
+    async def _collect(
+        self,
+        mal_client: MALClient,
+        source: ListSource,
+        seen_ids: SeenSet,
+        wanted: int,
+        budget: Optional[PageBudget] = None,
+    ) -> List[Dict[str, Any]]:
+        """Read a source until `wanted` unseen items are found."""
+        items = []
+        stream = source.iterate(mal_client, budget)
+        try:
+            async for item in stream:
+                anime_id = item.get("node", {}).get("id")
+                if anime_id and anime_id not in seen_ids:
+                    items.append(item)
+                    if len(items) >= wanted:
+                        break
+        finally:
+            await stream.aclose()
+        return items
+
+    async def warm(self, mal_client: MALClient) -> None:
+        """Fetch the first page of every configured source into the cache."""
+        names = {name for mode_quotas in self.quotas.values() for name in mode_quotas}
+        await asyncio.gather(
+            *[self._collect(mal_client, SOURCES[name], SeenSet(), 1) for name in names],
+            return_exceptions=True,
+        )
+
+
+@lru_cache()
+def get_candidate_fan_out() -> CandidateFanOut:
+    """Get the process-wide candidate fan-out (quotas parsed once)."""
+    settings = get_settings()
+    return CandidateFanOut(
+        settings.candidate_source_quotas,
+        max_fetches=settings.candidate_source_max_fetches,
+    )
@@ -0,0 +1,455 @@
+"""
+Item-item graph of MAL co-recommendations and personalized PageRank over it.
+
+Every anime details response carries MAL's user recommendations for that
+anime ("people who liked A recommend B", with a vote count). The MAL client
+adds them to this graph as an undirected, vote-weighted edge list, so the
+graph grows from the details the server fetches anyway and never needs MAL
+calls of its own.
+
+For ranking, the graph is compiled into an immutable compressed sparse row
+(CSR) snapshot over dense node indices. `personalized_pagerank` then runs a
+few vectorized power iterations seeded by the user's whole rated history:
+liked anime attract probability mass, disliked anime push it away. Scores
+are linear in the seed vector, so both are handled in one signed run.
+Because the graph is undirected, each node's CSR row also lists the nodes
+that pass mass to it, so an iteration is one gather and one segmented sum.
+
+The snapshot is the only full copy of the graph. New edges wait in a small
+buffer keyed by anime pair and are merged into the next snapshot with numpy
+(`merge_edges`) in a worker thread, at most once per rebuild interval.
+Requests never wait for a rebuild; they rank with the last snapshot.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Container, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Weight of a disliked anime's seed relative to a liked one
+NEGATIVE_SEED_WEIGHT = 0.5
+
+# Power iteration stops early once scores change less than this (L1)
+CONVERGENCE_TOLERANCE = 1e-5
+
+
+@dataclass(frozen=True)
+class CompiledGraph:
+    """
+    Immutable CSR snapshot of the graph.
+
+    Node i is anime `ids[i]` (ids are sorted); its neighbours are
+    `indices[indptr[i]:indptr[i + 1]]` with edge weights at the same positions.
+    """
+
+    ids: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+    # Total edge weight per node (the transition probability denominators)
+    strengths: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "CompiledGraph":
+        return cls(
+            ids=np.zeros(0, dtype=np.int64),
+            indptr=np.zeros(1, dtype=np.int64),
+            indices=np.zeros(0, dtype=np.int32),
+            weights=np.zeros(0, dtype=np.float32),
+            strengths=np.zeros(0, dtype=np.float32),
+        )
+
+    def weight(self, a: int, b: int) -> Optional[float]:
+        """Weight of the edge between two anime, or None if there is none."""
+        row = self.position(a)
+        if row is None:
+            return None
+        column = self.position(b)
+        if column is None:
+            return None
+        start, end = self.indptr[row], self.indptr[row + 1]
+        # Rows are sorted by neighbour index
+        i = start + int(np.searchsorted(self.indices[start:end], column))
+        if i < end and self.indices[i] == column:
+            return float(self.weights[i])
+        return None
+
+    def position(self, anime_id: int) -> Optional[int]:
+        """Node index of an anime, or None if it is not in the snapshot."""
+        i = int(np.searchsorted(self.ids, anime_id))
+        if i < len(self.ids) and self.ids[i] == anime_id:
+            return i
+        return None
+
+    def positions(self, anime_ids: Iterable[int]) -> np.ndarray:
+        """Node indices of the given anime that are in the snapshot."""
+        wanted = np.fromiter(anime_ids, dtype=np.int64)
+        if not len(self.ids) or not len(wanted):
+            return np.zeros(0, dtype=np.int64)
+        found = np.searchsorted(self.ids, wanted)
+        found = np.minimum(found, len(self.ids) - 1)
+        return found[self.ids[found] == wanted]
+
+    def edge_lists(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Directed (source ID, target ID, weight) arrays, both directions."""
+        sources = np.repeat(self.ids, np.diff(self.indptr))
+        return sources, self.ids[self.indices], self.weights
+
+
+def build_graph(
+    sources: np.ndarray, targets: np.ndarray, weights: np.ndarray
+) -> CompiledGraph:
+    """
+    Build a snapshot from directed edge arrays that list both directions.
+
+    Where an edge is listed more than once, its last weight wins.
+
+    Args:
+        sources: Source anime IDs
+        targets: Target anime IDs
+        weights: Edge weights
+
+    Returns:
+        The compiled snapshot
+    """
+    if not len(sources):
+        return CompiledGraph.empty()
+
+    # Stable sort by (source, target): the last copy of an edge ends a run
+    order = np.lexsort((targets, sources))
+    src, dst, wts = sources[order], targets[order], weights[order]
+    last = np.ones(len(src), dtype=bool)
+    last[:-1] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst, wts = src[last], dst[last], wts[last].astype(np.float32)
+
+    # Edges are symmetric, so every node appears as a source
+    ids = np.unique(src)
+    rows = np.searchsorted(ids, src)
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+    return CompiledGraph(
+        ids=ids,
+        indptr=indptr,
+        indices=np.searchsorted(ids, dst).astype(np.int32),
+        weights=wts,
+        # Every node has at least one edge, so no reduceat segment is empty
+        strengths=np.add.reduceat(wts, indptr[:-1]),
+    )
+
+
+def merge_edges(
+    previous: CompiledGraph, edges: Dict[Tuple[int, int], float]
+) -> CompiledGraph:
+    """
+    Build a snapshot from a previous one plus new or re-weighted edges.
+
+    Vectorized apart from reading the (small) edge buffer, so it can run in
+    a worker thread without holding the GIL for long. Where an edge appears
+    in both, the new weight wins.
+
+    Args:
+        previous: Snapshot to extend
+        edges: Undirected edge weights keyed by (smaller ID, larger ID)
+
+    Returns:
+        The merged snapshot
+    """
+    src, dst, wts = previous.edge_lists()
+    count = len(edges)
+    pairs = np.fromiter(
+        chain.from_iterable(edges), dtype=np.int64, count=2 * count
+    ).reshape(-1, 2)
+    votes = np.fromiter(edges.values(), dtype=np.float32, count=count)
+    return build_graph(
+        np.concatenate((src, pairs[:, 0], pairs[:, 1])),
+        np.concatenate((dst, pairs[:, 1], pairs[:, 0])),
+        np.concatenate((wts, votes, votes)),
+    )
+
+
+class CoRecommendationGraph:
+    """Undirected co-recommendation graph with a background-compiled CSR form."""
+
+    def __init__(
+        self,
+        max_nodes: int = 200_000,
+        damping: float = 0.85,
+        iterations: int = 20,
+        rebuild_interval: float = 10.0,
+        background: bool = True,
+    ):
+        self.max_nodes = max_nodes
+        self.damping = damping
+        self.iterations = iterations
+        # New edges are merged into the snapshot at most this often
+        self.rebuild_interval = rebuild_interval
+        # Merge in a worker thread (requests use the previous snapshot
+        # meanwhile) rather than inline; the offline harness compiles inline
+        self.background = background
+        self.compiled = CompiledGraph.empty()
+        # Edges added since the last merge started, keyed by (smaller ID,
+        # larger ID), and the batch a running background merge is folding in
+        self._pending: Dict[Tuple[int, int], float] = {}
+        self._merging: Dict[Tuple[int, int], float] = {}
+        # Nodes of pending or merging edges that are not in the snapshot yet
+        self._new_nodes: Set[int] = set()
+        self._compiled_at = float("-inf")
+        self._compiling: Optional["asyncio.Task[None]"] = None
+        self._full_logged = False
+
+    def __len__(self) -> int:
+        return len(self.compiled.ids) + len(self._new_nodes)
+
+    def __contains__(self, anime_id: int) -> bool:
+        return (
+            anime_id in self._new_nodes or self.compiled.position(anime_id) is not None
+        )
+
+    @property
+    def edge_count(self) -> int:
+        """Edges in the compiled snapshot (pending edges are not counted)."""
+        return len(self.compiled.indices) // 2
+
+    def add_details(self, details: Dict[str, Any]) -> None:
+        """Add the recommendations of one anime details response."""
+        source = details.get("id")
+        if not source:
+            return
+        for rec in details.get("recommendations") or []:
+            target = rec.get("node", {}).get("id")
+            if target and target != source:
+                self.add_edge(source, target, rec.get("num_recommendations") or 1)
+
+    def add_edge(self, a: int, b: int, votes: float) -> None:
+        """Set the weight of the edge between two anime (idempotent)."""
+        key = (a, b) if a < b else (b, a)
+        if self._weight(key) == votes:
+            return
+        new_nodes = [n for n in key if n not in self]
+        if new_nodes and len(self) + len(new_nodes) > self.max_nodes:
+            if not self._full_logged:
+                logger.warning("Co-recommendation graph is full (%d nodes)", len(self))
+                self._full_logged = True
+            return
+        self._new_nodes.update(new_nodes)
+        self._pending[key] = votes
+
+    def _weight(self, key: Tuple[int, int]) -> Optional[float]:
+        """Current weight of an edge, newest buffer first."""
+        for edges in (self._pending, self._merging):
+            if key in edges:
+                return edges[key]
+        return self.compiled.weight(*key)
+
+    def _swap_in(self, compiled: CompiledGraph) -> None:
+        """Replace the snapshot (on the event loop; readers keep their own)."""
+        self.compiled = compiled
+        if self._new_nodes:
+            nodes = np.fromiter(self._new_nodes, dtype=np.int64)
+            self._new_nodes = set(
+                nodes[~np.isin(nodes, compiled.ids, assume_unique=True)].tolist()
+            )
+
+    def compile(self) -> None:
+        """Merge all pending edges into the snapshot now, on this thread."""
+        # Includes the batch of a running background merge, whose result is
+        # then discarded because the snapshot it extended is gone
+        edges = {**self._merging, **self._pending}
+        self._pending = {}
+        self._swap_in(merge_edges(self.compiled, edges))
+        self._compiled_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        """Merge all pending edges into the snapshot in a worker thread."""
+        if self._compiling is not None:
+            await asyncio.shield(self._compiling)
+        if self._pending:
+            self._compiling = asyncio.ensure_future(self._compile_in_thread())
+            await asyncio.shield(self._compiling)
+
+    async def _compile_in_thread(self) -> None:
+        self._merging, self._pending = self._pending, {}
+        previous = self.compiled
+        started_at = time.perf_counter()
+        try:
+            compiled = await asyncio.to_thread(merge_edges, previous, self._merging)
+        except Exception:
+            logger.exception("Compiling the co-recommendation graph failed")
+            self._pending = {**self._merging, **self._pending}
+            return
+        finally:
+            merged, self._merging = len(self._merging), {}
+            self._compiling = None
+            self._compiled_at = time.monotonic()
+        if self.compiled is not previous:
+            # `compile` already merged this batch into a newer snapshot
+            return
+        self._swap_in(compiled)
+        logger.debug(
+            "Compiled co-recommendation graph (%d nodes, %d new edges) in %.1f ms",
+            len(compiled.ids),
+            merged,
+            (time.perf_counter() - started_at) * 1000,
+        )
+
+    def _schedule_compile(self) -> None:
+        """Start merging pending edges if they are due and no merge is running."""
+        if (
+            not self._pending
+            or self._compiling is not None
+            or time.monotonic() - self._compiled_at < self.rebuild_interval
+        ):
+            return
+        if not self.background:
+            self.compile()
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No running event loop (scripts): compile inline
+            self.compile()
+            return
+        self._compiling = loop.create_task(self._compile_in_thread())
+
+    def personalized_pagerank(
+        self,
+        liked_ids: Iterable[int],
+        disliked_ids: Iterable[int],
+        exclude: Container[int],
+        limit: int,
+    ) -> List[Tuple[int, float]]:
+        """
+        Rank anime by personalized PageRank from the user's rated history.
+
+        Args:
+            liked_ids: Positively rated anime (restart mass)
+            disliked_ids: Negatively rated anime (negative restart mass)
+            exclude: Anime that must not be returned (seen, blocked)
+            limit: Maximum number of results
+
+        Returns:
+            Up to `limit` (anime ID, score) pairs with positive scores, best first
+        """
+        self._schedule_compile()
+        # A merge finishing meanwhile swaps in a new snapshot; keep this one
+        graph = self.compiled
+        n = len(graph.ids)
+        if n == 0 or limit <= 0:
+            return []
+
+        seeds = np.zeros(n, dtype=np.float64)
+        np.add.at(seeds, graph.positions(liked_ids), 1.0)
+        positive_mass = seeds.sum()
+        if positive_mass == 0:
+            return []
+        np.add.at(seeds, graph.positions(disliked_ids), -NEGATIVE_SEED_WEIGHT)
+        seeds /= positive_mass
+
+        # r = (1 - d) * s + d * P^T r. Node j receives r_i * w_ij / strength_i
+        # from each neighbour i, i.e. a segmented sum over j's own CSR row.
+        seeds = seeds.astype(np.float32)
+        restart = (1.0 - self.damping) * seeds
+        starts = graph.indptr[:-1]
+        scores = seeds
+        for _ in range(self.iterations):
+            outflow = scores / graph.strengths
+            spread = np.add.reduceat(outflow[graph.indices] * graph.weights, starts)
+            updated = restart + self.damping * spread
+            converged = np.abs(updated - scores).sum() < CONVERGENCE_TOLERANCE
+            scores = updated
+            if converged:
+                break
+
+        candidates = np.flatnonzero(scores > 0)
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        results = []
+        for i in ranked:
+            anime_id = int(graph.ids[i])
+            if seeds[i] == 0 and anime_id not in exclude:
+                results.append((anime_id, float(scores[i])))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def save(self, path: str) -> None:
+        """Write the graph to an .npz file (replacing it atomically)."""
+        self.compile()
+        graph = self.compiled
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                ids=graph.ids,
+                indptr=graph.indptr,
+                indices=graph.indices,
+                weights=graph.weights,
+            )
+        os.replace(temp_path, path)
+
+    def load(self, path: str) -> None:
+        """
+        Merge in a graph saved with `save`.
+
+        Edges already in this graph win over saved ones. If the result has
+        more than `max_nodes` nodes, the most strongly connected are kept.
+        """
+        with np.load(path) as data:
+            ids = data["ids"].astype(np.int64)
+            degrees = np.diff(data["indptr"])
+            targets = ids[data["indices"]]
+            weights = data["weights"].astype(np.float32)
+        sources = np.repeat(ids, degrees)
+        src, dst, wts = self.compiled.edge_lists()
+        loaded = build_graph(
+            np.concatenate((sources, src)),
+            np.concatenate((targets, dst)),
+            np.concatenate((weights, wts)),
+        )
+
+        room = max(self.max_nodes - len(self._new_nodes), 0)
+        if len(loaded.ids) > room:
+            logger.warning(
+                "Saved co-recommendation graph has %d nodes, keeping %d",
+                len(loaded.ids),
+                room,
+            )
+            strongest = np.argsort(-loaded.strengths, kind="stable")[:room]
+            keep = np.isin(loaded.ids, loaded.ids[strongest])
+            src, dst, wts = loaded.edge_lists()
+            within = keep[np.repeat(np.arange(len(keep)), np.diff(loaded.indptr))]
+            within &= keep[loaded.indices]
+            loaded = build_graph(src[within], dst[within], wts[within])
+        self._swap_in(loaded)
+
+    def stats(self) -> dict:
+        """Return graph size for diagnostics."""
+        return {
+            "nodes": len(self),
+            "edges": self.edge_count,
+            "pending_edges": len(self._pending) + len(self._merging),
+        }
+
+
+@lru_cache()
+def get_co_graph() -> Optional[CoRecommendationGraph]:
+    """Get the process-wide co-recommendation graph (None when disabled)."""
+    settings = get_settings()
+    if not settings.co_graph_enabled:
+        return None
+    return CoRecommendationGraph(
+        max_nodes=settings.co_graph_max_nodes,
+        damping=settings.co_graph_damping,
+        iterations=settings.co_graph_iterations,
+    )
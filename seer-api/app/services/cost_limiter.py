@@ -0,0 +1,272 @@
+"""
+Cost-based throttling of recommendation requests.
+
+Requests are charged in cost units rather than counted: prompt tokens,
+weighted completion tokens, MAL calls that missed the cache, and history
+items the server had to process. Each request first reserves an estimate
+(a running average of recent actual costs plus its history size) and is
+settled with the actual cost once it finishes, so large or expensive
+requests drain their client's budget faster.
+
+Two token buckets apply: one per client key and one shared global bucket
+sized to the upstream (OpenAI) budget. When the global bucket runs low,
+requests are degraded to the fast model only; when it cannot cover a
+request, the request is shed with 429 before any upstream call is made.
+
+Author: Runkai Zhang
+"""
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Weight of each running-average update of the per-mode cost estimate
+ESTIMATE_SMOOTHING = 0.1
+
+
+class CostLimitExceeded(Exception):
+    """The client or global budget cannot cover a request right now."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Bucket of cost units that refills continuously up to its capacity."""
+
+    __slots__ = ("capacity", "refill_per_second", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.refill_per_second,
+        )
+        self.updated_at = now
+
+    def can_cover(self, amount: float) -> bool:
+        self.refill()
+        return self.tokens >= min(amount, self.capacity)
+
+    def charge(self, amount: float) -> None:
+        """Take (or, if negative, return) units; the balance may go into debt."""
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def seconds_until(self, amount: float) -> float:
+        """Seconds until `amount` units will be available."""
+        self.refill()
+        missing = min(amount, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_per_second
+
+    @property
+    def fill_ratio(self) -> float:
+        return max(self.tokens, 0.0) / self.capacity
+
+
+@dataclass
+class RequestCost:
+    """What a finished request actually used."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    mal_calls: int = 0
+    history_items: int = 0
+
+
+class Reservation:
+    """Cost units reserved for one request, settled when it finishes."""
+
+    def __init__(
+        self,
+        limiter: "CostLimiter",
+        client: Optional[TokenBucket],
+        mode: str,
+        estimate: float,
+        degraded: bool,
+    ):
+        self.limiter = limiter
+        self.client = client
+        self.mode = mode
+        self.estimate = estimate
+        self.degraded = degraded
+        self.settled = False
+
+    def settle(self, cost: Optional[RequestCost]) -> float:
+        """
+        Replace the estimate with the actual cost.
+
+        Args:
+            cost: Actual usage, or None to keep the estimate (e.g. on errors)
+
+        Returns:
+            The amount finally charged
+        """
+        if self.settled or self.client is None:
+            return 0.0
+        self.settled = True
+        if cost is None:
+            return self.estimate
+        actual = self.limiter.units(cost)
+        self.client.charge(actual - self.estimate)
+        self.limiter.global_bucket.charge(actual - self.estimate)
+        # The estimate base covers the upstream part; history size is added per request
+        self.limiter.observe(
+            self.mode, actual - cost.history_items * self.limiter.history_item_cost
+        )
+        return actual
+
+
+class CostLimiter:
+    """Per-client and global token buckets charged by request cost."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        client_capacity: float = 50_000,
+        client_refill_per_hour: float = 250_000,
+        global_capacity: float = 200_000,
+        global_refill_per_minute: float = 200_000,
+        degrade_threshold: float = 0.25,
+        completion_weight: float = 4.0,
+        mal_call_cost: float = 100.0,
+        history_item_cost: float = 1.0,
+        default_estimate: float = 3000.0,
+        max_clients: int = 10_000,
+    ):
+        self.enabled = enabled
+        self.client_capacity = client_capacity
+        self.client_refill_per_second = client_refill_per_hour / 3600
+        self.global_bucket = TokenBucket(global_capacity, global_refill_per_minute / 60)
+        self.degrade_threshold = degrade_threshold
+        self.completion_weight = completion_weight
+        self.mal_call_cost = mal_call_cost
+        self.history_item_cost = history_item_cost
+        self.default_estimate = default_estimate
+        # Idle buckets are dropped once they would have refilled completely
+        # (twice the time from empty, to also cover moderate debt)
+        self.clients: BoundedTTLCache[TokenBucket] = BoundedTTLCache(
+            max_entries=max_clients,
+            ttl_seconds=2 * client_capacity / self.client_refill_per_second,
+        )
+        self._estimates: Dict[str, float] = {}
+        self.shed = 0
+        self.degraded = 0
+
+    def units(self, cost: RequestCost) -> float:
+        """Convert usage to cost units."""
+        return (
+            cost.prompt_tokens
+            + cost.completion_tokens * self.completion_weight
+            + cost.mal_calls * self.mal_call_cost
+            + cost.history_items * self.history_item_cost
+        )
+
+    def estimate(self, mode: str, history_items: int) -> float:
+        """Expected cost of a request before it runs."""
+        base = self._estimates.get(mode, self.default_estimate)
+        return base + history_items * self.history_item_cost
+
+    def observe(self, mode: str, upstream_units: float) -> None:
+        """Fold a finished request's upstream cost into the per-mode estimate."""
+        previous = self._estimates.get(mode, self.default_estimate)
+        self._estimates[mode] = previous + ESTIMATE_SMOOTHING * (
+            upstream_units - previous
+        )
+
+    def reserve(self, client_key: str, mode: str, history_items: int) -> Reservation:
+        """
+        Reserve the estimated cost of a request.
+
+        Args:
+            client_key: Identifies the caller (e.g. its IP address)
+            mode: Recommendation mode, used for the estimate
+            history_items: History items the request makes the server process
+
+        Returns:
+            A reservation to settle when the request finishes
+
+        Raises:
+            CostLimitExceeded: If the client or global budget is exhausted
+        """
+        if not self.enabled:
+            return Reservation(self, None, mode, 0.0, degraded=False)
+
+        estimate = self.estimate(mode, history_items)
+        client = self.clients.get(client_key)
+        if client is None:
+            client = TokenBucket(self.client_capacity, self.client_refill_per_second)
+        # Re-set on every request so active clients are never evicted
+        self.clients.set(client_key, client)
+
+        if not client.can_cover(estimate):
+            self.shed += 1
+            raise CostLimitExceeded(
+                "Recommendation budget exceeded - please try again later",
+                retry_after=client.seconds_until(estimate),
+            )
+        if not self.global_bucket.can_cover(estimate):
+            self.shed += 1
+            logger.warning("Global cost budget exhausted, shedding request")
+            raise CostLimitExceeded(
+                "The service is busy - please try again shortly",
+                retry_after=self.global_bucket.seconds_until(estimate),
+            )
+
+        client.charge(estimate)
+        self.global_bucket.charge(estimate)
+        # Keep serving everyone on the cheap tier rather than running dry
+        degraded = self.global_bucket.fill_ratio < self.degrade_threshold
+        if degraded:
+            self.degraded += 1
+        return Reservation(self, client, mode, estimate, degraded)
+
+    def stats(self) -> dict:
+        """Return limiter state for diagnostics."""
+        return {
+            "enabled": self.enabled,
+            "clients": len(self.clients),
+            "global_fill_ratio": round(self.global_bucket.fill_ratio, 3),
+            "estimates": {k: round(v) for k, v in self._estimates.items()},
+            "shed": self.shed,
+            "degraded": self.degraded,
+        }
+
+
+def retry_after_header(seconds: float) -> str:
+    """Format a Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+@lru_cache()
+def get_cost_limiter() -> CostLimiter:
+    """Get the process-wide cost limiter."""
+    settings = get_settings()
+    return CostLimiter(
+        enabled=settings.cost_limit_enabled,
+        client_capacity=settings.cost_client_capacity,
+        client_refill_per_hour=settings.cost_client_refill_per_hour,
+        global_capacity=settings.cost_global_capacity,
+        global_refill_per_minute=settings.cost_global_refill_per_minute,
+        degrade_threshold=settings.cost_degrade_threshold,
+        completion_weight=settings.cost_completion_weight,
+        mal_call_cost=settings.cost_mal_call,
+        history_item_cost=settings.cost_history_item,
+    )
@@ -0,0 +1,235 @@
+"""
+Hedged upstream calls and quorum gathering to cut tail latency.
+
+`Hedger.run` starts a call and, if it has not finished by the time most calls
+usually have (an adaptive percentile of recent latencies), starts a duplicate
+and returns whichever finishes first. Duplicates are paid for from a
+`HedgeBudget` that only earns a fraction of a hedge per primary call, so
+hedging can never add more than that fraction of extra upstream load.
+Attempts that are cancelled (usually a slow primary losing to its hedge) still
+record their elapsed time as a lower bound, so the percentile is not built
+from the fast survivors alone.
+
+`gather_quorum` waits for a set of calls like `asyncio.gather`, but returns
+once a quorum has arrived and the stragglers have had a short grace period.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Sequence, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Below this many samples the hedge delay falls back to the initial delay
+MIN_LATENCY_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies, in seconds."""
+
+    def __init__(self, window: int = 256):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        """Record a call's latency, or a lower bound for a cancelled call."""
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return the latency at `fraction` (0-1), or None with too few samples."""
+        if len(self._samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(fraction * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+class HedgeBudget:
+    """
+    Token bucket that limits hedges to a fraction of primary calls.
+
+    Every primary call deposits `ratio` tokens (up to `burst`) and every hedge
+    withdraws one, so over time hedges are at most `ratio` of primaries.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def deposit(self) -> None:
+        """Credit one primary call."""
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one hedge from the budget if available."""
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class Hedger:
+    """Runs calls with an adaptive, budgeted hedge."""
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        initial_delay: float = 0.5,
+        min_delay: float = 0.05,
+        max_delay: float = 2.0,
+        budget_ratio: float = 0.05,
+    ):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(budget_ratio)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the primary call before hedging."""
+        observed = self.latencies.percentile(self.percentile)
+        if observed is None:
+            return self.initial_delay
+        return min(max(observed, self.min_delay), self.max_delay)
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `call`, hedging it with a second attempt if it is slow.
+
+        Args:
+            call: Factory for the awaitable; invoked once more for the hedge
+
+        Returns:
+            The result of whichever attempt succeeded first
+
+        Raises:
+            Exception: The primary's error if every attempt failed
+        """
+        self.calls += 1
+        self.budget.deposit()
+        primary = asyncio.ensure_future(self._timed(call))
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+            if done or not self.budget.try_spend():
+                if not done:
+                    self.budget_denied += 1
+                return await primary
+
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self._timed(call))
+            attempts.append(hedge)
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; report the primary's error
+            return primary.result()
+        finally:
+            # Cancel the losing attempt (or both, if we were cancelled)
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    async def _timed(self, call: Callable[[], Awaitable[T]]) -> T:
+        started_at = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # Censored sample: the call would have taken at least this long.
+            # Without it the slow tail never lands in the window, the hedge
+            # delay drifts down and hedges fire ever more often.
+            self.latencies.record(time.perf_counter() - started_at)
+            raise
+        self.latencies.record(time.perf_counter() - started_at)
+        return result
+
+    def stats(self) -> dict:
+        """Return hedging counters for diagnostics."""
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+        }
+
+
+async def gather_quorum(
+    awaitables: Sequence[Awaitable[T]], quorum: int, grace: float
+) -> List[Optional[T]]:
+    """
+    Await calls until `quorum` have succeeded, then give the rest `grace` seconds.
+
+    Calls still running after the grace period are left to finish in the
+    background (their results typically land in a cache) and are reported as
+    None, as are calls that failed.
+
+    Args:
+        awaitables: Calls to run concurrently
+        quorum: Successful results needed before the grace period starts
+        grace: Seconds to wait for stragglers once the quorum is reached
+
+    Returns:
+        Results in the order of `awaitables`, None where missing
+
+    Raises:
+        Exception: The first error, if every call failed
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in awaitables]
+    if not tasks:
+        return []
+    quorum = max(1, min(quorum, len(tasks)))
+
+    pending = set(tasks)
+    succeeded = 0
+    deadline: Optional[float] = None
+    loop = asyncio.get_running_loop()
+    while pending:
+        timeout = None if deadline is None else max(deadline - loop.time(), 0.0)
+        done, pending = await asyncio.wait(
+            pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        if not done:
+            break
+        succeeded += sum(1 for task in done if task.exception() is None)
+        if deadline is None and succeeded >= quorum:
+            deadline = loop.time() + grace
+
+    for task in pending:
+        task.add_done_callback(_discard_result)
+
+    finished = [t for t in tasks if t.done()]
+    if finished and all(t.exception() is not None for t in finished) and not pending:
+        raise finished[0].exception()
+
+    return [
+        task.result() if task.done() and task.exception() is None else None
+        for task in tasks
+    ]
+
+
+def _discard_result(task: "asyncio.Future") -> None:
+    # Retrieve the outcome of an abandoned straggler so asyncio doesn't warn
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Straggler failed after quorum: %s", task.exception())
@@ -0,0 +1,238 @@
+"""
+Content-addressed store for validated anime histories.
+
+After a full `anime_history` has been validated, it is stored under a hash of
+its normalized content and the hash is returned to the client. Follow-up
+requests can then send only `{base_hash, appended_items, rating_changes}`
+instead of the whole history. The store is a bounded ephemeral cache, so a base
+can disappear at any time; clients must fall back to resending the full
+history when that happens.
+
+Each stored history also carries the set of its MAL IDs and its liked and
+disliked IDs. A delta derives them from its base, so a request never has to
+walk the whole history to find out what the user has seen or rated.
+
+Stored items keep only the part of the synopsis that prompts show, and the
+store is bounded by the total number of items as well as by entry count, so
+a few huge histories cannot take up unbounded memory.
+
+Author: Runkai Zhang
+"""
+
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import get_settings
+from app.schemas import AnimeHistoryItem, HistoryDelta, UserRatingEnum
+from app.services.anime_record import HISTORY_SYNOPSIS_CHARS
+from app.services.cache import BoundedTTLCache
+from app.services.seen import SeenSet
+
+
+class HistoryBaseEvictedError(Exception):
+    """Raised when a delta references a history hash the server no longer holds."""
+
+
+class HistoryDeltaError(Exception):
+    """Raised when a delta cannot be applied to its base history."""
+
+
+@dataclass(frozen=True)
+class StoredHistory:
+    """A validated history together with the digest of each item."""
+
+    items: Tuple[AnimeHistoryItem, ...]
+    item_digests: Tuple[bytes, ...]
+    # Every MAL ID in the history; shared between requests, so copy before adding
+    anime_ids: SeenSet
+    # Positively and negatively rated MAL IDs, in history order
+    liked_ids: Tuple[int, ...]
+    disliked_ids: Tuple[int, ...]
+
+    @property
+    def content_hash(self) -> str:
+        """Hash of the whole history, derived from the per-item digests."""
+        return self.prefix_hash(len(self.item_digests))
+
+    def prefix_hash(self, length: int) -> str:
+        """Hash of the first `length` items, as if they were the whole history."""
+        return hashlib.sha256(b"".join(self.item_digests[:length])).hexdigest()[:32]
+
+    @classmethod
+    def from_items(cls, items: Sequence[AnimeHistoryItem]) -> "StoredHistory":
+        """Trim and digest a validated history."""
+        trimmed = tuple(_trim(item) for item in items)
+        liked_ids, disliked_ids = _rated_ids(trimmed)
+        return cls(
+            items=trimmed,
+            item_digests=tuple(_item_digest(i) for i in trimmed),
+            anime_ids=SeenSet(item.mal_id for item in trimmed),
+            liked_ids=liked_ids,
+            disliked_ids=disliked_ids,
+        )
+
+    def extend(self, items: Sequence[AnimeHistoryItem]) -> "StoredHistory":
+        """
+        Return this history with validated items appended.
+
+        Only the new items are trimmed, digested and scanned for ratings.
+
+        Args:
+            items: Validated history items to append
+
+        Returns:
+            The extended history (not stored)
+        """
+        if not items:
+            return self
+        appended = tuple(_trim(item) for item in items)
+        liked, disliked = _rated_ids(appended)
+        anime_ids = self.anime_ids.copy()
+        anime_ids.update(item.mal_id for item in appended)
+        return StoredHistory(
+            items=self.items + appended,
+            item_digests=self.item_digests + tuple(_item_digest(i) for i in appended),
+            anime_ids=anime_ids,
+            liked_ids=self.liked_ids + liked,
+            disliked_ids=self.disliked_ids + disliked,
+        )
+
+
+def _trim(item: AnimeHistoryItem) -> AnimeHistoryItem:
+    """Drop the part of the synopsis that prompts never show."""
+    if item.synopsis and len(item.synopsis) > HISTORY_SYNOPSIS_CHARS + 1:
+        return item.model_copy(
+            update={"synopsis": item.synopsis[: HISTORY_SYNOPSIS_CHARS + 1]}
+        )
+    return item
+
+
+def _rated_ids(
+    items: Sequence[AnimeHistoryItem],
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """
+    Split history items into liked and disliked MAL IDs, keeping history order.
+
+    Args:
+        items: Validated history items
+
+    Returns:
+        Liked IDs and disliked IDs
+    """
+    liked, disliked = [], []
+    for item in items:
+        if item.rating is None:
+            continue
+        if item.rating.value == "positive":
+            liked.append(item.mal_id)
+        elif item.rating.value == "negative":
+            disliked.append(item.mal_id)
+    return tuple(liked), tuple(disliked)
+
+
+def _rerated(
+    history: StoredHistory, rating_changes: Dict[int, Optional[UserRatingEnum]]
+) -> StoredHistory:
+    """Apply rating changes; the rated lists are rebuilt to keep history order."""
+    items = list(history.items)
+    digests = list(history.item_digests)
+    positions: Dict[int, int] = {item.mal_id: i for i, item in enumerate(items)}
+    for mal_id, rating in rating_changes.items():
+        position = positions.get(mal_id)
+        if position is None:
+            raise HistoryDeltaError(
+                f"Cannot change rating of anime {mal_id}: not in base history"
+            )
+        items[position] = items[position].model_copy(update={"rating": rating})
+        digests[position] = _item_digest(items[position])
+
+    liked_ids, disliked_ids = _rated_ids(items)
+    return StoredHistory(
+        items=tuple(items),
+        item_digests=tuple(digests),
+        # Re-rating never changes which anime are in the history
+        anime_ids=history.anime_ids,
+        liked_ids=liked_ids,
+        disliked_ids=disliked_ids,
+    )
+
+
+def _item_digest(item: AnimeHistoryItem) -> bytes:
+    """Digest of a single normalized history item."""
+    # Serialized in field declaration order, so equal items hash equally
+    return hashlib.sha256(item.model_dump_json().encode("utf-8")).digest()
+
+
+class HistoryStore:
+    """Bounded cache of validated histories keyed by their content hash."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, max_items: int):
+        # Weighted by item count; least recently used histories go first
+        self._cache: BoundedTTLCache[StoredHistory] = BoundedTTLCache(
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+            max_weight=max_items,
+            weigher=lambda stored: len(stored.items),
+        )
+
+    def put(self, items: List[AnimeHistoryItem]) -> StoredHistory:
+        """
+        Store a full, already validated history.
+
+        Args:
+            items: Validated history items
+
+        Returns:
+            The stored history; its `content_hash` is the client's next `base_hash`
+        """
+        return self._store(StoredHistory.from_items(items))
+
+    def apply_delta(self, delta: HistoryDelta) -> StoredHistory:
+        """
+        Rebuild a full history from a stored base and a delta.
+
+        Only appended and re-rated items are hashed again, and the seen and
+        rated IDs are extended from the base's, so an append-only delta costs
+        time proportional to its own size rather than the history's.
+
+        Args:
+            delta: Base hash plus appended items and rating changes
+
+        Returns:
+            The reconstructed history, stored under its own content hash
+
+        Raises:
+            HistoryBaseEvictedError: If the base hash is unknown or expired
+            HistoryDeltaError: If a rating change targets an anime not in the history
+        """
+        base = self._cache.get(delta.base_hash)
+        if base is None:
+            raise HistoryBaseEvictedError(
+                f"History {delta.base_hash} is no longer cached. "
+                "Resend the full anime_history."
+            )
+
+        if delta.rating_changes:
+            base = _rerated(base, delta.rating_changes)
+        return self._store(base.extend(delta.appended_items))
+
+    def _store(self, stored: StoredHistory) -> StoredHistory:
+        self._cache.set(stored.content_hash, stored)
+        return stored
+
+    def stats(self) -> dict:
+        """Return cache statistics for diagnostics."""
+        return self._cache.stats()
+
+
+@lru_cache()
+def get_history_store() -> HistoryStore:
+    """Get the process-wide history store."""
+    settings = get_settings()
+    return HistoryStore(
+        max_entries=settings.history_cache_max_entries,
+        ttl_seconds=settings.history_cache_ttl_seconds,
+        max_items=settings.history_cache_max_items,
+    )
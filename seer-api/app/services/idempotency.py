@@ -0,0 +1,154 @@
+"""
+Duplicate suppression for recommendation requests.
+
+Double-clicks, retries from flaky mobile connections and clients re-sending
+after a timeout all produce copies of the same /api/recommend request. Each
+request is identified by its client address plus either its Idempotency-Key
+header or, when there is none, a hash of its body:
+
+- a copy of a request that is still running attaches to that request's
+  computation instead of starting its own;
+- a copy of a request that completed recently gets the stored result.
+
+Either way the copy makes no MAL or OpenAI calls and is not charged to the
+cost limiter. Results of requests without a key are kept only briefly, since
+an identical body sent much later may be a deliberate new request. Failures
+are not stored, so retrying after an error computes again.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import hashlib
+import json
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an idempotency key is reused with a different request body."""
+
+
+def request_fingerprint(body: BaseModel) -> str:
+    """Hash of a request body that ignores field order and formatting."""
+    canonical = json.dumps(
+        body.model_dump(mode="json"), sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Coalesces in-flight duplicates and replays recently completed results."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 600.0,
+        body_ttl_seconds: float = 30.0,
+    ):
+        # Request key -> (body fingerprint, result)
+        self.completed: BoundedTTLCache[Tuple[str, Any]] = BoundedTTLCache(
+            max_entries=max_entries, ttl_seconds=ttl_seconds
+        )
+        # How long results of requests without an Idempotency-Key are kept
+        self.body_ttl_seconds = body_ttl_seconds
+        self._inflight: Dict[str, Tuple[str, "asyncio.Task[Any]"]] = {}
+        self.computed = 0
+        self.coalesced = 0
+        self.replayed = 0
+
+    async def run(
+        self,
+        client: str,
+        idempotency_key: Optional[str],
+        fingerprint: str,
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        Return the result of a request, computing it only once per duplicate set.
+
+        Args:
+            client: Client identifier that keys are scoped to (e.g. IP address)
+            idempotency_key: Idempotency-Key header, or None to key by body
+            fingerprint: `request_fingerprint` of the request body
+            compute: Produces the result; only called for the first request
+
+        Returns:
+            The result and whether it came from an earlier request
+
+        Raises:
+            IdempotencyKeyReused: If the key belongs to a different body
+            Exception: Whatever `compute` raised, for every attached request
+        """
+        if idempotency_key is None:
+            key, ttl = f"{client}:body:{fingerprint}", self.body_ttl_seconds
+        else:
+            key, ttl = f"{client}:key:{idempotency_key}", None
+
+        stored = self.completed.get(key)
+        if stored is not None:
+            self._check(stored[0], fingerprint)
+            self.replayed += 1
+            return stored[1], True
+
+        running = self._inflight.get(key)
+        if running is not None:
+            self._check(running[0], fingerprint)
+            self.coalesced += 1
+            return await asyncio.shield(running[1]), True
+
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = (fingerprint, task)
+        task.add_done_callback(lambda t: self._finished(key, fingerprint, ttl, t))
+        self.computed += 1
+        # Shielded so the first client going away does not cancel the others
+        return await asyncio.shield(task), False
+
+    @staticmethod
+    def _check(stored_fingerprint: str, fingerprint: str) -> None:
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyKeyReused(
+                "Idempotency-Key was already used for a different request"
+            )
+
+    def _finished(
+        self,
+        key: str,
+        fingerprint: str,
+        ttl: Optional[float],
+        task: "asyncio.Task[Any]",
+    ) -> None:
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        # Also retrieves the error in case every waiting client went away
+        if task.exception() is None:
+            self.completed.set(key, (fingerprint, task.result()), ttl_seconds=ttl)
+
+    def stats(self) -> dict:
+        """Return store size and duplicate counters for diagnostics."""
+        return {
+            "stored": len(self.completed),
+            "in_flight": len(self._inflight),
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
+
+
+@lru_cache()
+def get_idempotency_store() -> Optional[IdempotencyStore]:
+    """Get the process-wide idempotency store (None when disabled)."""
+    settings = get_settings()
+    if not settings.idempotency_enabled:
+        return None
+    return IdempotencyStore(
+        max_entries=settings.idempotency_max_entries,
+        ttl_seconds=settings.idempotency_ttl_seconds,
+        body_ttl_seconds=settings.idempotency_body_ttl_seconds,
+    )
@@ -0,0 +1,435 @@
+"""
+Caching proxy for anime poster images.
+
+`/api/image/{mal_id}` serves a poster resized to one of a few fixed widths,
+encoded as WebP when the client accepts it and JPEG otherwise. The original
+is fetched from the MAL CDN once per variant, resized off the event loop and
+written to a size-bounded disk cache, so repeated requests never touch MAL.
+
+Since every new variant costs a MAL details call, a CDN fetch and a decode,
+each client may only trigger a limited number of renders per minute, and
+anime without a poster are remembered for a while so walking IDs does not
+repeat the lookups.
+
+Resizing needs the optional Pillow package; without it the original image is
+cached and served unchanged, with the media type of its actual format.
+
+Cached files are read into memory before the proxy yields to other requests,
+so a concurrent eviction can never remove a file a response is about to send.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import io
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+from app.services.cost_limiter import CostLimitExceeded, TokenBucket
+from app.services.mal_client import MALClient, get_mal_client
+
+
+@lru_cache()
+def pillow() -> Optional[ModuleType]:
+    """Pillow's Image module, imported on first use (None if not installed)."""
+    try:
+        from PIL import Image
+    except ImportError:  # pragma: no cover - optional dependency
+        return None
+    return Image
+
+
+# Widths we render; requested widths snap up to the next one so the number of
+# cached variants per anime stays small
+THUMBNAIL_WIDTHS = (120, 240, 480)
+DEFAULT_WIDTH = 240
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+# Leading bytes of the formats the MAL CDN serves, to label unresized originals
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class ImageNotFound(Exception):
+    """The anime does not exist or has no poster."""
+
+
+class ImageUpstreamError(Exception):
+    """The image CDN returned something that is not a usable image."""
+
+
+@dataclass(frozen=True)
+class CachedImage:
+    """An image read from the disk cache, with its file metadata."""
+
+    data: bytes
+    stat_result: os.stat_result
+    media_type: str
+
+
+def sniff_media_type(data: bytes) -> Optional[str]:
+    """Media type of an image from its leading bytes (None if unrecognised)."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in SIGNATURES:
+        if data.startswith(signature):
+            return media_type
+    return None
+
+
+def snap_width(width: Optional[int]) -> int:
+    """Round a requested width up to the nearest rendered width."""
+    if not width:
+        return DEFAULT_WIDTH
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def choose_format(accept: str) -> str:
+    """Pick WebP when the client lists it in its Accept header, else JPEG."""
+    if pillow() is not None and "image/webp" in accept.lower():
+        return "webp"
+    return "jpeg"
+
+
+def render_thumbnail(data: bytes, width: int, fmt: str, quality: int) -> bytes:
+    """
+    Resize an image to at most `width` pixels wide and re-encode it.
+
+    Args:
+        data: Original image bytes
+        width: Maximum output width (the aspect ratio is kept)
+        fmt: "webp" or "jpeg"
+        quality: Encoder quality (1-100)
+
+    Returns:
+        Encoded thumbnail bytes
+    """
+    Image = pillow()
+    with Image.open(io.BytesIO(data)) as image:
+        # thumbnail() lets the JPEG decoder downscale while decoding
+        image.thumbnail((width, image.height), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        if fmt == "webp":
+            image.save(output, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class ImageDiskCache:
+    """
+    Directory of rendered images with a total size limit.
+
+    Files are evicted least recently used first. Recency is tracked in memory
+    and seeded from file access times, which are bumped on every hit so the
+    order survives restarts (modification times, and with them the ETags
+    derived from them, stay unchanged).
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        entries = []
+        for path in self.directory.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                stat_result = path.stat()
+                entries.append((stat_result.st_atime, path.name, stat_result.st_size))
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def get(self, name: str) -> Optional[Tuple[bytes, os.stat_result]]:
+        """Read a cached file and its metadata, and mark it as recently used."""
+        if name not in self._sizes:
+            self.misses += 1
+            return None
+        path = self.directory / name
+        try:
+            with open(path, "rb") as f:
+                stat_result = os.fstat(f.fileno())
+                data = f.read()
+            os.utime(path, (time.time(), stat_result.st_mtime))
+        except OSError:
+            # Removed behind our back
+            self.total_bytes -= self._sizes.pop(name)
+            self.misses += 1
+            return None
+        self._sizes.move_to_end(name)
+        self.hits += 1
+        return data, stat_result
+
+    def put(self, name: str, data: bytes) -> os.stat_result:
+        """
+        Atomically write a file into the cache, evicting old ones if full.
+
+        Returns:
+            Metadata of the written file
+        """
+        path = self.directory / name
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            stat_result = path.stat()
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self.total_bytes += len(data) - self._sizes.pop(name, 0)
+        self._sizes[name] = len(data)
+        self._evict(keep=name)
+        return stat_result
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        while self.total_bytes > self.max_bytes and self._sizes:
+            name, size = next(iter(self._sizes.items()))
+            if name == keep:
+                break
+            del self._sizes[name]
+            self.total_bytes -= size
+            try:
+                os.unlink(self.directory / name)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Return size and hit/miss counters for diagnostics."""
+        return {
+            "files": len(self._sizes),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ImageProxy:
+    """Fetches, resizes and caches anime posters."""
+
+    def __init__(
+        self,
+        mal_client: MALClient,
+        cache: ImageDiskCache,
+        upstream_base_url: Optional[str] = None,
+        quality: int = 80,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        renders_per_minute: float = 60.0,
+        missing_ttl_seconds: float = 3600.0,
+        max_clients: int = 10_000,
+    ):
+        self.mal_client = mal_client
+        self.cache = cache
+        # Replaces scheme and host of MAL CDN URLs, e.g. a local image server
+        self.upstream_base_url = upstream_base_url
+        self.quality = quality
+        self.transport = transport
+        # Concurrent requests for the same variant share one render
+        self._inflight: Dict[str, "asyncio.Task[Tuple[bytes, os.stat_result]]"] = {}
+        # Renders each client may start: a minute's worth of burst
+        self.renders_per_minute = renders_per_minute
+        self._render_budgets: BoundedTTLCache[TokenBucket] = BoundedTTLCache(
+            max_entries=max_clients, ttl_seconds=120
+        )
+        # MAL ID -> reason, for anime that have no poster
+        self._missing: BoundedTTLCache[str] = BoundedTTLCache(
+            max_entries=50_000, ttl_seconds=missing_ttl_seconds
+        )
+        self.upstream_fetches = 0
+        self.renders_denied = 0
+
+    async def thumbnail(
+        self, mal_id: int, width: int, fmt: str, client_key: Optional[str] = None
+    ) -> CachedImage:
+        """
+        Return a cached thumbnail, rendering it first if needed.
+
+        Args:
+            mal_id: MAL anime ID
+            width: One of THUMBNAIL_WIDTHS
+            fmt: "webp" or "jpeg"
+            client_key: Caller whose render budget pays for a new render
+
+        Returns:
+            The image, with the metadata of its cache file
+
+        Raises:
+            ImageNotFound: If the anime has no poster
+            ImageUpstreamError: If the CDN response is not a decodable image
+            CostLimitExceeded: If the caller may not start another render yet
+            httpx.HTTPError: If MAL or the CDN request fails
+        """
+        if pillow() is None:
+            # Nothing to resize with; cache the original as-is
+            width, fmt = 0, "original"
+        name = f"{mal_id}-{width}.{fmt}"
+        cached = self.cache.get(name)
+        if cached is not None:
+            return self._cached_image(fmt, *cached)
+
+        missing = self._missing.get(mal_id)
+        if missing is not None:
+            raise ImageNotFound(missing)
+
+        task = self._inflight.get(name)
+        if task is None:
+            self._charge_render(client_key)
+            task = asyncio.ensure_future(self._render(name, mal_id, width, fmt))
+            self._inflight[name] = task
+            task.add_done_callback(lambda t: self._finished(name, t))
+        # Shielded so one client disconnecting does not cancel the others' render
+        return self._cached_image(fmt, *await asyncio.shield(task))
+
+    @staticmethod
+    def _cached_image(
+        fmt: str, data: bytes, stat_result: os.stat_result
+    ) -> CachedImage:
+        media_type = MEDIA_TYPES.get(fmt) or sniff_media_type(data)
+        return CachedImage(data, stat_result, media_type or "application/octet-stream")
+
+    def _finished(
+        self, name: str, task: "asyncio.Task[Tuple[bytes, os.stat_result]]"
+    ) -> None:
+        self._inflight.pop(name, None)
+        # Retrieve the error in case every waiting client went away
+        if not task.cancelled():
+            task.exception()
+
+    def _charge_render(self, client_key: Optional[str]) -> None:
+        """Take one render from a client's budget."""
+        if client_key is None:
+            return
+        bucket = self._render_budgets.get(client_key)
+        if bucket is None:
+            bucket = TokenBucket(self.renders_per_minute, self.renders_per_minute / 60)
+        # Re-set on every render so active clients are never evicted
+        self._render_budgets.set(client_key, bucket)
+        if not bucket.can_cover(1):
+            self.renders_denied += 1
+            raise CostLimitExceeded(
+                "Too many new images requested - please try again later",
+                retry_after=bucket.seconds_until(1),
+            )
+        bucket.charge(1)
+
+    async def _render(
+        self, name: str, mal_id: int, width: int, fmt: str
+    ) -> Tuple[bytes, os.stat_result]:
+        try:
+            details = await self.mal_client.get_anime_details(mal_id)
+            url = self.picture_url(details or {})
+            if url is None:
+                raise ImageNotFound(f"Anime {mal_id} has no poster")
+
+            async with httpx.AsyncClient(transport=self.transport) as client:
+                response = await client.get(url, timeout=10.0, follow_redirects=True)
+                response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            # Unknown anime on MAL, or a poster missing from the CDN
+            if e.response.status_code != 404:
+                raise
+            reason = f"No poster found for anime {mal_id}"
+            self._missing.set(mal_id, reason)
+            raise ImageNotFound(reason) from e
+        except ImageNotFound as e:
+            self._missing.set(mal_id, str(e))
+            raise
+        self.upstream_fetches += 1
+
+        data = response.content
+        if width:
+            try:
+                data = await asyncio.to_thread(
+                    render_thumbnail, data, width, fmt, self.quality
+                )
+            except (OSError, pillow().DecompressionBombError) as e:
+                # UnidentifiedImageError (e.g. an HTML error page) is an OSError
+                raise ImageUpstreamError(
+                    f"Poster of anime {mal_id} could not be decoded: {e}"
+                ) from e
+        elif sniff_media_type(data) is None:
+            # Served as-is, so it must be an image browsers can show
+            raise ImageUpstreamError(
+                f"Poster of anime {mal_id} is not a supported image "
+                f"({response.headers.get('content-type', 'no content type')})"
+            )
+        return data, self.cache.put(name, data)
+
+    def picture_url(self, details: Dict[str, Any]) -> Optional[str]:
+        """Largest poster URL in MAL details, pointed at the configured upstream."""
+        picture = details.get("main_picture") or {}
+        url = picture.get("large") or picture.get("medium")
+        if not url or not self.upstream_base_url:
+            return url
+        base = urlsplit(self.upstream_base_url)
+        parts = urlsplit(url)
+        return urlunsplit(
+            (
+                base.scheme,
+                base.netloc,
+                base.path.rstrip("/") + parts.path,
+                parts.query,
+                "",
+            )
+        )
+
+    def stats(self) -> dict:
+        """Return cache and upstream counters for diagnostics."""
+        return {
+            **self.cache.stats(),
+            "upstream_fetches": self.upstream_fetches,
+            "known_missing": len(self._missing),
+            "renders_denied": self.renders_denied,
+            "resizing": pillow() is not None,
+        }
+
+
+@lru_cache()
+def get_image_proxy() -> ImageProxy:
+    """Get the process-wide image proxy."""
+    # Pillow is only imported once images are first requested
+    pillow()
+    settings = get_settings()
+    return ImageProxy(
+        get_mal_client(),
+        ImageDiskCache(
+            Path(settings.image_cache_dir),
+            max_bytes=int(settings.image_cache_max_mb * 1024 * 1024),
+        ),
+        upstream_base_url=settings.image_upstream_base_url,
+        quality=settings.image_quality,
+        renders_per_minute=settings.image_renders_per_minute,
+        missing_ttl_seconds=settings.image_missing_ttl_seconds,
+    )
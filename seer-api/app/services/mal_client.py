@@ -3,11 +3,42 @@ MyAnimeList API client for fetching anime data.
 Official API documentation: https://myanimelist.net/apiconfig/references/api/v2
 """
 
-from typing import Any, Dict, List, Optional
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
 
 from app.config import get_settings
+from app.services.anime_record import AnimeRecord
+from app.services.cache import BoundedTTLCache
+from app.services.hedging import Hedger
+from app.services.mal_keys import ClientKey, ClientKeyPool
+from app.services.title_index import TitleIndex, get_title_index
+from app.timing import stage
+
+if TYPE_CHECKING:
+    from app.services.co_graph import CoRecommendationGraph
+
+RANKING_FIELDS = "id,title,main_picture,mean,rank,popularity,genres,num_episodes,synopsis,studios,media_type,source,rating"
+
+# First page size for lazily paginated lists, and MAL's maximum page size
+RANKING_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 500
+
+
+class PageBudget:
+    """Number of uncached list pages beyond the first that a caller may fetch."""
+
+    def __init__(self, pages: int):
+        self.remaining = pages
+
+    def take(self) -> bool:
+        """Use up one page if any are left."""
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
 
 
 class MALClient:
@@ -15,9 +46,33 @@ class MALClient:
 
     BASE_URL = "https://api.myanimelist.net/v2"
 
-    def __init__(self, client_id: str):
+    def __init__(
+        self,
+        client_id: str,
+        cache_max_entries: int = 4096,
+        cache_ttl_seconds: float = 1800,
+        hedger: Optional[Hedger] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        graph: Optional["CoRecommendationGraph"] = None,
+        key_pool: Optional[ClientKeyPool] = None,
+        title_index: Optional[TitleIndex] = None,
+    ):
         self.client_id = client_id
-        self.headers = {"X-MAL-CLIENT-ID": client_id}
+        # Requests are spread over one or more client IDs (see mal_keys.py)
+        self.key_pool = key_pool or ClientKeyPool([client_id])
+        # Custom HTTP transport, e.g. recorded responses for offline evaluation
+        self.transport = transport
+        # Optional duplicate requests for slow detail fetches (see hedging.py)
+        self.hedger = hedger
+        # Co-recommendation graph fed by every details response (see co_graph.py)
+        self.graph = graph
+        # Titles of every fetched anime, for bulk title resolution
+        self.title_index = title_index
+        # Anime details and ranking pages change slowly, so repeated requests
+        # (and speculative prefetches) are served from memory.
+        self.cache: BoundedTTLCache[Any] = BoundedTTLCache(
+            max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds
+        )
 
     async def search_anime(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """
@@ -30,39 +85,63 @@ class MALClient:
         Returns:
             List of anime search results
         """
-        fields = "id,title,main_picture,synopsis,mean,rank,popularity,genres,num_episodes,media_type,studios,source"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
+        cache_key = ("search", " ".join(query.casefold().split()), limit)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        fields = "id,title,alternative_titles,main_picture,synopsis,mean,rank,popularity,genres,num_episodes,media_type,studios,source"
+        with stage("mal_search"):
+            data = await self._request(
                 f"{self.BASE_URL}/anime",
-                headers=self.headers,
-                params={"q": query, "limit": limit, "fields": fields},
-                timeout=10.0,
+                {"q": query, "limit": limit, "fields": fields},
             )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("data", [])
+        results = data.get("data", [])
+        self.cache.set(cache_key, results)
+        self._learn_titles(results)
+        return results
 
-    async def get_anime_details(self, anime_id: int) -> Optional[Dict[str, Any]]:
+    async def get_anime_details(
+        self, anime_id: int, hedge: bool = False
+    ) -> Optional[Dict[str, Any]]:
         """
         Get detailed information about a specific anime.
 
         Args:
             anime_id: MAL anime ID
+            hedge: Send a duplicate request if this one is unusually slow
+                (only for latency-critical callers; needs a configured hedger)
 
         Returns:
             Detailed anime information including genres, studios, etc.
         """
-        fields = "id,title,synopsis,mean,rank,popularity,genres,num_episodes,media_type,studios,source,rating,recommendations"
+        cache_key = ("details", anime_id)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.BASE_URL}/anime/{anime_id}",
-                headers=self.headers,
-                params={"fields": fields},
-                timeout=10.0,
-            )
-            response.raise_for_status()
-            return response.json()
+        with stage("mal_details"):
+            if hedge and self.hedger is not None:
+                details = await self.hedger.run(
+                    lambda: self._fetch_anime_details(anime_id)
+                )
+            else:
+                details = await self._fetch_anime_details(anime_id)
+
+        self.cache.set(cache_key, details)
+        if self.graph is not None:
+            self.graph.add_details(details)
+        if details:
+            self._learn_titles([details])
+        return details
+
+    async def _fetch_anime_details(self, anime_id: int) -> Dict[str, Any]:
+        """Fetch anime details from MAL, bypassing the cache."""
+        fields = "id,title,main_picture,synopsis,mean,rank,popularity,genres,num_episodes,media_type,studios,source,rating,recommendations"
+
+        return await self._request(
+            f"{self.BASE_URL}/anime/{anime_id}", {"fields": fields}
+        )
 
     async def get_anime_recommendations(
         self, anime_id: int, limit: int = 10
@@ -84,36 +163,177 @@ class MALClient:
         recommendations = anime_details.get("recommendations", [])[:limit]
         return recommendations
 
-    async def search_by_genre(
-        self, genre_ids: List[int], limit: int = 10, min_score: float = 7.0
-    ) -> List[Dict[str, Any]]:
+    async def iter_ranking(
+        self,
+        ranking_type: str = "all",
+        page_size: int = RANKING_PAGE_SIZE,
+        max_pages: int = 8,
+        budget: Optional[PageBudget] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
-        Search for anime by genre.
-        Note: The MAL API v2 doesn't directly support genre filtering in search,
-        so this is a simplified implementation that would need enhancement.
+        Lazily iterate over a MAL ranking, following `paging.next` links.
+
+        Pages are only fetched when the consumer asks for more items, so
+        stopping early costs nothing. Each page doubles in size (up to MAL's
+        maximum) to keep the number of round trips low for deep scans.
 
         Args:
-            genre_ids: List of genre IDs to filter by
-            limit: Maximum number of results
-            min_score: Minimum score threshold
+            ranking_type: MAL ranking type (e.g. "all", "airing", "bypopularity")
+            page_size: Size of the first page
+            max_pages: Maximum number of pages to fetch
+            budget: Limits uncached pages after the first (shared across lists)
+
+        Yields:
+            Ranking items in rank order
+        """
+        params: Dict[str, Any] = {
+            "ranking_type": ranking_type,
+            "limit": page_size,
+            "fields": RANKING_FIELDS,
+        }
+        async for item in self._iter_pages(
+            f"{self.BASE_URL}/anime/ranking", params, max_pages, budget
+        ):
+            yield item
+
+    async def iter_season(
+        self,
+        year: int,
+        season: str,
+        page_size: int = RANKING_PAGE_SIZE,
+        max_pages: int = 8,
+        budget: Optional[PageBudget] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Lazily iterate over a season's anime, best scored first.
+
+        Args:
+            year: Season year
+            season: "winter", "spring", "summer" or "fall"
+            page_size: Size of the first page
+            max_pages: Maximum number of pages to fetch
+            budget: Limits uncached pages after the first (shared across lists)
+
+        Yields:
+            Season list items
+        """
+        params: Dict[str, Any] = {
+            "sort": "anime_score",
+            "limit": page_size,
+            "fields": RANKING_FIELDS,
+        }
+        async for item in self._iter_pages(
+            f"{self.BASE_URL}/anime/season/{year}/{season}", params, max_pages, budget
+        ):
+            yield item
+
+    async def _iter_pages(
+        self,
+        url: str,
+        params: Dict[str, Any],
+        max_pages: int,
+        budget: Optional[PageBudget] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield the items of a paginated list, fetching pages on demand."""
+        for page_number in range(max_pages):
+            if (
+                page_number > 0
+                and budget is not None
+                and self._page_key(url, params) not in self.cache
+                and not budget.take()
+            ):
+                return
+            page = await self._get_page(url, params)
+            for item in page.get("data", []):
+                yield item
+
+            next_url = page.get("paging", {}).get("next")
+            if not next_url:
+                return
+            url, params = self._next_page(next_url)
+
+    def _next_page(self, next_url: str) -> Tuple[str, Dict[str, Any]]:
+        """Split a `paging.next` link into URL and params, growing the page size."""
+        parsed = httpx.URL(next_url)
+        params: Dict[str, Any] = dict(parsed.params)
+        limit = int(params.get("limit", RANKING_PAGE_SIZE))
+        params["limit"] = min(limit * 2, MAX_PAGE_SIZE)
+        return str(parsed.copy_with(query=None)), params
+
+    @staticmethod
+    def _page_key(url: str, params: Dict[str, Any]) -> Tuple[Any, ...]:
+        return ("page", url, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+    async def _get_page(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Fetch one page of a list endpoint, using the cache when possible."""
+        cache_key = self._page_key(url, params)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        with stage("mal_page"):
+            page = await self._request(url, params)
+
+        self.cache.set(cache_key, page)
+        self._learn_titles(page.get("data", []))
+        return page
+
+    def _learn_titles(self, items: List[Dict[str, Any]]) -> None:
+        """Add fetched anime (bare or wrapped in "node") to the title index."""
+        if self.title_index is not None:
+            self.title_index.learn(item.get("node", item) for item in items)
+
+    async def _request(self, url: str, params: Dict[str, Any]) -> Any:
+        """
+        GET a MAL API URL with a client ID from the pool.
+
+        A 429 or 403 benches the key that received it; the request is then
+        retried once with another key if the pool has one.
+
+        Args:
+            url: MAL API URL
+            params: Query parameters
 
         Returns:
-            List of anime matching criteria
-        """
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.BASE_URL}/anime/ranking",
-                headers=self.headers,
-                params={
-                    "ranking_type": "all",
-                    "limit": limit,
-                    "fields": "id,title,mean,rank,popularity,genres,num_episodes,synopsis,studios,media_type,source,rating",
-                },
-                timeout=10.0,
+            Decoded JSON response
+
+        Raises:
+            httpx.HTTPStatusError: If MAL answers with an error status
+        """
+        failed_key: Optional[ClientKey] = None
+        while True:
+            async with self.key_pool.acquire(exclude=failed_key) as key:
+                sent_at = time.monotonic()
+                async with httpx.AsyncClient(transport=self.transport) as client:
+                    response = await client.get(
+                        url,
+                        headers={"X-MAL-CLIENT-ID": key.client_id},
+                        params=params,
+                        timeout=10.0,
+                    )
+            benched = self.key_pool.report(
+                key,
+                sent_at,
+                response.status_code,
+                response.headers.get("retry-after"),
             )
+            if benched and failed_key is None and len(self.key_pool) > 1:
+                failed_key = key
+                continue
             response.raise_for_status()
-            data = response.json()
-            return data.get("data", [])
+            return response.json()
+
+    def extract_record(self, anime_data: Dict[str, Any]) -> AnimeRecord:
+        """
+        Extract a compact AnimeRecord from MAL anime data.
+
+        Args:
+            anime_data: Raw anime data from MAL API
+
+        Returns:
+            Normalized AnimeRecord
+        """
+        return AnimeRecord.from_mal(anime_data)
 
     def extract_metadata(self, anime_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -125,36 +345,37 @@ class MALClient:
         Returns:
             Normalized metadata dictionary
         """
-        # Handle both search results and detailed anime objects
-        if "node" in anime_data:
-            anime_data = anime_data["node"]
-
-        # Extract image URL (prefer medium size, fallback to large)
-        image_url = None
-        if "main_picture" in anime_data and anime_data["main_picture"]:
-            main_picture = anime_data["main_picture"]
-            image_url = main_picture.get("medium") or main_picture.get("large")
-
-        return {
-            "mal_id": anime_data.get("id"),
-            "title": anime_data.get("title", ""),
-            "genres": [g.get("name", "") for g in anime_data.get("genres", [])],
-            "studios": [s.get("name", "") for s in anime_data.get("studios", [])],
-            "episodes": anime_data.get("num_episodes"),
-            "score": str(anime_data.get("mean", "N/A"))
-            if anime_data.get("mean")
-            else "N/A",
-            "synopsis": anime_data.get("synopsis", ""),
-            "media_type": anime_data.get("media_type", ""),
-            "rating": anime_data.get("rating", ""),
-            "source": anime_data.get("source", ""),
-            "image_url": image_url,
-            "rank": anime_data.get("rank"),
-            "popularity": anime_data.get("popularity"),
-        }
+        return self.extract_record(anime_data).to_dict()
 
 
+@lru_cache()
 def get_mal_client() -> MALClient:
-    """Get MAL client instance with configured credentials."""
+    """Get the shared MAL client instance with configured credentials."""
+    # numpy (for the graph) is only imported once MAL is first needed
+    from app.services.co_graph import get_co_graph
+
     settings = get_settings()
-    return MALClient(client_id=settings.mal_client_id)
+    hedger = None
+    if settings.mal_hedge_enabled:
+        hedger = Hedger(
+            percentile=settings.mal_hedge_percentile,
+            initial_delay=settings.mal_hedge_initial_delay_ms / 1000,
+            min_delay=settings.mal_hedge_min_delay_ms / 1000,
+            max_delay=settings.mal_hedge_max_delay_ms / 1000,
+            budget_ratio=settings.mal_hedge_budget_ratio,
+        )
+    key_pool = ClientKeyPool(
+        [settings.mal_client_id, *settings.mal_extra_client_ids],
+        requests_per_second=settings.mal_key_requests_per_second,
+        burst=settings.mal_key_burst,
+        bench_seconds=settings.mal_key_bench_seconds,
+    )
+    return MALClient(
+        client_id=settings.mal_client_id,
+        cache_max_entries=settings.mal_cache_max_entries,
+        cache_ttl_seconds=settings.mal_cache_ttl_seconds,
+        hedger=hedger,
+        graph=get_co_graph(),
+        key_pool=key_pool,
+        title_index=get_title_index(),
+    )
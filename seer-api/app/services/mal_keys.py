@@ -0,0 +1,218 @@
+"""
+Pool of MyAnimeList client IDs with per-key rate budgets.
+
+MAL rate-limits each client ID separately, so spreading requests over
+several IDs raises the sustainable upstream throughput roughly linearly in
+the number of IDs. Every request takes a key from the pool:
+
+- each key has a token bucket that paces it to its own request budget;
+- among the keys with budget left, the one with the fewest requests in
+  flight is chosen (ties go to the fullest bucket);
+- a key answered with 429 or 403 is benched for a while (honouring
+  Retry-After, doubling on repeated failures) and other keys take over.
+
+When every key is benched, the one that comes back first is used anyway,
+so a pool never fails requests on its own. A pool of one key has nothing
+to balance, so its requests are not paced either: they go out as before
+and MAL's own 429s bench the key.
+
+Only requests sent after a bench has ended can clear its failure count;
+responses to requests sent earlier neither reset nor extend it.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Sequence
+
+from app.services.cost_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean the key itself is throttled or rejected
+BENCH_STATUS_CODES = (403, 429)
+
+
+class ClientKey:
+    """One MAL client ID and its budget and health."""
+
+    __slots__ = (
+        "client_id",
+        "bucket",
+        "in_flight",
+        "benched_until",
+        "failures",
+        "requests",
+        "benched",
+    )
+
+    def __init__(self, client_id: str, bucket: TokenBucket):
+        self.client_id = client_id
+        self.bucket = bucket
+        self.in_flight = 0
+        self.benched_until = 0.0
+        self.failures = 0
+        self.requests = 0
+        self.benched = 0
+
+    def is_benched(self, now: float) -> bool:
+        return self.benched_until > now
+
+    @property
+    def label(self) -> str:
+        """Key identifier that is safe to log."""
+        return f"...{self.client_id[-4:]}"
+
+
+class ClientKeyPool:
+    """Balances MAL requests over several client IDs."""
+
+    def __init__(
+        self,
+        client_ids: Sequence[str],
+        requests_per_second: float = 10.0,
+        burst: float = 30.0,
+        bench_seconds: float = 30.0,
+        max_bench_seconds: float = 600.0,
+        max_wait: float = 2.0,
+    ):
+        unique_ids = list(dict.fromkeys(cid for cid in client_ids if cid))
+        if not unique_ids:
+            raise ValueError("At least one MAL client ID is required")
+        self.keys: List[ClientKey] = [
+            ClientKey(cid, TokenBucket(burst, requests_per_second))
+            for cid in unique_ids
+        ]
+        self.bench_seconds = bench_seconds
+        self.max_bench_seconds = max_bench_seconds
+        # Longest a request waits for budget before using a key over budget
+        self.max_wait = max_wait
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _pick(self, now: float, exclude: Optional[ClientKey]) -> Optional[ClientKey]:
+        """Least-loaded healthy key with budget left, or None."""
+        best = None
+        for key in self.keys:
+            if key is exclude or key.is_benched(now) or not key.bucket.can_cover(1):
+                continue
+            if best is None or (key.in_flight, -key.bucket.tokens) < (
+                best.in_flight,
+                -best.bucket.tokens,
+            ):
+                best = key
+        return best
+
+    def _fallback(self, now: float, exclude: Optional[ClientKey]) -> ClientKey:
+        """Least-loaded healthy key regardless of budget, else the first back."""
+        candidates = [k for k in self.keys if k is not exclude] or self.keys
+        healthy = [k for k in candidates if not k.is_benched(now)]
+        if healthy:
+            return min(healthy, key=lambda k: (k.in_flight, -k.bucket.tokens))
+        return min(candidates, key=lambda k: k.benched_until)
+
+    async def _select(self, exclude: Optional[ClientKey]) -> ClientKey:
+        if len(self.keys) == 1:
+            return self.keys[0]
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            now = time.monotonic()
+            key = self._pick(now, exclude)
+            if key is not None:
+                return key
+            healthy = [
+                k for k in self.keys if k is not exclude and not k.is_benched(now)
+            ]
+            if not healthy or now >= deadline:
+                return self._fallback(now, exclude)
+            wait = min(k.bucket.seconds_until(1) for k in healthy)
+            await asyncio.sleep(min(max(wait, 0.001), deadline - now))
+
+    @asynccontextmanager
+    async def acquire(
+        self, exclude: Optional[ClientKey] = None
+    ) -> AsyncIterator[ClientKey]:
+        """
+        Take a key for one request.
+
+        Args:
+            exclude: Key to avoid if possible (e.g. the one that just failed)
+
+        Yields:
+            The key to send the request with
+        """
+        key = await self._select(exclude)
+        key.bucket.charge(1)
+        key.in_flight += 1
+        key.requests += 1
+        try:
+            yield key
+        finally:
+            key.in_flight -= 1
+
+    def report(
+        self,
+        key: ClientKey,
+        sent_at: float,
+        status_code: int,
+        retry_after: Optional[str] = None,
+    ) -> bool:
+        """
+        Record the outcome of a request sent with a key.
+
+        Args:
+            key: Key the request was sent with
+            sent_at: `time.monotonic()` when the request was sent
+            status_code: HTTP status of the response
+            retry_after: Retry-After header of the response, if any
+
+        Returns:
+            True if the key was benched (the request may be retried elsewhere)
+        """
+        now = time.monotonic()
+        if status_code not in BENCH_STATUS_CODES:
+            # Requests sent before or during a bench say nothing about whether
+            # the key has recovered
+            if not key.is_benched(now) and sent_at >= key.benched_until:
+                key.failures = 0
+            return False
+
+        if sent_at < key.benched_until:
+            # A bench that started after this request was sent covers it
+            return True
+        key.failures += 1
+        key.benched += 1
+        duration = min(
+            self.bench_seconds * 2 ** (key.failures - 1), self.max_bench_seconds
+        )
+        if retry_after and retry_after.isdigit():
+            duration = min(max(duration, float(retry_after)), self.max_bench_seconds)
+        key.benched_until = now + duration
+        logger.warning(
+            "MAL client ID %s got %d, benched for %.0f s",
+            key.label,
+            status_code,
+            duration,
+        )
+        return True
+
+    def stats(self) -> dict:
+        """Return per-key load and health for diagnostics."""
+        now = time.monotonic()
+        return {
+            "keys": [
+                {
+                    "key": key.label,
+                    "requests": key.requests,
+                    "in_flight": key.in_flight,
+                    "tokens": round(key.bucket.tokens, 1),
+                    "benched": key.benched,
+                    "benched_for_seconds": round(max(key.benched_until - now, 0.0), 1),
+                }
+                for key in self.keys
+            ],
+        }
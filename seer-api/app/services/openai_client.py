@@ -2,27 +2,108 @@
 OpenAI API client for preference extraction and recommendation ranking.
 """
 
+import asyncio
 import json
-from typing import Any, Dict, List
-
-from openai import AsyncOpenAI
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 from app.config import get_settings
+from app.services.anime_record import AnimeRecord
+from app.services.profile import PreferenceProfile
+from app.services.seen import SeenSet
+from app.timing import stage
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TokenUsage:
+    """Tokens billed for the completions behind one ranking."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, usage: Any) -> None:
+        """Add the `usage` object of an OpenAI response (ignored if missing)."""
+        if usage is None:
+            return
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+@dataclass
+class RankingResult:
+    """The candidate chosen by the model and how it was chosen."""
+
+    anime: AnimeRecord
+    reason: str
+    tier: str  # "fast", "full" or "fallback"
+    confidence: Optional[float] = None
+    usage: TokenUsage = field(default_factory=TokenUsage)
 
 
 class OpenAIRecommendationClient:
-    """Client for using OpenAI to extract preferences and rank anime recommendations."""
+    """Client for using OpenAI to extract preferences and rank anime recommendations.
 
-    def __init__(self, api_key: str, model: str = "gpt-5-thinking"):
-        self.client = AsyncOpenAI(api_key=api_key)
+    Ranking uses a two-tier cascade when `fast_model` is set: the fast model
+    picks first, and the full model is only asked when the fast answer is
+    invalid, picks an unknown candidate, times out or reports low confidence.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-5-thinking",
+        fast_model: Optional[str] = None,
+        confidence_threshold: float = 0.7,
+        fast_timeout: float = 8.0,
+        timeout: float = 60.0,
+    ):
+        self.api_key = api_key
+        self._client: Optional["AsyncOpenAI"] = None
         self.model = model
+        self.fast_model = fast_model
+        self.confidence_threshold = confidence_threshold
+        self.fast_timeout = fast_timeout
+        self.timeout = timeout
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """OpenAI SDK client, imported and created on first use to keep startup fast."""
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(api_key=self.api_key)
+        return self._client
+
+    @client.setter
+    def client(self, client: "AsyncOpenAI") -> None:
+        self._client = client
 
     async def rank_for_similar(
         self,
-        candidates: List[Dict[str, Any]],
-        anime_history: List[Dict[str, Any]],
-        seen_anime_ids: List[int],
-    ) -> Dict[str, Any]:
+        candidates: List[AnimeRecord],
+        anime_history: List[AnimeRecord],
+        seen_anime_ids: SeenSet,
+        profile: Optional[PreferenceProfile] = None,
+        fast_only: bool = False,
+    ) -> Optional[RankingResult]:
         """
         Select a recommendation similar to what the user already enjoys.
 
@@ -32,33 +113,40 @@ class OpenAIRecommendationClient:
         Args:
             candidates: List of candidate anime
             anime_history: User's viewing history with ratings
-            seen_anime_ids: List of MAL IDs the user has already seen
+            seen_anime_ids: MAL IDs the user has already seen or excluded
+            profile: Preference profile summarising the whole history
+            fast_only: Never escalate to the full model (used under load)
 
         Returns:
-            Recommendation that matches user's established preferences
+            Selected anime with the reason it was recommended and the model tier used
         """
         # Filter out already seen anime
-        candidates = [c for c in candidates if c.get("mal_id") not in seen_anime_ids]
+        candidates = [c for c in candidates if c.mal_id not in seen_anime_ids]
 
         if not candidates:
             return None
 
         # Get liked anime for pattern matching
-        liked_anime = [h for h in anime_history if h.get("user_rating") == "positive"]
+        liked_anime = [h for h in anime_history if h.user_rating == "positive"]
 
         # Format for prompt
-        candidates_text = self._format_candidates(
-            candidates[:20]
-        )  # Increased from 12 to 20
-        liked_text = self._build_history_context(
-            liked_anime[-8:]
-        )  # Increased from 3 to 8
+        with stage("prompt"):
+            candidates_text = self._format_candidates(
+                candidates[:20]
+            )  # Increased from 12 to 20
+            liked_text = self._build_history_context(
+                liked_anime[-8:]
+            )  # Increased from 3 to 8
+            profile_text = self._build_profile_context(profile)
 
         prompt = f"""You are an anime recommender finding similar anime to what the user loves.
 
 What the User Loved:
 {liked_text}
 
+User's Taste Profile (whole history, recent items weigh more):
+{profile_text}
+
 Available Candidates:
 {candidates_text}
 
@@ -75,49 +163,28 @@ Return JSON with:
 - mal_id: Selected anime's MAL ID
 - title: Anime title
 - reason: 2 sentences explaining the similarities and why they'll love it
+- confidence: Number from 0 to 1 for how sure you are this is the best candidate
 
 Return ONLY the JSON object."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert at finding anime similar to what users already love.",
-                },
-                {"role": "user", "content": prompt},
-            ],
+        return await self._select(
+            candidates=candidates,
+            system_prompt="You are an expert at finding anime similar to what users already love.",
+            prompt=prompt,
             temperature=0.3,  # Lower temperature for more consistent/safe recommendations
-            response_format={"type": "json_object"},
+            default_reason="This anime is similar to what you've enjoyed.",
+            fallback_reason="This anime shares similarities with your favorites.",
+            fast_only=fast_only,
         )
 
-        try:
-            result = json.loads(response.choices[0].message.content)
-            selected_anime = next(
-                (c for c in candidates if c.get("mal_id") == result.get("mal_id")),
-                candidates[0] if candidates else None,
-            )
-
-            if selected_anime:
-                selected_anime["recommendation_reason"] = result.get(
-                    "reason", "This anime is similar to what you've enjoyed."
-                )
-                return selected_anime
-            return None
-        except (json.JSONDecodeError, StopIteration):
-            if candidates:
-                candidates[0]["recommendation_reason"] = (
-                    "This anime shares similarities with your favorites."
-                )
-                return candidates[0]
-            return None
-
     async def rank_for_discovery(
         self,
-        candidates: List[Dict[str, Any]],
-        anime_history: List[Dict[str, Any]],
-        seen_anime_ids: List[int],
-    ) -> Dict[str, Any]:
+        candidates: List[AnimeRecord],
+        anime_history: List[AnimeRecord],
+        seen_anime_ids: SeenSet,
+        profile: Optional[PreferenceProfile] = None,
+        fast_only: bool = False,
+    ) -> Optional[RankingResult]:
         """
         Select a recommendation that encourages discovery and expanding horizons.
 
@@ -127,30 +194,37 @@ Return ONLY the JSON object."""
         Args:
             candidates: List of diverse candidate anime
             anime_history: User's viewing history with ratings
-            seen_anime_ids: List of MAL IDs the user has already seen
+            seen_anime_ids: MAL IDs the user has already seen or excluded
+            profile: Preference profile summarising the whole history
+            fast_only: Never escalate to the full model (used under load)
 
         Returns:
-            Recommendation that balances familiarity with discovery
+            Selected anime with the reason it was recommended and the model tier used
         """
         # Filter out already seen anime
-        candidates = [c for c in candidates if c.get("mal_id") not in seen_anime_ids]
+        candidates = [c for c in candidates if c.mal_id not in seen_anime_ids]
 
         if not candidates:
             return None
 
         # Format for prompt
-        candidates_text = self._format_candidates(
-            candidates[:20]
-        )  # Increased from 12 to 20
-        history_text = self._build_history_context(
-            anime_history[-10:]
-        )  # Increased from 5 to 10
+        with stage("prompt"):
+            candidates_text = self._format_candidates(
+                candidates[:20]
+            )  # Increased from 12 to 20
+            history_text = self._build_history_context(
+                anime_history[-10:]
+            )  # Increased from 5 to 10
+            profile_text = self._build_profile_context(profile)
 
         prompt = f"""You are an anime curator focused on expanding horizons and discovery.
 
 User's Recent History:
 {history_text}
 
+User's Taste Profile (whole history, recent items weigh more):
+{profile_text}
+
 Available Candidates:
 {candidates_text}
 
@@ -172,44 +246,161 @@ Return JSON with:
 - mal_id: Selected anime's MAL ID
 - title: Anime title
 - reason: 2-3 sentences explaining why this expands their horizons (be specific about what's new/different)
+- confidence: Number from 0 to 1 for how sure you are this is the best candidate
 
 Return ONLY the JSON object."""
 
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a curator helping users discover great anime beyond their comfort zone.",
-                },
-                {"role": "user", "content": prompt},
-            ],
+        return await self._select(
+            candidates=candidates,
+            system_prompt="You are a curator helping users discover great anime beyond their comfort zone.",
+            prompt=prompt,
             temperature=0.7,  # Higher temperature for more creative recommendations
-            response_format={"type": "json_object"},
+            default_reason="This anime will introduce you to new perspectives.",
+            fallback_reason="This critically acclaimed anime will expand your horizons.",
+            fast_only=fast_only,
         )
 
-        try:
-            result = json.loads(response.choices[0].message.content)
-            selected_anime = next(
-                (c for c in candidates if c.get("mal_id") == result.get("mal_id")),
-                candidates[0] if candidates else None,
-            )
+    async def _select(
+        self,
+        candidates: List[AnimeRecord],
+        system_prompt: str,
+        prompt: str,
+        temperature: float,
+        default_reason: str,
+        fallback_reason: str,
+        fast_only: bool = False,
+    ) -> Optional[RankingResult]:
+        """
+        Ask the model cascade to pick one candidate.
 
-            if selected_anime:
-                selected_anime["recommendation_reason"] = result.get(
-                    "reason", "This anime will introduce you to new perspectives."
-                )
-                return selected_anime
+        Args:
+            candidates: Unseen candidates shown in the prompt
+            system_prompt: System message for the ranking call
+            prompt: User message listing history and candidates
+            temperature: Sampling temperature
+            default_reason: Reason used when the model omits one
+            fallback_reason: Reason used when no model answer is usable
+            fast_only: Accept any usable fast-model answer and never call the
+                full model (ignored when no fast model is configured)
+
+        Returns:
+            The chosen candidate, or None if there are no candidates
+        """
+        if not candidates:
             return None
-        except (json.JSONDecodeError, StopIteration):
-            if candidates:
-                candidates[0]["recommendation_reason"] = (
-                    "This critically acclaimed anime will expand your horizons."
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        usage = TokenUsage()
+
+        if self.fast_model:
+            try:
+                result = await self._complete(
+                    self.fast_model,
+                    messages,
+                    temperature,
+                    self.fast_timeout,
+                    usage,
+                    stage_name="llm_fast",
+                )
+            except Exception as e:
+                logger.info("Fast model failed, escalating: %s", e)
+                result = None
+
+            choice = self._match_candidate(result, candidates)
+            confidence = self._confidence(result)
+            if choice and (confidence is not None or fast_only):
+                if fast_only or confidence >= self.confidence_threshold:
+                    return RankingResult(
+                        anime=choice,
+                        reason=result.get("reason") or default_reason,
+                        tier="fast",
+                        confidence=confidence,
+                        usage=usage,
+                    )
+                logger.info("Fast model confidence %.2f, escalating", confidence)
+            elif fast_only:
+                return RankingResult(
+                    anime=candidates[0],
+                    reason=fallback_reason,
+                    tier="fallback",
+                    usage=usage,
                 )
-                return candidates[0]
+
+        result = await self._complete(
+            self.model,
+            messages,
+            temperature,
+            self.timeout,
+            usage,
+            stage_name="llm_full",
+        )
+        choice = self._match_candidate(result, candidates)
+        if choice:
+            return RankingResult(
+                anime=choice,
+                reason=result.get("reason") or default_reason,
+                tier="full",
+                confidence=self._confidence(result),
+                usage=usage,
+            )
+
+        return RankingResult(
+            anime=candidates[0], reason=fallback_reason, tier="fallback", usage=usage
+        )
+
+    async def _complete(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        timeout: float,
+        usage: TokenUsage,
+        stage_name: str = "llm",
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Run one JSON-mode completion and parse it, or return None if unparsable.
+
+        Tokens billed for the call are added to `usage`.
+        """
+        with stage(stage_name):
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    response_format={"type": "json_object"},
+                ),
+                timeout=timeout,
+            )
+        usage.add(getattr(response, "usage", None))
+        try:
+            with stage("parse"):
+                result = json.loads(response.choices[0].message.content)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        return result if isinstance(result, dict) else None
+
+    def _match_candidate(
+        self, result: Optional[Dict[str, Any]], candidates: List[AnimeRecord]
+    ) -> Optional[AnimeRecord]:
+        """Return the candidate the model picked, if it is one of the candidates."""
+        if not result:
             return None
+        return next((c for c in candidates if c.mal_id == result.get("mal_id")), None)
 
-    def _build_history_context(self, anime_history: List[Dict[str, Any]]) -> str:
+    def _confidence(self, result: Optional[Dict[str, Any]]) -> Optional[float]:
+        """Extract a self-reported confidence in [0, 1], if present."""
+        if not result:
+            return None
+        try:
+            confidence = float(result.get("confidence"))
+        except (TypeError, ValueError):
+            return None
+        return min(max(confidence, 0.0), 1.0)
+
+    def _build_history_context(self, anime_history: List[AnimeRecord]) -> str:
         """Build a text summary of anime history for prompts."""
         if not anime_history:
             return "No history yet."
@@ -226,7 +417,32 @@ Return ONLY the JSON object."""
 
         return "\n".join(lines)
 
-    def _format_candidates(self, candidates: List[Dict[str, Any]]) -> str:
+    def _build_profile_context(self, profile: Optional[PreferenceProfile]) -> str:
+        """Build a text summary of the user's preference profile for prompts."""
+        if profile is None or not profile.item_count:
+            return "No profile yet."
+
+        lines = []
+        for label, table in (("genres", "genres"), ("studios", "studios")):
+            liked = profile.top(table)
+            disliked = profile.top(table, negative=True)
+            if liked:
+                lines.append(f"- Favorite {label}: {', '.join(liked)}")
+            if disliked:
+                lines.append(f"- Disliked {label}: {', '.join(disliked)}")
+        sources = profile.top("sources", n=3)
+        if sources:
+            lines.append(f"- Preferred sources: {', '.join(sources)}")
+
+        counts = ", ".join(
+            f"{count} {rating}"
+            for rating, count in sorted(profile.rating_counts.items())
+        )
+        lines.append(f"- Ratings so far: {counts}")
+
+        return "\n".join(lines)
+
+    def _format_candidates(self, candidates: List[AnimeRecord]) -> str:
         """Format candidate anime for inclusion in prompts."""
         lines = [
             self._summarize_anime(
@@ -241,60 +457,67 @@ Return ONLY the JSON object."""
 
     def _summarize_anime(
         self,
-        anime: Dict[str, Any],
+        anime: AnimeRecord,
         prefix: str = "- ",
         include_user_context: bool = False,
         include_synopsis: bool = False,
     ) -> str:
         """Create a rich summary block for an anime entry."""
-        title = anime.get("title", "Unknown")
-        mal_id = anime.get("mal_id")
+        title = anime.title or "Unknown"
+        mal_id = anime.mal_id
         header = f"{prefix}{title}"
         if mal_id:
             header += f" (MAL ID: {mal_id})"
 
         lines = [header]
 
-        if anime.get("genres"):
-            lines.append(f"   Genres: {', '.join(anime['genres'])}")
-        if anime.get("studios"):
-            lines.append(f"   Studios: {', '.join(anime['studios'])}")
+        genres, studios = anime.genres, anime.studios
+        if genres:
+            lines.append(f"   Genres: {', '.join(genres)}")
+        if studios:
+            lines.append(f"   Studios: {', '.join(studios)}")
 
         meta_parts = []
-        if anime.get("media_type"):
-            meta_parts.append(f"Format: {anime['media_type']}")
-        if anime.get("episodes"):
-            meta_parts.append(f"Episodes: {anime['episodes']}")
-        if anime.get("score"):
-            meta_parts.append(f"MAL Score: {anime['score']}")
-        if anime.get("source"):
-            meta_parts.append(f"Source: {anime['source']}")
-        if anime.get("rating"):
-            meta_parts.append(f"Content Rating: {anime['rating']}")
+        if anime.media_type:
+            meta_parts.append(f"Format: {anime.media_type}")
+        if anime.episodes:
+            meta_parts.append(f"Episodes: {anime.episodes}")
+        if anime.score:
+            meta_parts.append(f"MAL Score: {anime.score}")
+        if anime.source:
+            meta_parts.append(f"Source: {anime.source}")
+        if anime.content_rating:
+            meta_parts.append(f"Content Rating: {anime.content_rating}")
         if meta_parts:
             lines.append("   " + " | ".join(meta_parts))
 
         if include_user_context:
             user_parts = []
-            if anime.get("user_seen") is not None:
-                user_parts.append("Seen" if anime.get("user_seen") else "Not seen")
-            if anime.get("watch_status"):
-                user_parts.append(f"Watch Status: {anime['watch_status']}")
-            if anime.get("user_rating"):
-                user_parts.append(f"User Rating: {anime['user_rating']}")
+            if anime.user_seen is not None:
+                user_parts.append("Seen" if anime.user_seen else "Not seen")
+            if anime.watch_status:
+                user_parts.append(f"Watch Status: {anime.watch_status}")
+            if anime.user_rating:
+                user_parts.append(f"User Rating: {anime.user_rating}")
             if user_parts:
                 lines.append("   " + " | ".join(user_parts))
 
-        if include_synopsis and anime.get("synopsis"):
-            synopsis = anime["synopsis"].strip().replace("\n", " ")
+        if include_synopsis and anime.synopsis:
+            synopsis = anime.synopsis.strip().replace("\n", " ")
             lines.append(f"   Synopsis: {synopsis[:200]}...")
 
         return "\n".join(lines)
 
 
+@lru_cache()
 def get_openai_client() -> OpenAIRecommendationClient:
-    """Get OpenAI client instance with configured credentials."""
+    """Get the shared OpenAI client instance with configured credentials."""
     settings = get_settings()
     return OpenAIRecommendationClient(
-        api_key=settings.openai_api_key, model=settings.openai_model
+        api_key=settings.openai_api_key,
+        model=settings.openai_model,
+        fast_model=settings.openai_fast_model or None,
+        confidence_threshold=settings.cascade_confidence_threshold,
+        fast_timeout=settings.openai_fast_timeout_seconds,
+        timeout=settings.openai_timeout_seconds,
     )
@@ -0,0 +1,132 @@
+"""
+Speculative background prefetching of upstream data.
+
+After a recommendation is returned, the user usually rates it and immediately
+asks for another one. While the user is reading, the engine computes that next
+recommendation for each rating the user might give and keeps the results in
+the `Prefetcher`, so the follow-up request only has to look one up.
+
+Prefetch jobs run as background tasks of the triggering response, which
+Starlette starts once the response has been sent. They are strictly best
+effort: they are dropped when the global budget is used up or when too many
+foreground requests are in flight.
+
+Author: Runkai Zhang
+"""
+
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+from app.timing import detach
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Runs low-priority background jobs within a global concurrency budget and
+    holds the results they precompute.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_concurrent: int,
+        max_foreground: int,
+        max_results: int = 2000,
+        result_ttl_seconds: float = 600.0,
+    ):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_foreground = max_foreground
+        self._foreground = 0
+        self._running = 0
+        self._results: BoundedTTLCache[Dict[str, Any]] = BoundedTTLCache(
+            max_entries=max_results, ttl_seconds=result_ttl_seconds
+        )
+        self.scheduled = 0
+        self.dropped = 0
+        self.results_used = 0
+
+    @contextmanager
+    def foreground(self) -> Iterator[None]:
+        """Mark a user-facing request as in flight."""
+        self._foreground += 1
+        try:
+            yield
+        finally:
+            self._foreground -= 1
+
+    def is_busy(self) -> bool:
+        """Whether foreground load is high enough that prefetching should yield."""
+        return self._foreground > self.max_foreground
+
+    async def run(self, job: Callable[[], Awaitable[None]]) -> None:
+        """
+        Run a prefetch job if the budget allows it, otherwise drop it.
+
+        Meant to be added as a background task of the triggering response, so
+        the job only starts once the response has been sent.
+
+        Args:
+            job: Zero-argument coroutine function doing the prefetch work
+        """
+        if not self.enabled or self._running >= self.max_concurrent:
+            self.dropped += 1
+            return
+        if self.is_busy():
+            self.dropped += 1
+            return
+
+        # Background work must not show up in the triggering request's timings
+        detach()
+        self._running += 1
+        self.scheduled += 1
+        try:
+            await job()
+        except Exception as e:
+            logger.debug("Prefetch failed: %s", e)
+        finally:
+            self._running -= 1
+
+    def store(self, key: Hashable, result: Dict[str, Any]) -> None:
+        """Keep a precomputed result for the request identified by `key`."""
+        self._results.set(key, result)
+
+    def take(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Remove and return the precomputed result for `key`, if any."""
+        result = self._results.get(key)
+        if result is not None:
+            self._results.pop(key)
+        return result
+
+    def used(self) -> None:
+        """Count a precomputed result that answered a request."""
+        self.results_used += 1
+
+    def stats(self) -> dict:
+        """Return prefetch counters for diagnostics."""
+        return {
+            "in_flight": self._running,
+            "scheduled": self.scheduled,
+            "dropped": self.dropped,
+            "results": len(self._results),
+            "results_used": self.results_used,
+        }
+
+
+@lru_cache()
+def get_prefetcher() -> Prefetcher:
+    """Get the process-wide prefetcher."""
+    settings = get_settings()
+    return Prefetcher(
+        enabled=settings.prefetch_enabled,
+        max_concurrent=settings.prefetch_max_concurrent,
+        max_foreground=settings.prefetch_max_foreground,
+        max_results=settings.prefetch_max_results,
+        result_ttl_seconds=settings.prefetch_result_ttl_seconds,
+    )
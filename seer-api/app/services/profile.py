@@ -0,0 +1,225 @@
+"""
+Incremental user preference profiles carried between requests as signed tokens.
+
+A `PreferenceProfile` summarises a history as recency-weighted genre, studio and
+source affinities plus rating counts. It is returned to the client as an opaque
+HMAC-signed token; when the token comes back with a history that extends the
+one it was built from, only the new items are folded in.
+
+Tokens carry the complete state - every affinity at full precision and the
+pending decay scale - so folding new items into a token gives exactly the
+profile a rebuild from the full history would. The affinity tables are
+bounded by the number of distinct genres, studios and sources in the history.
+
+Author: Runkai Zhang
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import get_settings
+from app.schemas import AnimeHistoryItem
+from app.services.history_store import StoredHistory
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 2
+
+# How much each rating pushes an anime's genres/studios/source
+RATING_WEIGHTS = {
+    "positive": 1.0,
+    "neutral": 0.2,
+    "negative": -1.0,
+    None: 0.3,  # Seen but not rated yet
+}
+
+# Every new item multiplies older contributions by this factor
+RECENCY_DECAY = 0.97
+
+# Payload key of each affinity table
+AFFINITY_TABLES = {"genres": "g", "studios": "st", "sources": "so"}
+
+RECENT_LIKED_SIZE = 8
+
+
+@dataclass
+class PreferenceProfile:
+    """Recency-weighted summary of a user's history."""
+
+    item_count: int = 0
+    history_prefix_hash: str = ""
+    genres: Dict[str, float] = field(default_factory=dict)
+    studios: Dict[str, float] = field(default_factory=dict)
+    sources: Dict[str, float] = field(default_factory=dict)
+    rating_counts: Dict[str, int] = field(default_factory=dict)
+    recent_liked_ids: List[int] = field(default_factory=list)
+    # Decay is applied lazily: stored affinities are divided by `scale`
+    scale: float = 1.0
+
+    def fold(self, item: AnimeHistoryItem) -> None:
+        """Add one history item to the profile (newest item last)."""
+        rating = item.rating.value if item.rating else None
+        weight = RATING_WEIGHTS[rating]
+
+        # Instead of decaying every entry, grow the weight of new items
+        self.scale /= RECENCY_DECAY
+        if self.scale > 1e6:
+            self._normalize()
+        scaled = weight * self.scale
+
+        for name in item.genres:
+            self.genres[name] = self.genres.get(name, 0.0) + scaled
+        for name in item.studios:
+            self.studios[name] = self.studios.get(name, 0.0) + scaled
+        if item.source:
+            self.sources[item.source] = self.sources.get(item.source, 0.0) + scaled
+
+        key = rating or "unrated"
+        self.rating_counts[key] = self.rating_counts.get(key, 0) + 1
+        if rating == "positive":
+            self.recent_liked_ids.append(item.mal_id)
+            del self.recent_liked_ids[:-RECENT_LIKED_SIZE]
+        self.item_count += 1
+
+    def top(self, table: str, n: int = 5, negative: bool = False) -> List[str]:
+        """Return the strongest liked (or disliked) names from an affinity table."""
+        entries = getattr(self, table).items()
+        if negative:
+            ranked = sorted((v, k) for k, v in entries if v < 0)
+        else:
+            ranked = sorted(((-v, k) for k, v in entries if v > 0))
+        return [name for _, name in ranked[:n]]
+
+    def _normalize(self) -> None:
+        """Fold the lazy scale back into the stored affinities."""
+        for table in (self.genres, self.studios, self.sources):
+            for name in table:
+                table[name] /= self.scale
+        self.scale = 1.0
+
+    def to_payload(self) -> dict:
+        """Serialize the complete profile state to a JSON-compatible payload."""
+        payload = {
+            "v": PROFILE_VERSION,
+            "n": self.item_count,
+            "h": self.history_prefix_hash,
+            "c": self.rating_counts,
+            "l": self.recent_liked_ids,
+            "s": self.scale,
+        }
+        for table, key in AFFINITY_TABLES.items():
+            payload[key] = getattr(self, table)
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "PreferenceProfile":
+        """Rebuild a profile from `to_payload` output."""
+        if payload.get("v") != PROFILE_VERSION:
+            raise ValueError("Unsupported profile version")
+        tables = {
+            table: {str(k): float(v) for k, v in payload[key].items()}
+            for table, key in AFFINITY_TABLES.items()
+        }
+        return cls(
+            item_count=int(payload["n"]),
+            history_prefix_hash=str(payload["h"]),
+            rating_counts={str(k): int(v) for k, v in payload["c"].items()},
+            recent_liked_ids=[int(i) for i in payload["l"]],
+            scale=float(payload["s"]),
+            **tables,
+        )
+
+
+class ProfileSigner:
+    """Encodes profiles as signed opaque tokens and verifies them."""
+
+    def __init__(self, secret: bytes):
+        self._secret = secret
+
+    def encode(self, profile: PreferenceProfile) -> str:
+        """Serialize and sign a profile."""
+        body = json.dumps(profile.to_payload(), separators=(",", ":")).encode()
+        signature = hmac.new(self._secret, body, hashlib.sha256).digest()[:16]
+        return f"{_b64encode(body)}.{_b64encode(signature)}"
+
+    def decode(self, token: str) -> Optional[PreferenceProfile]:
+        """Verify and deserialize a token, or return None if it is not usable."""
+        try:
+            body_part, signature_part = token.split(".", 1)
+            body = _b64decode(body_part)
+            signature = _b64decode(signature_part)
+        except (ValueError, binascii.Error):
+            return None
+
+        expected = hmac.new(self._secret, body, hashlib.sha256).digest()[:16]
+        if not hmac.compare_digest(signature, expected):
+            return None
+
+        try:
+            return PreferenceProfile.from_payload(json.loads(body))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def build_profile(
+    history: StoredHistory, token: Optional[str], signer: ProfileSigner
+) -> Tuple[PreferenceProfile, str]:
+    """
+    Bring a profile up to date with the given history.
+
+    If `token` was built from a prefix of `history`, only the items after that
+    prefix are folded in. Otherwise the profile is rebuilt from scratch.
+
+    Args:
+        history: Validated history with per-item digests
+        token: Profile token from the previous response, if any
+        signer: Signer used to verify and issue tokens
+
+    Returns:
+        Tuple of the updated profile and its new token
+    """
+    profile = signer.decode(token) if token else None
+    if profile is not None and (
+        profile.item_count > len(history.items)
+        or profile.history_prefix_hash != history.prefix_hash(profile.item_count)
+    ):
+        logger.debug("Profile token does not match history, rebuilding")
+        profile = None
+
+    if profile is None:
+        profile = PreferenceProfile()
+    new_items: Sequence[AnimeHistoryItem] = history.items[profile.item_count :]
+    for item in new_items:
+        profile.fold(item)
+    profile.history_prefix_hash = history.content_hash
+
+    return profile, signer.encode(profile)
+
+
+@lru_cache()
+def get_profile_signer() -> ProfileSigner:
+    """Get the process-wide profile signer."""
+    settings = get_settings()
+    if settings.profile_token_secret:
+        secret = settings.profile_token_secret.encode("utf-8")
+    else:
+        # Tokens from other workers or previous runs simply fail verification
+        # and the profile is rebuilt from the full history.
+        secret = secrets.token_bytes(32)
+    return ProfileSigner(secret)
@@ -8,12 +8,50 @@ Supports two modes:
 Author: Runkai Zhang
 """
 
-import asyncio
-from typing import Any, Dict, List, Optional
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
+from fastapi import BackgroundTasks
+
+from app.config import get_settings
 from app.schemas import AnimeHistoryItem, RecommendationMode
+from app.services.anime_record import AnimeRecord
+from app.services.candidate_sources import CandidateFanOut, get_candidate_fan_out
+from app.services.hedging import gather_quorum
+from app.services.history_store import StoredHistory
 from app.services.mal_client import MALClient
 from app.services.openai_client import OpenAIRecommendationClient
+from app.services.prefetch import Prefetcher, get_prefetcher
+from app.services.seen import SeenSet
+from app.services.profile import (
+    PreferenceProfile,
+    ProfileSigner,
+    build_profile,
+    get_profile_signer,
+)
+from app.timing import stage
+
+logger = logging.getLogger(__name__)
+
+# How many history items each mode shows the model
+SIMILAR_HISTORY_ITEMS = 8
+DISCOVERY_HISTORY_ITEMS = 10
+
+# Candidate pool: total size, familiar share, and how many liked anime may be
+# consulted for familiar candidates
+CANDIDATE_POOL_SIZE = 12
+FAMILIAR_CANDIDATES = 4
+FAMILIAR_SOURCE_LIMIT = 3
+
+# Ratings the user may give a recommendation before asking for the next one,
+# most likely first, with the watch status and seen flag the frontend records
+# alongside each
+NEXT_RATINGS: Dict[Optional[str], Tuple[str, bool]] = {
+    "positive": ("completed", True),
+    "neutral": ("backlog", False),
+    None: ("backlog", False),  # Added to the watch list
+    "negative": ("ignored", False),
+}
 
 
 class RecommendationEngine:
@@ -21,20 +59,47 @@ class RecommendationEngine:
     Stateless orchestrator for anime recommendations.
     Combines MAL data with OpenAI-powered preference extraction and ranking.
 
-    All state is passed in via anime_history parameter - no database required.
+    All state is passed in via the history parameter (plus an optional signed
+    profile token) - no database required.
     """
 
     def __init__(
-        self, mal_client: MALClient, openai_client: OpenAIRecommendationClient
+        self,
+        mal_client: MALClient,
+        openai_client: OpenAIRecommendationClient,
+        profile_signer: Optional[ProfileSigner] = None,
+        prefetcher: Optional[Prefetcher] = None,
+        details_quorum: Optional[int] = None,
+        quorum_grace: Optional[float] = None,
+        fan_out: Optional[CandidateFanOut] = None,
     ):
+        settings = get_settings()
         self.mal_client = mal_client
         self.openai_client = openai_client
+        self.details_quorum = (
+            details_quorum
+            if details_quorum is not None
+            else settings.candidate_details_quorum
+        )
+        self.quorum_grace = (
+            quorum_grace
+            if quorum_grace is not None
+            else settings.candidate_quorum_grace_ms / 1000
+        )
+        self.fan_out = fan_out or get_candidate_fan_out()
+        self.graph = mal_client.graph
+        self.profile_signer = profile_signer or get_profile_signer()
+        self.prefetcher = prefetcher or get_prefetcher()
 
     async def get_recommendation(
         self,
-        anime_history: List[AnimeHistoryItem],
+        history: StoredHistory,
         mode: RecommendationMode = RecommendationMode.EXPLORE,
         exclude_ids: Optional[List[int]] = None,
+        profile_token: Optional[str] = None,
+        seen_ids: Optional[SeenSet] = None,
+        fast_only: bool = False,
+        background_tasks: Optional[BackgroundTasks] = None,
     ) -> Dict[str, Any]:
         """
         Generate a recommendation based on the selected mode.
@@ -43,33 +108,88 @@ class RecommendationEngine:
         - similar: Find anime similar to what user already loves
         - explore: Discover new genres and expand horizons (default)
 
-        This is completely stateless - all user data comes from anime_history parameter.
+        This is completely stateless - all user data comes from the history parameter.
 
         Args:
-            anime_history: Ordered list of anime the user has watched/rated (first = initial favorite)
+            history: Validated, ordered anime history (first = initial favorite)
             mode: Recommendation strategy (similar or explore)
+            exclude_ids: MAL IDs to skip in addition to the history
+            profile_token: Token from a previous response; lets the preference
+                profile be updated with only the new history items
+            seen_ids: Extra seen MAL IDs sent without full history objects
+            fast_only: Rank with the fast model only (set when shedding cost)
+            background_tasks: Tasks of the response; the follow-up request is
+                prefetched there once the response has been sent
 
         Returns:
             Dict containing:
                 - recommendation: The recommended anime with explanation
+                - profile_token: Updated preference profile token
+                - model_tier: Which ranking model tier made the choice
+                - token_usage: Prompt and completion tokens spent on ranking
 
         Raises:
             ValueError: If history is empty
         """
+        with self.prefetcher.foreground():
+            result = await self._recommend(
+                history, mode, exclude_ids, profile_token, seen_ids, fast_only
+            )
+
+        # The user will most likely rate this anime and ask again right away
+        if background_tasks is not None:
+            background_tasks.add_task(
+                self.prefetcher.run,
+                lambda: self._prefetch_next(
+                    history, mode, exclude_ids, seen_ids, result, fast_only
+                ),
+            )
+        return result
+
+    async def _recommend(
+        self,
+        history: StoredHistory,
+        mode: RecommendationMode,
+        exclude_ids: Optional[List[int]],
+        profile_token: Optional[str],
+        seen_ids: Optional[SeenSet],
+        fast_only: bool = False,
+    ) -> Dict[str, Any]:
+        """Run one recommendation, or use the one prefetched for this request."""
+        anime_history = history.items
         if not anime_history:
             raise ValueError(
                 "anime_history cannot be empty. Please provide at least one anime "
                 "(your favorite anime should be the first item)."
             )
 
-        # Convert Pydantic models to dicts for processing
-        history_dicts = [self._history_item_to_dict(item) for item in anime_history]
-        exclude_ids = exclude_ids or []
-        seen_ids = [item.mal_id for item in anime_history]
-        blocked_ids = seen_ids + [eid for eid in exclude_ids if eid not in seen_ids]
+        with stage("profile"):
+            profile, new_profile_token = build_profile(
+                history, profile_token, self.profile_signer
+            )
+
+        blocked_ids = _blocked_ids(history, exclude_ids, seen_ids)
+        liked_ids, disliked_ids = history.liked_ids, history.disliked_ids
+
+        # A prefetch may have answered this request already (see _prefetch_next)
+        last = anime_history[-1]
+        prefetched = self.prefetcher.take(
+            _followup_key(
+                history.prefix_hash(len(anime_history) - 1),
+                last.mal_id,
+                last.rating.value if last.rating else None,
+                mode,
+            )
+        )
+        if prefetched and prefetched["recommendation"]["mal_id"] not in blocked_ids:
+            self.prefetcher.used()
+            return {**prefetched, "profile_token": new_profile_token}
 
         # Gather diverse candidates from various sources
-        candidates = await self._gather_diverse_candidates(history_dicts, blocked_ids)
+        with stage("candidates"):
+            candidates = await self._gather_diverse_candidates(
+                liked_ids, blocked_ids, mode, disliked_ids
+            )
 
         if not candidates:
             raise ValueError(
@@ -80,107 +200,297 @@ class RecommendationEngine:
         if mode == RecommendationMode.SIMILAR:
             recommendation = await self.openai_client.rank_for_similar(
                 candidates=candidates,
-                anime_history=history_dicts,
+                anime_history=self._liked_records(anime_history, profile),
                 seen_anime_ids=blocked_ids,
+                profile=profile,
+                fast_only=fast_only,
             )
         else:  # EXPLORE mode
+            recent = anime_history[-DISCOVERY_HISTORY_ITEMS:]
             recommendation = await self.openai_client.rank_for_discovery(
                 candidates=candidates,
-                anime_history=history_dicts,
+                anime_history=[AnimeRecord.from_history_item(i) for i in recent],
                 seen_anime_ids=blocked_ids,
+                profile=profile,
+                fast_only=fast_only,
             )
 
         if not recommendation:
             raise ValueError("Could not generate recommendation. Please try again.")
 
-        return {"recommendation": recommendation}
+        logger.info(
+            "Recommended %s in %s mode using %s model tier (confidence=%s, tokens=%d)",
+            recommendation.anime.mal_id,
+            mode.value,
+            recommendation.tier,
+            recommendation.confidence,
+            recommendation.usage.total_tokens,
+        )
+        result = {
+            "recommendation": {
+                **recommendation.anime.to_dict(),
+                "recommendation_reason": recommendation.reason,
+            },
+            "profile_token": new_profile_token,
+            "model_tier": recommendation.tier,
+            "token_usage": recommendation.usage.as_dict(),
+        }
+        return result
 
     async def _gather_diverse_candidates(
-        self, history_dicts: List[Dict[str, Any]], seen_ids: List[int]
-    ) -> List[Dict[str, Any]]:
+        self,
+        liked_ids: Sequence[int],
+        seen_ids: SeenSet,
+        mode: RecommendationMode = RecommendationMode.EXPLORE,
+        disliked_ids: Sequence[int] = (),
+    ) -> List[AnimeRecord]:
         """
         Gather diverse candidates prioritizing discovery over comfort zone.
 
         Mix of familiar (related to liked anime) and exploratory (different genres/themes).
+        Both sources are lazy streams that skip seen anime as they go and stop
+        as soon as the pool is full, so users who have seen the most popular
+        titles still get candidates without paying for a fixed large fetch.
 
         Args:
-            history_dicts: User's anime history as dictionaries
+            liked_ids: MAL IDs of positively rated anime, most recent last
             seen_ids: MAL IDs of anime the user has already seen
+            mode: Recommendation mode, which selects the exploratory list mix
+            disliked_ids: MAL IDs of negatively rated anime
 
         Returns:
-            Diverse list of candidate anime (up to 12)
+            Diverse list of candidate anime (up to CANDIDATE_POOL_SIZE)
         """
         candidates = []
-        seen_ids_set = set(seen_ids)
-        liked_anime = [h for h in history_dicts if h.get("user_rating") == "positive"]
-
-        # Strategy 1: Familiar - recommendations from most recent liked anime (33%)
-        if liked_anime:
-            most_recent = liked_anime[-1]
-            recs = await self.mal_client.get_anime_recommendations(
-                most_recent["mal_id"], limit=4
-            )
-            # Collect valid anime IDs for parallel fetching
-            rec_ids = []
-            for rec in recs:
-                anime_id = rec.get("node", {}).get("id")
-                if (
-                    anime_id
-                    and anime_id not in seen_ids_set
-                    and anime_id not in rec_ids
-                ):
-                    rec_ids.append(anime_id)
-                    if len(rec_ids) >= 4:
-                        break
-
-            # Fetch all details in parallel
+
+        # Strategy 1: Familiar - personalized PageRank over the co-recommendation
+        # graph, seeded by the whole rated history. Until the graph covers the
+        # history, MAL recommendations of recently liked anime fill up (33%)
+        if liked_ids:
+            rec_ids = self._graph_candidate_ids(liked_ids, disliked_ids, seen_ids)
+            if len(rec_ids) < FAMILIAR_CANDIDATES:
+                for anime_id in await self._familiar_candidate_ids(liked_ids, seen_ids):
+                    if anime_id not in rec_ids:
+                        rec_ids.append(anime_id)
+                rec_ids = rec_ids[:FAMILIAR_CANDIDATES]
+
+            # Fetch all details in parallel (hedging slow calls), and move on
+            # once a quorum has arrived rather than waiting for the slowest
             if rec_ids:
-                details_list = await asyncio.gather(
-                    *[self.mal_client.get_anime_details(aid) for aid in rec_ids]
+                details_list = await gather_quorum(
+                    [
+                        self.mal_client.get_anime_details(aid, hedge=True)
+                        for aid in rec_ids
+                    ],
+                    quorum=self.details_quorum,
+                    grace=self.quorum_grace,
                 )
                 for details in details_list:
                     if details:
-                        candidates.append(self.mal_client.extract_metadata(details))
+                        candidates.append(self.mal_client.extract_record(details))
 
-        # Strategy 2: Exploratory - high-rated anime from MAL rankings (67%)
-        ranking = await self.mal_client.search_by_genre([], limit=12)
-        for item in ranking:
-            anime_id = item.get("node", {}).get("id")
-            if (
-                anime_id
-                and anime_id not in seen_ids_set
-                and not any(c["mal_id"] == anime_id for c in candidates)
-            ):
-                candidates.append(self.mal_client.extract_metadata(item))
-                if len(candidates) >= 12:
-                    break
+        # Strategy 2: Exploratory - best of several MAL lists, fetched in
+        # parallel and merged by normalised score (67%)
+        candidates.extend(
+            await self.fan_out.candidates(
+                self.mal_client,
+                mode.value,
+                seen_ids,
+                exclude_ids=[c.mal_id for c in candidates],
+                limit=CANDIDATE_POOL_SIZE - len(candidates),
+            )
+        )
 
         return candidates
 
-    def _history_item_to_dict(self, item: AnimeHistoryItem) -> Dict[str, Any]:
+    def _graph_candidate_ids(
+        self, liked_ids: Sequence[int], disliked_ids: Sequence[int], seen_ids: SeenSet
+    ) -> List[int]:
         """
-        Convert AnimeHistoryItem Pydantic model to dictionary.
+        Rank unseen anime by personalized PageRank from the rated history.
 
         Args:
-            item: AnimeHistoryItem from request
+            liked_ids: MAL IDs of liked anime
+            disliked_ids: MAL IDs of disliked anime
+            seen_ids: MAL IDs to skip
 
         Returns:
-            Dictionary representation
+            Up to FAMILIAR_CANDIDATES anime IDs, best first (none without a graph)
         """
-        return {
-            "mal_id": item.mal_id,
-            "title": item.title,
-            "genres": item.genres,
-            "studios": item.studios,
-            "episodes": item.episodes,
-            "score": item.score,
-            "synopsis": item.synopsis,
-            "media_type": item.media_type,
-            "source": item.source,
-            "watch_status": item.watch_status,
-            "image_url": item.image_url,
-            "rank": item.rank,
-            "popularity": item.popularity,
-            "user_seen": item.has_seen,
-            "user_rating": item.rating.value if item.rating else None,
-        }
+        if self.graph is None:
+            return []
+        with stage("graph"):
+            ranked = self.graph.personalized_pagerank(
+                liked_ids, disliked_ids, seen_ids, FAMILIAR_CANDIDATES
+            )
+        return [anime_id for anime_id, _ in ranked]
+
+    async def _iter_familiar_ids(
+        self, liked_ids: Sequence[int], seen_ids: SeenSet
+    ) -> AsyncIterator[int]:
+        """
+        Lazily yield unseen MAL recommendations for liked anime, newest first.
+
+        Details for an older liked anime are only fetched when the newer ones
+        did not yield enough unseen recommendations.
+
+        Args:
+            liked_ids: MAL IDs of liked anime, most recent last
+            seen_ids: MAL IDs to skip
+
+        Yields:
+            Recommended anime IDs
+        """
+        yielded = set()
+        for liked_id in reversed(liked_ids[-FAMILIAR_SOURCE_LIMIT:]):
+            recs = await self.mal_client.get_anime_recommendations(liked_id)
+            for rec in recs:
+                anime_id = rec.get("node", {}).get("id")
+                if anime_id and anime_id not in seen_ids and anime_id not in yielded:
+                    yielded.add(anime_id)
+                    yield anime_id
+
+    async def _familiar_candidate_ids(
+        self, liked_ids: Sequence[int], seen_ids: SeenSet
+    ) -> List[int]:
+        """
+        Pick unseen MAL recommendations for recently liked anime.
+
+        Args:
+            liked_ids: MAL IDs of liked anime, most recent last
+            seen_ids: MAL IDs to skip
+
+        Returns:
+            Up to FAMILIAR_CANDIDATES anime IDs whose details should be fetched
+        """
+        rec_ids = []
+        familiar = self._iter_familiar_ids(liked_ids, seen_ids)
+        try:
+            async for anime_id in familiar:
+                rec_ids.append(anime_id)
+                if len(rec_ids) >= FAMILIAR_CANDIDATES:
+                    break
+        finally:
+            await familiar.aclose()
+        return rec_ids
+
+    async def _prefetch_next(
+        self,
+        history: StoredHistory,
+        mode: RecommendationMode,
+        exclude_ids: Optional[List[int]],
+        seen_ids: Optional[SeenSet],
+        result: Dict[str, Any],
+        fast_only: bool,
+    ) -> None:
+        """
+        Precompute the request that usually follows a recommendation.
+
+        For each rating in NEXT_RATINGS, the history is extended with the
+        recommended anime rated that way and the whole recommendation is run:
+        candidate pools (warming the MAL cache) and, unless `prefetch_rankings`
+        is off, the ranking, whose result is kept for the follow-up request.
+        Each step yields to foreground traffic if the server gets busy.
+
+        Args:
+            history: History of the request that produced `result`
+            mode: Recommendation mode of that request
+            exclude_ids: MAL IDs that request excluded
+            seen_ids: Extra seen MAL IDs of that request
+            result: The recommendation that was returned
+            fast_only: Whether that request was ranked with the fast model only
+        """
+        recommendation = result["recommendation"]
+        base_hash = history.content_hash
+        rank = get_settings().prefetch_rankings
+        for rating, (watch_status, has_seen) in NEXT_RATINGS.items():
+            if self.prefetcher.is_busy():
+                return
+            item = AnimeHistoryItem.model_validate(
+                {
+                    **recommendation,
+                    "rating": rating,
+                    "watch_status": watch_status,
+                    "has_seen": has_seen,
+                }
+            )
+            next_history = history.extend([item])
+            try:
+                if rank:
+                    next_result = await self._recommend(
+                        next_history,
+                        mode,
+                        exclude_ids,
+                        result["profile_token"],
+                        seen_ids,
+                        fast_only,
+                    )
+                else:
+                    await self._gather_diverse_candidates(
+                        next_history.liked_ids,
+                        _blocked_ids(next_history, exclude_ids, seen_ids),
+                        mode,
+                        next_history.disliked_ids,
+                    )
+                    continue
+            except ValueError:
+                # No candidates left for this rating
+                continue
+            # The profile token is rebuilt from the history actually sent
+            del next_result["profile_token"]
+            self.prefetcher.store(
+                _followup_key(base_hash, item.mal_id, rating, mode), next_result
+            )
+
+    def _liked_records(
+        self, anime_history: Sequence[AnimeHistoryItem], profile: PreferenceProfile
+    ) -> List[AnimeRecord]:
+        """
+        Convert the profile's most recent liked anime to records.
+
+        Scans the history from the end so only the tail needs to be visited.
+
+        Args:
+            anime_history: Validated history items
+            profile: Up-to-date preference profile
+
+        Returns:
+            Liked anime as records, oldest first
+        """
+        wanted = set(profile.recent_liked_ids[-SIMILAR_HISTORY_ITEMS:])
+        liked = []
+        for item in reversed(anime_history):
+            if not wanted:
+                break
+            if (
+                item.mal_id in wanted
+                and item.rating
+                and item.rating.value == "positive"
+            ):
+                wanted.discard(item.mal_id)
+                liked.append(AnimeRecord.from_history_item(item))
+        liked.reverse()
+        return liked
+
+
+def _blocked_ids(
+    history: StoredHistory,
+    exclude_ids: Optional[List[int]],
+    seen_ids: Optional[SeenSet],
+) -> SeenSet:
+    """MAL IDs a request must not recommend, without walking the history."""
+    blocked_ids = history.anime_ids.copy()
+    if seen_ids is not None:
+        blocked_ids.update(seen_ids)
+    blocked_ids.update(exclude_ids or [])
+    return blocked_ids
+
+
+def _followup_key(
+    base_hash: str,
+    anime_id: int,
+    rating: Optional[str],
+    mode: RecommendationMode,
+) -> Tuple[str, int, Optional[str], str]:
+    """Identify a request that appends one rated anime to a known history."""
+    return base_hash, anime_id, rating, mode.value
@@ -0,0 +1,170 @@
+"""
+Compact set of seen MAL IDs and its wire format.
+
+`SeenSet` is the single structure the engine uses for "already seen or
+excluded" checks. It is a bitmap indexed by MAL ID, so membership tests cost
+the same no matter how long the history is.
+
+Clients with very long histories can send their exclusions as
+`seen_ids_packed`: the sorted IDs, delta-encoded as LEB128 varints and then
+base64url-encoded without padding. Ten thousand typical MAL IDs pack into
+under 15 KB of text.
+
+Author: Runkai Zhang
+"""
+
+import base64
+import binascii
+from typing import Iterable, Iterator, List, Set
+
+# IDs above this are kept in a small overflow set so a hostile ID can't make
+# us allocate a huge bitmap. Real MAL IDs are far below it.
+MAX_BITMAP_ID = 1 << 20
+
+
+class SeenSet:
+    """Bitmap-backed set of non-negative MAL IDs."""
+
+    __slots__ = ("_bits", "_overflow", "_count")
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._bits = bytearray()
+        self._overflow: Set[int] = set()
+        self._count = 0
+        self.update(ids)
+
+    def add(self, anime_id: int) -> None:
+        """Add one ID."""
+        if anime_id < 0:
+            raise ValueError(f"Invalid MAL ID: {anime_id}")
+        if anime_id >= MAX_BITMAP_ID:
+            if anime_id not in self._overflow:
+                self._overflow.add(anime_id)
+                self._count += 1
+            return
+
+        byte, bit = anime_id >> 3, 1 << (anime_id & 7)
+        if byte >= len(self._bits):
+            # Grow geometrically to keep repeated adds amortised O(1)
+            self._bits.extend(bytes(max(byte + 1 - len(self._bits), len(self._bits))))
+        if not self._bits[byte] & bit:
+            self._bits[byte] |= bit
+            self._count += 1
+
+    def update(self, ids: Iterable[int]) -> None:
+        """Add many IDs (another SeenSet is merged bitmap-wise)."""
+        if isinstance(ids, SeenSet):
+            self._merge(ids)
+            return
+        for anime_id in ids:
+            self.add(anime_id)
+
+    def _merge(self, other: "SeenSet") -> None:
+        if len(other._bits) > len(self._bits):
+            self._bits.extend(bytes(len(other._bits) - len(self._bits)))
+        bits = int.from_bytes(self._bits, "little") | int.from_bytes(
+            other._bits, "little"
+        )
+        self._bits[:] = bits.to_bytes(len(self._bits), "little")
+        self._overflow |= other._overflow
+        self._count = bits.bit_count() + len(self._overflow)
+
+    def copy(self) -> "SeenSet":
+        """Return an independent copy."""
+        clone = SeenSet()
+        clone._bits = bytearray(self._bits)
+        clone._overflow = set(self._overflow)
+        clone._count = self._count
+        return clone
+
+    def __contains__(self, anime_id: object) -> bool:
+        if not isinstance(anime_id, int) or anime_id < 0:
+            return False
+        if anime_id >= MAX_BITMAP_ID:
+            return anime_id in self._overflow
+        byte = anime_id >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (anime_id & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over IDs in ascending order."""
+        for byte_index, byte in enumerate(self._bits):
+            if byte:
+                base = byte_index << 3
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield base + bit
+        yield from sorted(self._overflow)
+
+    def to_packed(self) -> str:
+        """Encode as the `seen_ids_packed` wire format."""
+        return pack_ids(self)
+
+    @classmethod
+    def from_packed(cls, packed: str) -> "SeenSet":
+        """Decode the `seen_ids_packed` wire format."""
+        return cls(unpack_ids(packed))
+
+
+def pack_ids(ids: Iterable[int]) -> str:
+    """
+    Pack IDs as base64url(varint deltas of the sorted unique IDs).
+
+    Args:
+        ids: Non-negative MAL IDs in any order
+
+    Returns:
+        Packed string
+    """
+    out = bytearray()
+    previous = 0
+    for anime_id in sorted(set(ids)):
+        delta = anime_id - previous
+        previous = anime_id
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+
+
+def unpack_ids(packed: str) -> List[int]:
+    """
+    Unpack a string produced by `pack_ids`.
+
+    Args:
+        packed: Packed string
+
+    Returns:
+        Sorted list of IDs
+
+    Raises:
+        ValueError: If the string is not valid base64url or ends mid-varint
+    """
+    try:
+        data = base64.b64decode(
+            packed + "=" * (-len(packed) % 4), altchars=b"-_", validate=True
+        )
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"seen_ids_packed is not valid base64url: {e}") from e
+
+    ids = []
+    current = 0
+    delta = 0
+    shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift > 35:
+                raise ValueError("seen_ids_packed contains an oversized varint")
+            continue
+        current += delta
+        ids.append(current)
+        delta = 0
+        shift = 0
+    if shift:
+        raise ValueError("seen_ids_packed ends in the middle of a varint")
+    return ids
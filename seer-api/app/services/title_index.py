@@ -0,0 +1,89 @@
+"""
+Index of anime titles learned from MAL responses.
+
+Every anime the MAL client fetches (search results, details, ranking and
+season pages) is remembered under each of its normalised titles, so bulk
+title resolution (see title_resolver.py) can match exact titles without a
+MAL search. Titles are normalised with Unicode NFKC, case folding and
+collapsed punctuation.
+
+Author: Runkai Zhang
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+# Large per-anime fields that title matches never need
+UNINDEXED_FIELDS = ("recommendations", "related_anime", "related_manga")
+
+
+def normalise_title(title: str) -> str:
+    """Normalise a title for comparison ("Re:Zero  -Starting" -> "re zero starting")."""
+    title = unicodedata.normalize("NFKC", title).casefold()
+    return _NON_WORD.sub(" ", title).strip()
+
+
+def titles_of(node: Dict[str, Any]) -> Iterable[str]:
+    """Every title MAL lists for an anime: main, English, Japanese and synonyms."""
+    yield node.get("title") or ""
+    alternatives = node.get("alternative_titles") or {}
+    yield alternatives.get("en") or ""
+    yield alternatives.get("ja") or ""
+    yield from alternatives.get("synonyms") or []
+
+
+class TitleIndex:
+    """Normalised title -> MAL anime data, bounded and expiring."""
+
+    def __init__(self, max_entries: int = 50_000, ttl_seconds: float = 86_400):
+        self._titles: BoundedTTLCache[Dict[str, Any]] = BoundedTTLCache(
+            max_entries=max_entries, ttl_seconds=ttl_seconds
+        )
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._titles
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Anime data for a normalised title, if known."""
+        return self._titles.get(key)
+
+    def learn(self, nodes: Iterable[Dict[str, Any]]) -> None:
+        """
+        Remember every title of the given anime.
+
+        Args:
+            nodes: MAL anime data, most relevant first; the first anime with a
+                title keeps it
+        """
+        for node in nodes:
+            if not node.get("id"):
+                continue
+            slim = None
+            for title in titles_of(node):
+                key = normalise_title(title)
+                if key and key not in self._titles:
+                    if slim is None:
+                        slim = {
+                            k: v for k, v in node.items() if k not in UNINDEXED_FIELDS
+                        }
+                    self._titles.set(key, slim)
+
+
+@lru_cache()
+def get_title_index() -> TitleIndex:
+    """Get the process-wide title index."""
+    settings = get_settings()
+    return TitleIndex(
+        max_entries=settings.title_index_max_entries,
+        ttl_seconds=settings.title_index_ttl_seconds,
+    )
@@ -0,0 +1,247 @@
+"""
+Bulk resolution of free-text anime titles to MAL entries.
+
+Used when importing an existing watch list. Titles are normalised (see
+title_index.py) and deduplicated, then resolved locally when possible: every
+title of every anime in earlier MAL responses is remembered, so an exact
+title match needs no MAL call. The remaining titles are searched on MAL with
+a bounded number of requests in flight (shared across all imports), and
+results are yielded as they complete rather than in input order. Each import
+may only hold part of the shared slots, so one large import cannot starve
+the others.
+
+Searches are charged to a per-client search budget of their own, so an
+import does not use up the budget for recommendations. Local matches and
+duplicate titles are free.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.cache import BoundedTTLCache
+from app.services.cost_limiter import CostLimitExceeded, TokenBucket
+from app.services.mal_client import MALClient, get_mal_client
+from app.services.title_index import (
+    TitleIndex,
+    get_title_index,
+    normalise_title,
+    titles_of,
+)
+
+logger = logging.getLogger(__name__)
+
+# MAL rejects shorter search queries and truncates longer ones
+MIN_QUERY_LENGTH = 3
+MAX_QUERY_LENGTH = 64
+
+
+def match_confidence(query: str, node: Dict[str, Any]) -> float:
+    """
+    Similarity between a normalised query and the closest title of an anime.
+
+    Args:
+        query: Normalised query title
+        node: MAL anime data
+
+    Returns:
+        0-1 similarity (1.0 for an exact normalised match)
+    """
+    best = 0.0
+    for title in titles_of(node):
+        candidate = normalise_title(title)
+        if not candidate:
+            continue
+        if candidate == query:
+            return 1.0
+        best = max(best, SequenceMatcher(None, query, candidate).ratio())
+    return best
+
+
+@dataclass
+class Resolution:
+    """Best match for one distinct title."""
+
+    match: Optional[Dict[str, Any]]
+    confidence: float
+    source: str  # "local", "mal" or "none"
+    error: Optional[str] = None
+
+
+class TitleResolver:
+    """Resolves titles against remembered titles first, then MAL search."""
+
+    def __init__(
+        self,
+        mal_client: MALClient,
+        concurrency: int = 32,
+        per_request_concurrency: int = 16,
+        search_limit: int = 5,
+        index: Optional[TitleIndex] = None,
+        search_burst: float = 1000,
+        searches_per_hour: float = 2000,
+        max_clients: int = 10_000,
+    ):
+        self.mal_client = mal_client
+        self.search_limit = search_limit
+        # Bounds concurrent MAL searches across all requests
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.per_request_concurrency = per_request_concurrency
+        # Normalised title -> MAL anime data, learned from every MAL response
+        self.index = index if index is not None else TitleIndex()
+        # Searches each client may trigger, independent of the recommendation
+        # cost budget. Idle buckets go once they would have refilled.
+        self.search_burst = search_burst
+        self.searches_per_second = searches_per_hour / 3600
+        self._search_budgets: BoundedTTLCache[TokenBucket] = BoundedTTLCache(
+            max_entries=max_clients,
+            ttl_seconds=search_burst / self.searches_per_second,
+        )
+        self.local_hits = 0
+        self.searches = 0
+        self.searches_denied = 0
+
+    def searches_needed(self, titles: List[str]) -> int:
+        """Number of distinct titles that `resolve_many` would search on MAL."""
+        return sum(
+            1
+            for key in {normalise_title(title) for title in titles}
+            if len(key) >= MIN_QUERY_LENGTH and key not in self.index
+        )
+
+    def charge(self, client_key: str, titles: List[str]) -> int:
+        """
+        Take the searches an import needs from the client's search budget.
+
+        Args:
+            client_key: Identifies the caller (e.g. its IP address)
+            titles: Titles of the import
+
+        Returns:
+            Number of searches charged
+
+        Raises:
+            CostLimitExceeded: If the budget cannot cover the searches
+        """
+        searches = self.searches_needed(titles)
+        if searches == 0:
+            return 0
+        bucket = self._search_budgets.get(client_key)
+        if bucket is None:
+            bucket = TokenBucket(self.search_burst, self.searches_per_second)
+        # Re-set on every import so active clients are never evicted
+        self._search_budgets.set(client_key, bucket)
+        if not bucket.can_cover(searches):
+            self.searches_denied += 1
+            raise CostLimitExceeded(
+                "Title search budget exceeded - please try again later",
+                retry_after=bucket.seconds_until(searches),
+            )
+        bucket.charge(searches)
+        return searches
+
+    async def resolve_many(
+        self, titles: List[str]
+    ) -> AsyncIterator[Tuple[List[int], Resolution]]:
+        """
+        Resolve titles, yielding each distinct title's result as it completes.
+
+        Args:
+            titles: Titles in the caller's order (duplicates allowed)
+
+        Yields:
+            Indices in `titles` sharing a normalised title, and their resolution
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, title in enumerate(titles):
+            groups.setdefault(normalise_title(title), []).append(index)
+
+        immediate = []
+        pending = []
+        # Searches of this request that may wait for the shared semaphore
+        own_slots = asyncio.Semaphore(self.per_request_concurrency)
+        for key, indices in groups.items():
+            node = self.index.get(key) if key else None
+            if node is not None:
+                self.local_hits += 1
+                immediate.append((indices, Resolution(node, 1.0, "local")))
+            elif len(key) < MIN_QUERY_LENGTH:
+                immediate.append((indices, Resolution(None, 0.0, "none")))
+            else:
+                query = titles[indices[0]].strip()[:MAX_QUERY_LENGTH]
+                pending.append(
+                    asyncio.ensure_future(self._search(key, indices, query, own_slots))
+                )
+
+        try:
+            # Searches are already running while the local results are sent
+            for result in immediate:
+                yield result
+            for next_done in asyncio.as_completed(pending):
+                yield await next_done
+        finally:
+            # The client went away; stop searching on its behalf
+            for task in pending:
+                task.cancel()
+
+    async def _search(
+        self, key: str, indices: List[int], query: str, own_slots: asyncio.Semaphore
+    ) -> Tuple[List[int], Resolution]:
+        try:
+            async with own_slots, self.semaphore:
+                # Another request may have taught us this title while we queued
+                node = self.index.get(key)
+                if node is not None:
+                    self.local_hits += 1
+                    return indices, Resolution(node, 1.0, "local")
+                self.searches += 1
+                results = await self.mal_client.search_anime(
+                    query, limit=self.search_limit
+                )
+        except Exception as e:
+            logger.warning("Title search for %r failed: %s", query, e)
+            return indices, Resolution(
+                None, 0.0, "none", error="MyAnimeList search failed"
+            )
+
+        nodes = [item.get("node", item) for item in results]
+        # Usually a no-op: the MAL client feeds the same index
+        self.index.learn(nodes)
+        best, confidence = None, 0.0
+        # Ties keep MAL's relevance order
+        for node in nodes:
+            score = match_confidence(key, node)
+            if score > confidence:
+                best, confidence = node, score
+        if best is None:
+            return indices, Resolution(None, 0.0, "none")
+        return indices, Resolution(best, round(confidence, 3), "mal")
+
+    def stats(self) -> dict:
+        """Return index size and lookup counters for diagnostics."""
+        return {
+            "titles_indexed": len(self.index),
+            "local_hits": self.local_hits,
+            "searches": self.searches,
+            "searches_denied": self.searches_denied,
+        }
+
+
+@lru_cache()
+def get_title_resolver() -> TitleResolver:
+    """Get the process-wide title resolver."""
+    settings = get_settings()
+    return TitleResolver(
+        get_mal_client(),
+        concurrency=settings.resolve_concurrency,
+        per_request_concurrency=settings.resolve_concurrency_per_request,
+        index=get_title_index(),
+        search_burst=settings.resolve_search_burst,
+        searches_per_hour=settings.resolve_searches_per_hour,
+    )
@@ -0,0 +1,109 @@
+"""
+Startup timing and cache warm-up for scale-to-zero deployments.
+
+`StartupReport` records how long each startup phase took so cold-start
+regressions show up in logs and `/api/health`. `warm_up` runs in the background
+during the application lifespan, preloading the data the first requests need;
+`/api/ready` only reports ready once it has finished.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StartupReport:
+    """Timings of the startup phases, in milliseconds since process start."""
+
+    started_at: float = field(default_factory=time.perf_counter)
+    phases: Dict[str, float] = field(default_factory=dict)
+    warm: bool = False
+    warmup_error: Optional[str] = None
+    _last_mark: Optional[float] = None
+
+    def mark(self, phase: str) -> None:
+        """Record the duration of a phase that just finished."""
+        now = time.perf_counter()
+        previous = self._last_mark if self._last_mark is not None else self.started_at
+        self.phases[phase] = round((now - previous) * 1000, 1)
+        self._last_mark = now
+
+    @property
+    def total_ms(self) -> float:
+        """Time from process start to the last recorded phase."""
+        end = self._last_mark if self._last_mark is not None else self.started_at
+        return round((end - self.started_at) * 1000, 1)
+
+    def uptime_seconds(self) -> float:
+        """Seconds since the process started."""
+        return round(time.perf_counter() - self.started_at, 1)
+
+    def as_dict(self) -> dict:
+        """Return the report for health checks."""
+        return {
+            "phases_ms": dict(self.phases),
+            "total_ms": self.total_ms,
+            "warm": self.warm,
+            "warmup_error": self.warmup_error,
+        }
+
+
+startup_report = StartupReport()
+
+
+async def warm_up(timeout: float) -> None:
+    """
+    Preload heavy imports and hot upstream data.
+
+    Failures are logged and do not prevent the instance from becoming ready;
+    they only mean the first requests pay the cold cost.
+
+    Args:
+        timeout: Maximum seconds to spend warming up
+    """
+    try:
+        await asyncio.wait_for(_warm_up(), timeout=timeout)
+    except Exception as e:
+        startup_report.warmup_error = f"{type(e).__name__}: {e}"
+        logger.warning("Warm-up did not complete: %s", startup_report.warmup_error)
+    finally:
+        startup_report.warm = True
+        startup_report.mark("warmup")
+        logger.info(
+            "Startup finished in %.1f ms: %s",
+            startup_report.total_ms,
+            startup_report.phases,
+        )
+
+
+async def _warm_up() -> None:
+    # Import the OpenAI SDK off the event loop so the first request doesn't
+    # pay for it, then create the shared clients.
+    await asyncio.to_thread(importlib.import_module, "openai")
+
+    from app.config import get_settings
+    from app.services import get_mal_client, get_openai_client
+    from app.services.candidate_sources import get_candidate_fan_out
+
+    get_openai_client()
+    mal_client = get_mal_client()
+    startup_report.mark("warmup_imports")
+
+    # Co-recommendation graph saved by the previous process
+    graph_path = get_settings().co_graph_path
+    if mal_client.graph is not None and graph_path and os.path.exists(graph_path):
+        mal_client.graph.load(graph_path)
+        await mal_client.graph.refresh()
+        startup_report.mark("co_graph")
+
+    # Exploratory candidates for every request start from these MAL lists
+    await get_candidate_fan_out().warm(mal_client)
@@ -0,0 +1,89 @@
+"""
+Static file serving for the SvelteKit frontend build.
+
+The build step (adapter-node with `precompress`) writes `.br` and `.gz`
+siblings next to each asset. `PrecompressedStaticFiles` serves the best
+variant the client accepts and sets cache headers: content-hashed files under
+`_app/immutable/` are cached forever, everything else is revalidated with its
+ETag.
+
+Author: Runkai Zhang
+"""
+
+import mimetypes
+import os
+import stat
+from typing import Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from app.compression import accepted_encodings
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Encodings we look for on disk, best first
+PRECOMPRESSED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves build-time precompressed variants with cache headers."""
+
+    def __init__(self, *args, immutable_prefix: str = "_app/immutable/", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable_prefix = immutable_prefix
+
+    def file_response(
+        self,
+        full_path: "os.PathLike[str] | str",
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+
+        response: Optional[FileResponse] = None
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for encoding, suffix in PRECOMPRESSED_VARIANTS:
+            if accepted.get(encoding, 0.0) <= 0.0:
+                continue
+            variant_path = full_path + suffix
+            try:
+                variant_stat = os.stat(variant_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(variant_stat.st_mode):
+                continue
+            response = FileResponse(
+                variant_path,
+                status_code=status_code,
+                stat_result=variant_stat,
+                media_type=media_type,
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+
+        if response is None:
+            response = FileResponse(
+                full_path,
+                status_code=status_code,
+                stat_result=stat_result,
+                media_type=media_type,
+            )
+
+        response.headers["Vary"] = "Accept-Encoding"
+        relative_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        if f"/{self.immutable_prefix}" in f"/{relative_path}":
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
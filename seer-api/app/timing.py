@@ -0,0 +1,171 @@
+"""
+Per-request stage timing reported through the `Server-Timing` header.
+
+Code that does meaningful work wraps it in `with stage("name"):`. While a
+request is being served by `ServerTimingMiddleware`, the durations are
+collected into that request's `RequestTimings` (shared with any tasks it
+spawns), sent back as `Server-Timing` and written as one structured log line.
+Outside a timed request `stage` does nothing but a context variable lookup.
+
+A stage that runs several times, possibly concurrently (parallel MAL fetches,
+hedges), is reported as the wall-clock time during which at least one
+occurrence was running, not the sum of the occurrences' durations.
+
+Author: Runkai Zhang
+"""
+
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+def _covered_ms(spans: List[Tuple[float, float]]) -> float:
+    """Milliseconds covered by the union of (start, end) spans in seconds."""
+    total = 0.0
+    current_start, current_end = None, None
+    for start, end in sorted(spans):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total * 1000
+
+
+class RequestTimings:
+    """Recorded stage spans for one request."""
+
+    __slots__ = ("started_at", "spans", "counts", "parent")
+
+    def __init__(self, parent: Optional["RequestTimings"] = None):
+        self.started_at = time.perf_counter()
+        self.spans: Dict[str, List[Tuple[float, float]]] = {}
+        self.counts: Dict[str, int] = {}
+        self.parent = parent
+
+    def add(self, name: str, started_at: float, ended_at: float) -> None:
+        """Record one occurrence of a stage (also in any enclosing collection)."""
+        self.spans.setdefault(name, []).append((started_at, ended_at))
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if self.parent is not None:
+            self.parent.add(name, started_at, ended_at)
+
+    @property
+    def stages(self) -> Dict[str, float]:
+        """Wall-clock milliseconds per stage, overlapping occurrences counted once."""
+        return {name: _covered_ms(spans) for name, spans in self.spans.items()}
+
+    def count(self, prefix: str) -> int:
+        """Number of recorded stages whose name starts with `prefix`."""
+        return sum(n for name, n in self.counts.items() if name.startswith(prefix))
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the request started."""
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def header_value(self) -> str:
+        """Format as a Server-Timing header value."""
+        parts: List[str] = []
+        for name, duration in self.stages.items():
+            part = f"{name};dur={duration:.1f}"
+            if self.counts[name] > 1:
+                # Number of occurrences behind the wall-clock time
+                part += f';desc="x{self.counts[name]}"'
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block of work as a named stage of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, started_at, time.perf_counter())
+
+
+@contextmanager
+def collect() -> Iterator[RequestTimings]:
+    """
+    Record the stages run inside the block into a fresh `RequestTimings`.
+
+    Collections nest: stages are also recorded in the enclosing collection.
+    """
+    timings = RequestTimings(parent=_current.get())
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def detach() -> None:
+    """Stop recording stages in the current context (e.g. in background tasks)."""
+    _current.set(None)
+
+
+class ServerTimingMiddleware:
+    """Collect stage timings for each HTTP request under `path_prefix`."""
+
+    def __init__(self, app: ASGIApp, path_prefix: str = "/api"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header_value())
+            await send(message)
+
+        with collect() as timings:
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                logger.info(
+                    "request_timing %s",
+                    json.dumps(
+                        {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "status": status_code,
+                            "total_ms": round(timings.elapsed_ms(), 1),
+                            "stages_ms": {
+                                k: round(v, 1) for k, v in timings.stages.items()
+                            },
+                            "counts": timings.counts,
+                        },
+                        separators=(",", ":"),
+                    ),
+                )
@@ -0,0 +1,5 @@
+"""
+Offline evaluation of recommendation quality against latency and cost.
+
+Run `python -m evaluation.harness --help` from the seer-api directory.
+"""
@@ -0,0 +1,359 @@
+"""
+Replay a corpus of histories through RecommendationEngine and report
+latency, cost and quality proxies.
+
+Examples (from the seer-api directory):
+
+    # Synthetic users against fake MAL and a fake LLM judge
+    python -m evaluation.harness --users 50
+
+    # Compare the model cascade with full-model-only ranking
+    python -m evaluation.harness --fast-model "" --output full_only.json
+
+    # Record real MAL responses once, then replay them offline
+    python -m evaluation.harness --corpus histories/ --record mal.json
+    python -m evaluation.harness --corpus histories/ --replay mal.json
+
+Quality proxies per recommendation:
+- genre_novelty: share of its genres absent from the history (explore wants high)
+- hit_rate: it is one of the held-out positively rated anime
+- heldout_genre_match: best genre Jaccard with a held-out positive anime
+- candidate_diversity: mean pairwise genre distance of the candidate pool
+
+Author: Runkai Zhang
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from statistics import mean
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.schemas import AnimeHistoryItem, RecommendationMode
+from app.services.anime_record import AnimeRecord
+from app.services.co_graph import CoRecommendationGraph
+from app.services.hedging import Hedger
+from app.services.history_store import StoredHistory
+from app.services.mal_client import MALClient
+from app.services.openai_client import OpenAIRecommendationClient
+from app.services.prefetch import Prefetcher
+from app.services.profile import ProfileSigner
+from app.services.recommendation import RecommendationEngine
+from app.services.seen import SeenSet
+from app.timing import collect
+from evaluation.corpus import EvalCase, load_corpus, synthetic_corpus
+from evaluation.metrics import (
+    candidate_diversity,
+    genre_novelty,
+    heldout_genre_match,
+    rate,
+    summarize,
+)
+from evaluation.upstreams import (
+    Catalogue,
+    FakeLLM,
+    FakeMAL,
+    LatencyModel,
+    RecordingTransport,
+    ReplayTransport,
+)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m evaluation.harness",
+        description="Offline recommendation quality-vs-cost evaluation.",
+    )
+    corpus = parser.add_argument_group("corpus")
+    corpus.add_argument(
+        "--corpus", type=Path, help="JSON file or directory of histories"
+    )
+    corpus.add_argument("--users", type=int, default=30, help="Synthetic users")
+    corpus.add_argument("--history-length", type=int, default=20)
+    corpus.add_argument("--holdout", type=int, default=2, help="Held-out positives")
+    corpus.add_argument("--seed", type=int, default=1)
+    corpus.add_argument(
+        "--modes",
+        nargs="+",
+        default=["similar", "explore"],
+        choices=["similar", "explore"],
+    )
+
+    upstream = parser.add_argument_group("upstreams")
+    upstream.add_argument("--mal-latency-ms", type=float, default=80.0)
+    upstream.add_argument("--mal-tail-probability", type=float, default=0.02)
+    upstream.add_argument("--llm-latency-ms", type=float, default=600.0)
+    upstream.add_argument("--llm-ms-per-output-token", type=float, default=0.0)
+    upstream.add_argument(
+        "--record", type=Path, help="Call real MAL and save a cassette"
+    )
+    upstream.add_argument(
+        "--replay", type=Path, help="Answer MAL calls from a cassette"
+    )
+    upstream.add_argument(
+        "--live-llm", action="store_true", help="Rank with the real OpenAI API"
+    )
+
+    engine = parser.add_argument_group("engine")
+    engine.add_argument("--model", default="gpt-5.1")
+    engine.add_argument(
+        "--fast-model", default="gpt-5-mini", help='Cascade fast model ("" disables)'
+    )
+    engine.add_argument("--confidence-threshold", type=float, default=0.7)
+    engine.add_argument("--hedge", action="store_true", help="Hedge MAL detail calls")
+    engine.add_argument(
+        "--no-co-graph",
+        action="store_true",
+        help="Disable personalized PageRank familiar candidates",
+    )
+    engine.add_argument("--prefetch", action="store_true", help="Enable prefetching")
+    engine.add_argument(
+        "--cold", action="store_true", help="Fresh MAL cache for every request"
+    )
+
+    parser.add_argument("--output", type=Path, help="Write the full report as JSON")
+    return parser.parse_args(argv)
+
+
+def _call_total(counter: Counter) -> int:
+    return sum(counter.values())
+
+
+async def run_evaluation(args: argparse.Namespace) -> Dict[str, Any]:
+    """Evaluate every case in every mode and return the report."""
+    catalogue = Catalogue(seed=args.seed)
+    mal_latency = LatencyModel(
+        args.mal_latency_ms, tail_probability=args.mal_tail_probability
+    )
+    if args.record:
+        transport = RecordingTransport(args.record)
+    elif args.replay:
+        transport = ReplayTransport(args.replay, mal_latency)
+    else:
+        transport = FakeMAL(catalogue, mal_latency)
+
+    if args.corpus:
+        cases = load_corpus(args.corpus, holdout=args.holdout)
+    else:
+        cases = synthetic_corpus(
+            catalogue,
+            users=args.users,
+            history_length=args.history_length,
+            holdout=args.holdout,
+            seed=args.seed,
+        )
+
+    openai_client = OpenAIRecommendationClient(
+        api_key=os.environ.get("OPENAI_API_KEY", ""),
+        model=args.model,
+        fast_model=args.fast_model or None,
+        confidence_threshold=args.confidence_threshold,
+    )
+    llm: Optional[FakeLLM] = None
+    if not args.live_llm:
+        llm = FakeLLM(
+            LatencyModel(args.llm_latency_ms),
+            ms_per_output_token=args.llm_ms_per_output_token,
+        )
+        openai_client.client = llm
+
+    # Shared even with --cold: the graph outlives MAL response caches
+    graph = (
+        None
+        if args.no_co_graph
+        else CoRecommendationGraph(rebuild_interval=0, background=False)
+    )
+
+    def new_mal_client() -> MALClient:
+        return MALClient(
+            client_id=os.environ.get("MAL_CLIENT_ID", "offline-evaluation"),
+            hedger=Hedger() if args.hedge else None,
+            transport=transport,
+            graph=graph,
+        )
+
+    shared_mal_client = new_mal_client()
+    prefetcher = Prefetcher(enabled=args.prefetch, max_concurrent=2, max_foreground=4)
+    signer = ProfileSigner(b"offline-evaluation")
+
+    rows = []
+    started_at = time.perf_counter()
+    for mode in args.modes:
+        for case in cases:
+            mal_client = new_mal_client() if args.cold else shared_mal_client
+            rows.append(
+                await _evaluate_case(
+                    case,
+                    mode,
+                    RecordingEngine(
+                        mal_client,
+                        openai_client,
+                        profile_signer=signer,
+                        prefetcher=prefetcher,
+                    ),
+                    transport,
+                    llm,
+                )
+            )
+
+    if isinstance(transport, RecordingTransport):
+        transport.save()
+
+    return {
+        "config": {
+            k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+        },
+        "cases": len(cases),
+        "wall_seconds": round(time.perf_counter() - started_at, 2),
+        "modes": {
+            mode: _summarize_mode([r for r in rows if r["mode"] == mode])
+            for mode in args.modes
+        },
+        "requests": rows,
+    }
+
+
+class RecordingEngine(RecommendationEngine):
+    """Engine that remembers the candidate pool it built."""
+
+    last_candidates: List[AnimeRecord] = []
+
+    async def _gather_diverse_candidates(
+        self,
+        liked_ids: List[int],
+        seen_ids: SeenSet,
+        mode: RecommendationMode = RecommendationMode.EXPLORE,
+        disliked_ids: Sequence[int] = (),
+    ) -> List[AnimeRecord]:
+        candidates = await super()._gather_diverse_candidates(
+            liked_ids, seen_ids, mode, disliked_ids
+        )
+        self.last_candidates = candidates
+        return candidates
+
+
+async def _evaluate_case(
+    case: EvalCase,
+    mode: str,
+    engine: RecordingEngine,
+    transport: Any,
+    llm: Optional[FakeLLM],
+) -> Dict[str, Any]:
+    history = StoredHistory.from_items(
+        [AnimeHistoryItem.model_validate(item) for item in case.history]
+    )
+    mal_before = _call_total(transport.calls)
+    llm_before = _call_total(llm.calls) if llm else 0
+
+    row: Dict[str, Any] = {"case_id": case.case_id, "mode": mode, "ok": False}
+    started_at = time.perf_counter()
+    with collect() as timings:
+        try:
+            result = await engine.get_recommendation(
+                history=history, mode=RecommendationMode(mode)
+            )
+        except Exception as e:
+            result = None
+            row["error"] = f"{type(e).__name__}: {e}"
+    row["latency_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+    row["stages_ms"] = {k: round(v, 1) for k, v in timings.stages.items()}
+    row["mal_calls"] = _call_total(transport.calls) - mal_before
+    row["llm_calls"] = _call_total(llm.calls) - llm_before if llm else None
+    if result is None:
+        return row
+
+    recommendation = result["recommendation"]
+    genres = recommendation.get("genres", [])
+    held_out_ids = {item["mal_id"] for item in case.held_out}
+    row.update(
+        ok=True,
+        recommended_id=recommendation["mal_id"],
+        model_tier=result["model_tier"],
+        **result["token_usage"],
+        genre_novelty=round(genre_novelty(genres, case.history_genres), 3),
+        hit=recommendation["mal_id"] in held_out_ids,
+        heldout_genre_match=round(
+            heldout_genre_match(genres, [h.get("genres", []) for h in case.held_out]),
+            3,
+        ),
+        candidate_diversity=round(
+            candidate_diversity([c.genres for c in engine.last_candidates]), 3
+        ),
+        candidates=len(engine.last_candidates),
+    )
+    return row
+
+
+def _summarize_mode(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r for r in rows if r["ok"]]
+    stage_names = sorted({name for r in ok for name in r["stages_ms"]})
+    return {
+        "requests": len(rows),
+        "errors": len(rows) - len(ok),
+        "latency_ms": summarize([r["latency_ms"] for r in ok]),
+        "stages_mean_ms": {
+            name: round(mean(r["stages_ms"].get(name, 0.0) for r in ok), 1)
+            for name in stage_names
+        },
+        "prompt_tokens": summarize([r["prompt_tokens"] for r in ok]),
+        "completion_tokens": summarize([r["completion_tokens"] for r in ok]),
+        "mal_calls": summarize([r["mal_calls"] for r in rows]),
+        "llm_calls": summarize(
+            [r["llm_calls"] for r in rows if r["llm_calls"] is not None]
+        ),
+        "model_tiers": dict(Counter(r["model_tier"] for r in ok)),
+        "genre_novelty": summarize([r["genre_novelty"] for r in ok])["mean"],
+        "hit_rate": rate([r["hit"] for r in ok]),
+        "heldout_genre_match": summarize([r["heldout_genre_match"] for r in ok])[
+            "mean"
+        ],
+        "candidate_diversity": summarize([r["candidate_diversity"] for r in ok])[
+            "mean"
+        ],
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Human-readable summary of a report."""
+    lines = [f"{report['cases']} histories, {report['wall_seconds']} s wall time"]
+    for mode, summary in report["modes"].items():
+        latency = summary["latency_ms"]
+        lines += [
+            "",
+            f"[{mode}] {summary['requests']} requests, {summary['errors']} errors",
+            f"  latency ms        mean {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}",
+            f"  stages mean ms    {summary['stages_mean_ms']}",
+            f"  prompt tokens     mean {summary['prompt_tokens']['mean']}",
+            f"  completion tokens mean {summary['completion_tokens']['mean']}",
+            f"  MAL calls         mean {summary['mal_calls']['mean']}",
+            f"  LLM calls         mean {summary['llm_calls']['mean']}",
+            f"  model tiers       {summary['model_tiers']}",
+            f"  genre novelty     {summary['genre_novelty']}",
+            f"  hit rate          {summary['hit_rate']}",
+            f"  held-out match    {summary['heldout_genre_match']}",
+            f"  candidate div.    {summary['candidate_diversity']}",
+        ]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Settings are only consulted for defaults; offline runs need no real keys
+    if not args.live_llm:
+        os.environ.setdefault("OPENAI_API_KEY", "offline-evaluation")
+    if not args.record:
+        os.environ.setdefault("MAL_CLIENT_ID", "offline-evaluation")
+
+    report = asyncio.run(run_evaluation(args))
+    print(format_report(report))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nFull report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
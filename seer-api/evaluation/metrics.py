@@ -0,0 +1,66 @@
+"""
+Quality proxies and summary statistics for evaluation runs.
+
+Author: Runkai Zhang
+"""
+
+from itertools import combinations
+from statistics import mean
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """Jaccard similarity of two sets (0 when both are empty)."""
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def genre_novelty(recommended: Iterable[str], history_genres: Set[str]) -> float:
+    """Share of the recommendation's genres that never appear in the history."""
+    genres = set(recommended)
+    if not genres:
+        return 0.0
+    return len(genres - history_genres) / len(genres)
+
+
+def heldout_genre_match(
+    recommended: Iterable[str], held_out: Sequence[Iterable[str]]
+) -> float:
+    """Best genre Jaccard between the recommendation and a held-out positive."""
+    genres = set(recommended)
+    return max((jaccard(genres, set(h)) for h in held_out), default=0.0)
+
+
+def candidate_diversity(candidate_genres: Sequence[Iterable[str]]) -> float:
+    """Mean pairwise Jaccard distance between candidate genre sets."""
+    sets = [set(g) for g in candidate_genres]
+    pairs = list(combinations(sets, 2))
+    if not pairs:
+        return 0.0
+    return mean(1.0 - jaccard(a, b) for a, b in pairs)
+
+
+def percentile(values: Sequence[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(max(int(round(fraction * len(ordered) + 0.5)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Mean, p50 and p95 of a series, rounded for reports."""
+    if not values:
+        return {"mean": None, "p50": None, "p95": None}
+    return {
+        "mean": round(mean(values), 3),
+        "p50": round(percentile(values, 0.5), 3),
+        "p95": round(percentile(values, 0.95), 3),
+    }
+
+
+def rate(flags: List[bool]) -> Optional[float]:
+    """Fraction of true flags."""
+    return round(sum(flags) / len(flags), 3) if flags else None
@@ -0,0 +1,410 @@
+"""
+Fake and recorded upstreams for offline evaluation.
+
+`Catalogue` is a deterministic synthetic anime universe. `FakeMAL` serves it
+through an httpx transport with the MAL API's URL and JSON shapes, and
+`FakeLLM` stands in for the OpenAI SDK with a simple, deterministic judge.
+Both add simulated latency and count calls, so latency and upstream usage can
+be compared between engine configurations without network access or cost.
+
+`RecordingTransport` and `ReplayTransport` capture real MAL responses to a
+cassette file once and replay them later.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+GENRES = [
+    "Action",
+    "Adventure",
+    "Comedy",
+    "Drama",
+    "Fantasy",
+    "Horror",
+    "Mecha",
+    "Music",
+    "Mystery",
+    "Psychological",
+    "Romance",
+    "Sci-Fi",
+    "Slice of Life",
+    "Sports",
+    "Supernatural",
+    "Suspense",
+]
+STUDIOS = [f"Studio {name}" for name in "ABCDEFGHIJKL"]
+SOURCES = ["manga", "light_novel", "original", "web_manga", "visual_novel"]
+
+
+@dataclass(frozen=True)
+class CatalogueEntry:
+    """One synthetic anime."""
+
+    mal_id: int
+    title: str
+    genres: Tuple[str, ...]
+    studio: str
+    source: str
+    score: float
+    episodes: int
+
+
+class Catalogue:
+    """Deterministic synthetic anime catalogue with MAL-style recommendations."""
+
+    def __init__(self, size: int = 3000, seed: int = 7):
+        rng = random.Random(seed)
+        # Some genres are much more common than others, as on MAL
+        weights = [1.0 / (rank + 1) ** 0.6 for rank in range(len(GENRES))]
+        self.entries: Dict[int, CatalogueEntry] = {}
+        for mal_id in range(1, size + 1):
+            count = rng.choice((2, 2, 3, 3, 4))
+            genres = set()
+            while len(genres) < count:
+                genres.add(rng.choices(GENRES, weights)[0])
+            self.entries[mal_id] = CatalogueEntry(
+                mal_id=mal_id,
+                title=f"Synthetic Anime {mal_id}",
+                genres=tuple(sorted(genres)),
+                studio=rng.choice(STUDIOS),
+                source=rng.choice(SOURCES),
+                score=round(min(max(rng.gauss(7.2, 0.7), 5.0), 9.3), 2),
+                episodes=rng.choice((12, 13, 24, 25, 50)),
+            )
+        self.ranked_ids = sorted(
+            self.entries, key=lambda i: (-self.entries[i].score, i)
+        )
+        self.rank = {mal_id: i + 1 for i, mal_id in enumerate(self.ranked_ids)}
+        self._seed = seed
+        self._recommendations: Dict[int, List[int]] = {}
+
+    def ranking(self, ranking_type: str) -> List[int]:
+        """IDs in the order of a MAL ranking type."""
+        if ranking_type == "bypopularity":
+            return sorted(self.ranked_ids, key=lambda i: (i * 7919) % len(self.entries))
+        if ranking_type == "favorite":
+            return sorted(
+                self.ranked_ids,
+                key=lambda i: -self.entries[i].score * (1 + (i % 5) / 10),
+            )
+        # Airing shows, movies and OVAs are disjoint slices of the catalogue
+        slices = {"airing": 0, "movie": 1, "ova": 2, "tv": 3}
+        if ranking_type in slices:
+            return [i for i in self.ranked_ids if i % 10 == slices[ranking_type]]
+        return self.ranked_ids
+
+    def season(self, year: int, season: str) -> List[int]:
+        """IDs of a season's anime, best scored first."""
+        rng = random.Random(f"{self._seed}-{year}-{season}")
+        return sorted(
+            rng.sample(self.ranked_ids, 60), key=lambda i: -self.entries[i].score
+        )
+
+    def __contains__(self, mal_id: int) -> bool:
+        return mal_id in self.entries
+
+    def with_genre(self, genre: str) -> List[int]:
+        """IDs of all anime tagged with `genre`."""
+        return [i for i, e in self.entries.items() if genre in e.genres]
+
+    def recommendations(self, mal_id: int, limit: int = 10) -> List[int]:
+        """The most genre-similar anime among a fixed pseudo-random sample."""
+        cached = self._recommendations.get(mal_id)
+        if cached is not None:
+            return cached[:limit]
+        rng = random.Random(self._seed * 100003 + mal_id)
+        genres = set(self.entries[mal_id].genres)
+        sample = rng.sample(self.ranked_ids, min(300, len(self.ranked_ids)))
+        scored = sorted(
+            (
+                (
+                    -len(genres & set(self.entries[other].genres)),
+                    self.rank[other],
+                    other,
+                )
+                for other in sample
+                if other != mal_id
+            )
+        )
+        self._recommendations[mal_id] = [other for _, _, other in scored[:10]]
+        return self._recommendations[mal_id][:limit]
+
+    def node(self, mal_id: int) -> Dict[str, Any]:
+        """MAL API representation of an anime."""
+        entry = self.entries[mal_id]
+        return {
+            "id": entry.mal_id,
+            "title": entry.title,
+            "main_picture": {"medium": f"https://cdn.example/{mal_id}.jpg"},
+            "mean": entry.score,
+            "rank": self.rank[mal_id],
+            "popularity": self.rank[mal_id],
+            "genres": [{"id": GENRES.index(g) + 1, "name": g} for g in entry.genres],
+            "studios": [{"id": STUDIOS.index(entry.studio) + 1, "name": entry.studio}],
+            "num_episodes": entry.episodes,
+            "media_type": "tv",
+            "source": entry.source,
+            "rating": "pg_13",
+            "synopsis": f"{entry.title} is a {', '.join(entry.genres).lower()} "
+            "story. " * 4,
+        }
+
+    def details(self, mal_id: int) -> Dict[str, Any]:
+        """MAL anime details, including recommendations."""
+        node = self.node(mal_id)
+        node["recommendations"] = [
+            {
+                "node": {"id": other, "title": self.entries[other].title},
+                "num_recommendations": 10 - i,
+            }
+            for i, other in enumerate(self.recommendations(mal_id))
+        ]
+        return node
+
+
+@dataclass
+class LatencyModel:
+    """Log-normal latency with an occasional slow tail, in milliseconds."""
+
+    median_ms: float
+    sigma: float = 0.35
+    tail_probability: float = 0.0
+    tail_multiplier: float = 8.0
+    rng: random.Random = field(default_factory=lambda: random.Random(11))
+
+    async def sleep(self) -> None:
+        if self.median_ms <= 0:
+            return
+        delay = self.median_ms * self.rng.lognormvariate(0.0, self.sigma)
+        if self.rng.random() < self.tail_probability:
+            delay *= self.tail_multiplier
+        await asyncio.sleep(delay / 1000)
+
+
+class FakeMAL(httpx.AsyncBaseTransport):
+    """httpx transport answering MAL API v2 requests from a `Catalogue`."""
+
+    def __init__(self, catalogue: Catalogue, latency: LatencyModel):
+        self.catalogue = catalogue
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.latency.sleep()
+        path = request.url.path.removeprefix("/v2")
+        params = request.url.params
+
+        if path == "/anime/ranking":
+            self.calls["ranking"] += 1
+            ids = self.catalogue.ranking(params.get("ranking_type", "all"))
+            return self._list_page(request, ids)
+
+        season = re.fullmatch(r"/anime/season/(\d+)/(\w+)", path)
+        if season:
+            self.calls["season"] += 1
+            ids = self.catalogue.season(int(season.group(1)), season.group(2))
+            return self._list_page(request, ids)
+
+        if path == "/anime":
+            self.calls["search"] += 1
+            query = params.get("q", "").lower()
+            matches = [
+                i
+                for i in self.catalogue.ranked_ids
+                if query in self.catalogue.entries[i].title.lower()
+            ][: int(params.get("limit", 5))]
+            return httpx.Response(
+                200, json={"data": [{"node": self.catalogue.node(i)} for i in matches]}
+            )
+
+        match = re.fullmatch(r"/anime/(\d+)", path)
+        if match and int(match.group(1)) in self.catalogue:
+            self.calls["details"] += 1
+            return httpx.Response(200, json=self.catalogue.details(int(match.group(1))))
+
+        self.calls["not_found"] += 1
+        return httpx.Response(404, json={"error": "not_found"})
+
+    def _list_page(self, request: httpx.Request, ids: List[int]) -> httpx.Response:
+        params = request.url.params
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 10))
+        body: Dict[str, Any] = {
+            "data": [
+                {"node": self.catalogue.node(i), "ranking": {"rank": offset + n + 1}}
+                for n, i in enumerate(ids[offset : offset + limit])
+            ],
+            "paging": {},
+        }
+        if offset + limit < len(ids):
+            body["paging"]["next"] = str(
+                request.url.copy_merge_params({"offset": offset + limit})
+            )
+        return httpx.Response(200, json=body)
+
+
+def _cassette_key(request: httpx.Request) -> str:
+    params = sorted(request.url.params.multi_items())
+    return f"{request.method} {request.url.path}?{httpx.QueryParams(params)}"
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Pass requests to the real API and save the responses to a cassette."""
+
+    def __init__(self, path: Path, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.path = path
+        self.inner = inner or httpx.AsyncHTTPTransport()
+        self.recorded: Dict[str, Dict[str, Any]] = {}
+        self.calls: Counter = Counter()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.calls["recorded"] += 1
+        response = await self.inner.handle_async_request(request)
+        content = await response.aread()
+        self.recorded[_cassette_key(request)] = {
+            "status": response.status_code,
+            "body": content.decode("utf-8"),
+        }
+        return httpx.Response(
+            response.status_code,
+            content=content,
+            headers={"content-type": response.headers.get("content-type", "")},
+        )
+
+    def save(self) -> None:
+        """Write (and merge into) the cassette file."""
+        existing = {}
+        if self.path.exists():
+            existing = json.loads(self.path.read_text())
+        existing.update(self.recorded)
+        self.path.write_text(json.dumps(existing, indent=1, sort_keys=True))
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Answer requests from a cassette written by `RecordingTransport`."""
+
+    def __init__(self, path: Path, latency: LatencyModel):
+        self.responses: Dict[str, Dict[str, Any]] = json.loads(path.read_text())
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.latency.sleep()
+        recorded = self.responses.get(_cassette_key(request))
+        if recorded is None:
+            self.calls["missing"] += 1
+            return httpx.Response(404, json={"error": "not_recorded"})
+        self.calls["replayed"] += 1
+        return httpx.Response(
+            recorded["status"],
+            content=recorded["body"].encode("utf-8"),
+            headers={"content-type": "application/json"},
+        )
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = _Message(content)
+
+
+class _Completion:
+    def __init__(self, content: str, usage: _Usage):
+        self.choices = [_Choice(content)]
+        self.usage = usage
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)."""
+    return max(1, len(text) // 4)
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for `AsyncOpenAI` that ranks candidates by genre.
+
+    It reads the prompt like the real model would: genres in the history part
+    count as the user's taste, and candidates are scored by overlap (similar
+    mode) or by how many new genres they bring (explore mode), with the MAL
+    score as a tie-breaker. Tokens are estimated from the prompt length.
+    """
+
+    def __init__(self, latency: LatencyModel, ms_per_output_token: float = 0.0):
+        self.latency = latency
+        self.ms_per_output_token = ms_per_output_token
+        self.calls: Counter = Counter()
+        self.chat = self
+        self.completions = self
+
+    async def create(self, model: str, messages: List[Dict[str, str]], **kwargs):
+        self.calls[model] += 1
+        prompt = messages[-1]["content"]
+        explore = "expand" in messages[0]["content"].lower()
+        content = json.dumps(self._judge(prompt, explore))
+
+        completion_tokens = estimate_tokens(content)
+        await self.latency.sleep()
+        await asyncio.sleep(completion_tokens * self.ms_per_output_token / 1000)
+        usage = _Usage(
+            sum(estimate_tokens(m["content"]) for m in messages), completion_tokens
+        )
+        return _Completion(content, usage)
+
+    def _judge(self, prompt: str, explore: bool) -> Dict[str, Any]:
+        history_part, _, rest = prompt.partition("Available Candidates:")
+        candidates_part = rest.split("Your Mission:")[0]
+
+        taste = Counter()
+        for line in re.findall(r"Genres: (.+)", history_part):
+            taste.update(g.strip() for g in line.split(","))
+
+        best: Optional[Tuple[float, int, str]] = None
+        for block in re.split(r"\n(?=\d+\. )", candidates_part.strip()):
+            header = re.search(r"^\d+\. (.+?) \(MAL ID: (\d+)\)", block)
+            if not header:
+                continue
+            genres_line = re.search(r"Genres: (.+)", block)
+            genres = (
+                [g.strip() for g in genres_line.group(1).split(",")]
+                if genres_line
+                else []
+            )
+            score_match = re.search(r"MAL Score: ([\d.]+)", block)
+            score = float(score_match.group(1)) if score_match else 0.0
+            if explore:
+                fit = sum(1 for g in genres if not taste[g]) + 0.1 * len(genres)
+            else:
+                fit = sum(min(taste[g], 3) for g in genres)
+            key = (fit + score / 10, int(header.group(2)), header.group(1))
+            if best is None or key[0] > best[0]:
+                best = key
+
+        if best is None:
+            return {"mal_id": None, "reason": "No candidates", "confidence": 0.0}
+        return {
+            "mal_id": best[1],
+            "title": best[2],
+            "reason": "Chosen by the offline evaluation judge.",
+            "confidence": 0.8,
+        }
@@ -0,0 +1,15 @@
+"""
+Shared pytest setup: make the `app` package importable and give the required
+settings dummy values so modules that read them at import time load.
+
+Author: Runkai Zhang
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("MAL_CLIENT_ID", "test")
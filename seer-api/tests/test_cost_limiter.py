@@ -0,0 +1,100 @@
+"""
+Tests for cost reservations and their settlement.
+
+Author: Runkai Zhang
+"""
+
+import pytest
+
+from app.services.cost_limiter import CostLimiter, CostLimitExceeded, RequestCost
+
+
+def make_limiter(**overrides):
+    # Practically no refill, so balances only change through charges
+    settings = dict(
+        client_capacity=10_000,
+        client_refill_per_hour=1e-6,
+        global_capacity=100_000,
+        global_refill_per_minute=1e-6,
+        default_estimate=3000,
+    )
+    settings.update(overrides)
+    return CostLimiter(**settings)
+
+
+def spent(limiter, client_key="client"):
+    return limiter.client_capacity - limiter.clients.get(client_key).tokens
+
+
+def test_reserve_charges_estimate_plus_history():
+    limiter = make_limiter()
+    reservation = limiter.reserve("client", "explore", history_items=50)
+    assert reservation.estimate == 3050
+    assert spent(limiter) == pytest.approx(3050, abs=0.01)
+
+
+def test_settle_replaces_estimate_with_actual_cost():
+    limiter = make_limiter()
+    reservation = limiter.reserve("client", "explore", history_items=10)
+    cost = RequestCost(
+        prompt_tokens=500, completion_tokens=50, mal_calls=2, history_items=10
+    )
+    charged = reservation.settle(cost)
+
+    # 500 + 50 * 4 + 2 * 100 + 10 * 1
+    assert charged == 910
+    assert spent(limiter) == pytest.approx(910, abs=0.01)
+    assert limiter.global_bucket.tokens == pytest.approx(100_000 - 910, abs=0.01)
+
+
+def test_settle_without_cost_keeps_estimate():
+    limiter = make_limiter()
+    reservation = limiter.reserve("client", "explore", history_items=0)
+    assert reservation.settle(None) == 3000
+    assert spent(limiter) == pytest.approx(3000, abs=0.01)
+    # Failures say nothing about typical cost
+    assert limiter.estimate("explore", 0) == 3000
+
+
+def test_settle_is_idempotent():
+    limiter = make_limiter()
+    reservation = limiter.reserve("client", "explore", history_items=0)
+    reservation.settle(RequestCost(prompt_tokens=100))
+    assert reservation.settle(RequestCost(prompt_tokens=9000)) == 0.0
+    assert reservation.settle(None) == 0.0
+    assert spent(limiter) == pytest.approx(100, abs=0.01)
+
+
+def test_settle_updates_mode_estimate_without_history():
+    limiter = make_limiter()
+    reservation = limiter.reserve("client", "similar", history_items=100)
+    reservation.settle(RequestCost(prompt_tokens=1000, history_items=100))
+    # The upstream part (1000) is smoothed into the estimate, history is not
+    assert limiter.estimate("similar", 0) == pytest.approx(3000 + 0.1 * (1000 - 3000))
+    assert limiter.estimate("explore", 0) == 3000
+
+
+def test_costly_request_can_overdraw_and_blocks_the_next():
+    limiter = make_limiter(client_capacity=5000)
+    reservation = limiter.reserve("client", "explore", history_items=0)
+    reservation.settle(RequestCost(prompt_tokens=8000))
+    assert limiter.clients.get("client").tokens < 0
+
+    with pytest.raises(CostLimitExceeded) as excinfo:
+        limiter.reserve("client", "explore", history_items=0)
+    assert excinfo.value.retry_after > 0
+
+
+def test_clients_are_budgeted_separately():
+    limiter = make_limiter(client_capacity=5000)
+    limiter.reserve("a", "explore", history_items=0).settle(None)
+    with pytest.raises(CostLimitExceeded):
+        limiter.reserve("a", "explore", history_items=0)
+    limiter.reserve("b", "explore", history_items=0)
+
+
+def test_disabled_limiter_never_charges():
+    limiter = make_limiter(enabled=False)
+    reservation = limiter.reserve("client", "explore", history_items=10)
+    assert reservation.settle(RequestCost(prompt_tokens=10**9)) == 0.0
+    assert limiter.clients.get("client") is None
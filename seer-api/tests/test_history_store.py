@@ -0,0 +1,117 @@
+"""
+Tests for the history delta protocol in HistoryStore.
+
+Author: Runkai Zhang
+"""
+
+import pytest
+
+from app.schemas import AnimeHistoryItem, HistoryDelta
+from app.services.history_store import (
+    HistoryBaseEvictedError,
+    HistoryDeltaError,
+    HistoryStore,
+    StoredHistory,
+)
+
+
+def item(mal_id, rating=None, **fields):
+    return AnimeHistoryItem(
+        mal_id=mal_id, title=f"Anime {mal_id}", rating=rating, **fields
+    )
+
+
+@pytest.fixture
+def store():
+    return HistoryStore(max_entries=16, ttl_seconds=3600, max_items=1000)
+
+
+def test_put_returns_history_under_its_content_hash(store):
+    stored = store.put([item(1, "positive"), item(2)])
+    again = store.apply_delta(HistoryDelta(base_hash=stored.content_hash))
+    assert again.items == stored.items
+    assert again.content_hash == stored.content_hash
+
+
+def test_delta_matches_full_history(store):
+    base = store.put([item(1, "positive"), item(2, "negative"), item(3)])
+    appended = [item(4, "positive"), item(5, "neutral")]
+    rebuilt = store.apply_delta(
+        HistoryDelta(
+            base_hash=base.content_hash,
+            appended_items=appended,
+            rating_changes={2: "positive", 3: "negative"},
+        )
+    )
+
+    expected = StoredHistory.from_items(
+        [
+            item(1, "positive"),
+            item(2, "positive"),
+            item(3, "negative"),
+            *appended,
+        ]
+    )
+    assert rebuilt.content_hash == expected.content_hash
+    assert rebuilt.liked_ids == expected.liked_ids == (1, 2, 4)
+    assert rebuilt.disliked_ids == expected.disliked_ids == (3,)
+    assert list(rebuilt.anime_ids) == [1, 2, 3, 4, 5]
+
+
+def test_delta_does_not_modify_its_base(store):
+    base = store.put([item(1, "positive")])
+    store.apply_delta(
+        HistoryDelta(
+            base_hash=base.content_hash,
+            appended_items=[item(2, "negative")],
+            rating_changes={1: None},
+        )
+    )
+    assert base.items[0].rating.value == "positive"
+    assert base.liked_ids == (1,)
+    assert 2 not in base.anime_ids
+
+
+def test_rating_change_for_unknown_anime_is_rejected(store):
+    base = store.put([item(1)])
+    with pytest.raises(HistoryDeltaError):
+        store.apply_delta(
+            HistoryDelta(base_hash=base.content_hash, rating_changes={2: "positive"})
+        )
+
+
+def test_rating_change_for_appended_anime_is_rejected(store):
+    # Rating changes apply to the base; appended items carry their own rating
+    base = store.put([item(1)])
+    with pytest.raises(HistoryDeltaError):
+        store.apply_delta(
+            HistoryDelta(
+                base_hash=base.content_hash,
+                appended_items=[item(2)],
+                rating_changes={2: "positive"},
+            )
+        )
+
+
+def test_unknown_base_hash(store):
+    with pytest.raises(HistoryBaseEvictedError):
+        store.apply_delta(HistoryDelta(base_hash="0" * 32))
+
+
+def test_evicted_base(store):
+    small = HistoryStore(max_entries=1, ttl_seconds=3600, max_items=1000)
+    first = small.put([item(1)])
+    small.put([item(2)])
+    with pytest.raises(HistoryBaseEvictedError):
+        small.apply_delta(HistoryDelta(base_hash=first.content_hash))
+
+
+def test_long_synopses_are_trimmed_consistently(store):
+    long_item = item(1, synopsis="x" * 5000)
+    base = store.put([item(2)])
+    via_delta = store.apply_delta(
+        HistoryDelta(base_hash=base.content_hash, appended_items=[long_item])
+    )
+    full = store.put([item(2), long_item])
+    assert via_delta.content_hash == full.content_hash
+    assert len(via_delta.items[1].synopsis) < 5000
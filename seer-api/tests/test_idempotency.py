@@ -0,0 +1,136 @@
+"""
+Tests for IdempotencyStore replay, coalescing and key reuse.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+
+import pytest
+
+from app.schemas import RecommendRequest
+from app.services.idempotency import (
+    IdempotencyKeyReused,
+    IdempotencyStore,
+    request_fingerprint,
+)
+
+
+class Counter:
+    """A compute function that counts its calls."""
+
+    def __init__(self, result="result", delay=0.0, error=None):
+        self.calls = 0
+        self.result = result
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_completed_request_is_replayed():
+    async def scenario():
+        store = IdempotencyStore()
+        compute = Counter()
+        first = await store.run("client", "key", "body", compute)
+        second = await store.run("client", "key", "body", compute)
+        return first, second, compute.calls
+
+    first, second, calls = asyncio.run(scenario())
+    assert first == ("result", False)
+    assert second == ("result", True)
+    assert calls == 1
+
+
+def test_in_flight_duplicates_share_one_computation():
+    async def scenario():
+        store = IdempotencyStore()
+        compute = Counter(delay=0.01)
+        results = await asyncio.gather(
+            *[store.run("client", "key", "body", compute) for _ in range(5)]
+        )
+        return results, compute.calls, store.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert [shared for _, shared in results].count(False) == 1
+    assert all(result == "result" for result, _ in results)
+    assert stats["coalesced"] == 4
+
+
+def test_key_reused_with_different_body():
+    async def scenario():
+        store = IdempotencyStore()
+        await store.run("client", "key", "body-a", Counter())
+        with pytest.raises(IdempotencyKeyReused):
+            await store.run("client", "key", "body-b", Counter())
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_while_first_request_runs():
+    async def scenario():
+        store = IdempotencyStore()
+        first = asyncio.ensure_future(
+            store.run("client", "key", "body-a", Counter(delay=0.01))
+        )
+        await asyncio.sleep(0)
+        with pytest.raises(IdempotencyKeyReused):
+            await store.run("client", "key", "body-b", Counter())
+        return await first
+
+    assert asyncio.run(scenario()) == ("result", False)
+
+
+def test_keys_are_scoped_per_client():
+    async def scenario():
+        store = IdempotencyStore()
+        compute = Counter()
+        await store.run("a", "key", "body", compute)
+        _, shared = await store.run("b", "key", "body-b", compute)
+        return shared, compute.calls
+
+    assert asyncio.run(scenario()) == (False, 2)
+
+
+def test_failures_are_not_stored():
+    async def scenario():
+        store = IdempotencyStore()
+        failing = Counter(error=RuntimeError("upstream down"))
+        with pytest.raises(RuntimeError):
+            await store.run("client", "key", "body", failing)
+        return await store.run("client", "key", "body", Counter())
+
+    assert asyncio.run(scenario()) == ("result", False)
+
+
+def test_requests_without_key_are_matched_by_body_briefly():
+    async def scenario():
+        store = IdempotencyStore(body_ttl_seconds=0.05)
+        compute = Counter()
+        _, replayed = await store.run("client", None, "body", compute)
+        _, shared = await store.run("client", None, "body", compute)
+        await asyncio.sleep(0.1)
+        _, expired = await store.run("client", None, "body", compute)
+        return replayed, shared, expired, compute.calls
+
+    assert asyncio.run(scenario()) == (False, True, False, 2)
+
+
+def test_fingerprint_ignores_field_order():
+    a = RecommendRequest.model_validate(
+        {"anime_history": [{"mal_id": 1, "title": "A"}], "mode": "similar"}
+    )
+    b = RecommendRequest.model_validate(
+        {"mode": "similar", "anime_history": [{"title": "A", "mal_id": 1}]}
+    )
+    c = RecommendRequest.model_validate(
+        {"anime_history": [{"mal_id": 2, "title": "A"}], "mode": "similar"}
+    )
+    assert request_fingerprint(a) == request_fingerprint(b)
+    assert request_fingerprint(a) != request_fingerprint(c)
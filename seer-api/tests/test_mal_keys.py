@@ -0,0 +1,132 @@
+"""
+Tests for balancing and benching in ClientKeyPool.
+
+Author: Runkai Zhang
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.mal_keys import ClientKeyPool
+
+
+async def take(pool, exclude=None):
+    async with pool.acquire(exclude) as key:
+        return key
+
+
+def test_requires_a_client_id():
+    with pytest.raises(ValueError):
+        ClientKeyPool(["", ""])
+
+
+def test_duplicate_ids_are_merged():
+    assert len(ClientKeyPool(["a", "b", "a"])) == 2
+
+
+def test_least_loaded_key_is_chosen():
+    async def scenario():
+        pool = ClientKeyPool(["aaaa", "bbbb"])
+        async with pool.acquire() as first:
+            second = await take(pool)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+
+
+def test_429_benches_key_and_others_take_over():
+    async def scenario():
+        pool = ClientKeyPool(["aaaa", "bbbb"], bench_seconds=30)
+        key = await take(pool)
+        sent_at = time.monotonic()
+        assert pool.report(key, sent_at, 429) is True
+        others = {await take(pool) for _ in range(5)}
+        return key, others
+
+    benched, others = asyncio.run(scenario())
+    assert benched not in others
+
+
+def test_bench_honours_retry_after_and_doubles():
+    pool = ClientKeyPool(["aaaa", "bbbb"], bench_seconds=10, max_bench_seconds=100)
+    key = pool.keys[0]
+
+    pool.report(key, time.monotonic(), 429)
+    first = key.benched_until - time.monotonic()
+    # A response to a request sent during the bench does not extend it
+    assert pool.report(key, time.monotonic(), 429) is True
+    assert key.failures == 1
+
+    key.benched_until = 0.0
+    pool.report(key, time.monotonic(), 403, retry_after="60")
+    second = key.benched_until - time.monotonic()
+
+    assert first == pytest.approx(10, abs=1)
+    assert second == pytest.approx(60, abs=1)
+    assert key.failures == 2
+
+
+def test_success_after_bench_resets_failures():
+    pool = ClientKeyPool(["aaaa", "bbbb"], bench_seconds=10)
+    key = pool.keys[0]
+    sent_before = time.monotonic()
+    pool.report(key, sent_before, 429)
+
+    # Answered after the bench ended but sent before it started: no reset
+    time.sleep(0.01)
+    key.benched_until = time.monotonic() - 0.001
+    pool.report(key, sent_before, 200)
+    assert key.failures == 1
+
+    pool.report(key, time.monotonic(), 200)
+    assert key.failures == 0
+
+
+def test_all_keys_benched_falls_back_to_first_back():
+    async def scenario():
+        pool = ClientKeyPool(["aaaa", "bbbb"], bench_seconds=30)
+        first, second = pool.keys
+        now = time.monotonic()
+        first.benched_until = now + 100
+        second.benched_until = now + 10
+        return second, await take(pool)
+
+    expected, chosen = asyncio.run(scenario())
+    assert chosen is expected
+
+
+def test_exclude_avoids_the_failed_key():
+    async def scenario():
+        pool = ClientKeyPool(["aaaa", "bbbb"])
+        return pool.keys[0], await take(pool, exclude=pool.keys[0])
+
+    excluded, chosen = asyncio.run(scenario())
+    assert chosen is not excluded
+
+
+def test_single_key_is_not_paced():
+    async def scenario():
+        pool = ClientKeyPool(["aaaa"], requests_per_second=0.001, burst=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await take(pool)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.5
+
+
+def test_over_budget_keys_wait_at_most_max_wait():
+    async def scenario():
+        pool = ClientKeyPool(
+            ["aaaa", "bbbb"], requests_per_second=0.001, burst=1, max_wait=0.05
+        )
+        await take(pool)
+        await take(pool)
+        started = time.monotonic()
+        await take(pool)
+        return time.monotonic() - started
+
+    assert 0.04 <= asyncio.run(scenario()) < 0.5
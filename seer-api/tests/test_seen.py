@@ -0,0 +1,88 @@
+"""
+Tests for SeenSet and the `seen_ids_packed` wire format.
+
+Author: Runkai Zhang
+"""
+
+import random
+
+import pytest
+
+from app.services.seen import MAX_BITMAP_ID, SeenSet, pack_ids, unpack_ids
+
+
+def test_pack_round_trip_sorts_and_deduplicates():
+    ids = [5, 1, 300, 1, 70_000, 127, 128, 0]
+    assert unpack_ids(pack_ids(ids)) == sorted(set(ids))
+
+
+def test_pack_round_trip_random_ids():
+    rng = random.Random(7)
+    ids = rng.sample(range(1, 60_000), 5_000)
+    assert unpack_ids(pack_ids(ids)) == sorted(ids)
+
+
+def test_pack_is_unpadded_base64url():
+    packed = pack_ids(range(0, 10_000, 3))
+    assert "=" not in packed
+    assert set(packed) <= set(
+        "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+    )
+
+
+def test_pack_empty():
+    assert pack_ids([]) == ""
+    assert unpack_ids("") == []
+
+
+def test_varint_boundaries():
+    # Deltas of 127 and 128 take one and two bytes
+    assert pack_ids([127]) == "fw"
+    assert pack_ids([128]) == "gAE"
+    assert unpack_ids("gAE") == [128]
+
+
+@pytest.mark.parametrize("packed", ["!!", "gA", "gICAgICA"])
+def test_unpack_rejects_invalid_input(packed):
+    with pytest.raises(ValueError):
+        unpack_ids(packed)
+
+
+def test_seen_set_membership_and_overflow():
+    ids = [0, 1, 8, 9, MAX_BITMAP_ID - 1, MAX_BITMAP_ID, 10**9]
+    seen = SeenSet(ids + [1, 8])
+    assert len(seen) == len(ids)
+    assert list(seen) == sorted(ids)
+    for anime_id in ids:
+        assert anime_id in seen
+    assert 2 not in seen
+    assert -1 not in seen
+    assert "1" not in seen
+
+
+def test_seen_set_rejects_negative_ids():
+    with pytest.raises(ValueError):
+        SeenSet([-1])
+
+
+def test_seen_set_packed_round_trip():
+    seen = SeenSet([3, 99, 12_345, MAX_BITMAP_ID + 5])
+    assert list(SeenSet.from_packed(seen.to_packed())) == list(seen)
+
+
+def test_copy_is_independent():
+    seen = SeenSet([1, 2])
+    clone = seen.copy()
+    clone.add(3)
+    assert 3 not in seen
+    assert len(seen) == 2 and len(clone) == 3
+
+
+def test_update_with_seen_set_merges_bitmaps():
+    small = SeenSet([1, 2, MAX_BITMAP_ID + 1])
+    large = SeenSet([2, 50_000, MAX_BITMAP_ID + 2])
+    small.update(large)
+    assert list(small) == [1, 2, 50_000, MAX_BITMAP_ID + 1, MAX_BITMAP_ID + 2]
+    assert len(small) == 5
+    # The merged-in set is left unchanged
+    assert list(large) == [2, 50_000, MAX_BITMAP_ID + 2]
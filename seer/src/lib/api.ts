@@ -8,6 +8,7 @@ import type {
   RecommendResponse,
   RecommendationMode,
   SearchResponse,
+  TitleResolution,
 } from "./types";
 
 import { env } from "$env/dynamic/public";
@@ -98,6 +99,14 @@ function parseRateLimitHeaders(headers: Headers): RateLimitInfo | null {
   return null;
 }
 
+/**
+ * URL of an anime's poster, resized and cached by the API.
+ * Pass the rendered width in physical pixels (CSS width x device pixel ratio).
+ */
+export function posterUrl(malId: number, width: number): string {
+  return `${API_BASE_URL}/image/${malId}?w=${Math.round(width)}`;
+}
+
 /**
  * Search for anime by title
  */
@@ -137,6 +146,48 @@ export async function searchAnime(
   }
 }
 
+/**
+ * Match many titles (e.g. an imported watch list) to anime in one request.
+ * `onResult` is called for each title as soon as it is resolved, in
+ * completion order; use `index` to map results back to `titles`.
+ */
+export async function resolveTitles(
+  titles: string[],
+  onResult: (result: TitleResolution) => void,
+): Promise<void> {
+  const response = await fetch(`${API_BASE_URL}/resolve`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({ titles }),
+  });
+
+  if (!response.ok || !response.body) {
+    const error = await response.json().catch(() => ({}));
+    throw new APIError(
+      "Failed to resolve titles",
+      response.status,
+      error.detail || response.statusText,
+    );
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffered = "";
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += value;
+    const lines = buffered.split("\n");
+    buffered = lines.pop() ?? "";
+    for (const line of lines) {
+      if (!line) continue;
+      const message = JSON.parse(line);
+      if (!message.done) onResult(message as TitleResolution);
+    }
+  }
+}
+
 /**
  * Get a recommendation based on anime history
  */
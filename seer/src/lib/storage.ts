@@ -108,6 +108,32 @@ export function importHistory(file: File): Promise<AnimeHistoryItem[]> {
 	});
 }
 
+/**
+ * Read a plain-text watch list (one title per line)
+ */
+export function readTitleList(file: File): Promise<string[]> {
+	return new Promise((resolve, reject) => {
+		const reader = new FileReader();
+
+		reader.onload = (e) => {
+			const text = (e.target?.result as string) ?? '';
+			const titles = text
+				.split(/\r?\n/)
+				.map((line) => line.trim())
+				.filter((line) => line.length > 0);
+
+			if (titles.length === 0) {
+				reject(new Error('The title list is empty'));
+				return;
+			}
+			resolve(titles);
+		};
+
+		reader.onerror = () => reject(new Error('Failed to read file'));
+		reader.readAsText(file);
+	});
+}
+
 /**
  * Clear all history
  */
@@ -43,6 +43,15 @@ export interface SearchResponse {
   results: AnimeBase[];
 }
 
+export interface TitleResolution {
+  index: number;
+  title: string;
+  match: AnimeBase | null;
+  confidence: number;
+  source: "local" | "mal" | "none";
+  error?: string;
+}
+
 export interface AnimeHistory {
   anime_history: AnimeHistoryItem[];
 }
@@ -11,7 +11,8 @@ const config = {
     // adapter-auto only supports some environments, see https://svelte.dev/docs/kit/adapter-auto for a list.
     // If your environment is not supported, or you settled on a specific environment, switch out the adapter.
     // See https://svelte.dev/docs/kit/adapters for more information about adapters.
-    adapter: adapter(),
+    // precompress writes .br/.gz siblings that seer-api serves directly
+    adapter: adapter({ precompress: true }),
   },
 };
 